@@ -10,57 +10,155 @@ def _abstract():
     caller = inspect.getouterframes(inspect.currentframe())[1][3]
     raise NotImplementedError(caller + ' must be implemented in subclass')
 
-import random, math
-
-import util
-from game import BasicField
-from boxes import TickBox, BreakBox, Box, Special, Diamond
-
-def copy_box(box):
-    args = [box.color, [box.x, box.y]]
-    newbox = None
-    if isinstance(box, Box):
-        newbox = Box(*args)
-    elif isinstance(box, TickBox):
-        newbox = TickBox(*args)
-        newbox.time_left = box.time_left
-    elif isinstance(box, BreakBox):
-        newbox = BreakBox(*args)
-    elif isinstance(box, Special):
-        newbox = Special(box.color, [box.x, box.y], box.special)
-    elif isinstance(box, Diamond):
-        newbox = Diamond(box.color, [box.x, box.y])
-    return newbox
+import os, random, math, time
+
+from engine import BasicField, BoxGen, FallingPiece, TickBox, TICK
+from engine import freeze, thaw, debone
+from constants import angrydd_path, COLORS, LEFT, RIGHT, ROT_CW, ROT_CC
+
+# Python 2.6 and later can think in other processes.
+try: import multiprocessing
+except ImportError: multiprocessing = None
+
+# Rows of gems on their way to a player (see VersusPlayer.enqueue), as
+# AIField.boning has them: a tuple of rows, each a tuple with None or
+# (color, ticks left) for each column.
+def boning_rows(pending):
+    rows = []
+    for row in pending:
+        cells = []
+        for box in row:
+            if box: cells.append((box.color, box.time_left))
+            else: cells.append(None)
+        rows.append(tuple(cells))
+    return tuple(rows)
 
 class AIField(BasicField):
     def __init__(self, field):
         BasicField.__init__(self, field.width, field.height)
+        self._marks = []
+        # If boning isn't None, take_turn plays out the rows in it after
+        # the turn, as the game does: what broke cancels some of them
+        # (see VersusPlayer.deboning), the rest land, and sent adds up
+        # how much is sent back to the other player.
+        self.boning = getattr(field, "boning", None)
+        self.sent = 0
+        # How many times things broke in the last turn taken, as the
+        # game counts a chain.
+        self.chain = 0
         for y, row in enumerate(field):
             for x, box in enumerate(row):
-                if field[y][x] is not None:
-                    # Only add a box if we're at its topleft, i.e.
-                    # don't add merged boxes many times.
-                    newbox = copy_box(box)
-                    if isinstance(newbox, Box):
-                        if box.x != x or box.y != y: continue
-                        else: newbox.set_size(box.size, self)
-                    if newbox:
-                        self.add_box([newbox.x, newbox.y], newbox)
-
-    # Take a turn (move all pieces down, tick, merge, break, repeat)
-    # Doesn't do boning. Returns the value of gems broken.
+                # Only add a box if we're at its topleft, i.e.
+                # don't add merged boxes many times.
+                if box is not None and box.x == x and box.y == y:
+                    self.place(box.copy())
+
+    # Remember the field as it is now, so undo can put it back. Marks
+    # nest; each undo goes back to the most recent one. Rather than copy
+    # anything, we note each box the first time it's placed, removed or
+    # ticked after the mark, and how it was.
+    def mark(self):
+        self._marks.append(({}, self._dirty.copy(), self.max_gemsize,
+                            self.max_chain, self.boning, self.sent))
+
+    def _remember(self, box):
+        boxes = self._marks[-1][0]
+        if id(box) not in boxes:
+            if box.kind == TICK: ticks = box.time_left
+            else: ticks = None
+            boxes[id(box)] = (box, box.x, box.y, box.size[0], box.size[1],
+                              ticks, self._field[box.y][box.x] is box)
+
+    # Put the field back the way it was at the last mark. Boxes that
+    # were dropped in since then are taken off again, and get their old
+    # position and size back, so they can be dropped somewhere else.
+    # Boxes between turns are never crashed, so none of them are.
+    def undo(self):
+        boxes, dirty, gemsize, chain, boning, sent = self._marks.pop()
+        boxes = boxes.values()
+        # This is going back to how things were at an outer mark too, so
+        # it mustn't be remembered there.
+        for box, x, y, w, h, ticks, was_on in boxes:
+            BasicField.unplace(self, box)
+        for box, x, y, w, h, ticks, was_on in boxes:
+            box.x, box.y, box.size = x, y, [w, h]
+            box.crashed = False
+            if ticks is not None: box.time_left = ticks
+            if was_on: BasicField.place(self, box)
+        self._dirty = dirty
+        self.max_gemsize = gemsize
+        self.max_chain = chain
+        self.boning = boning
+        self.sent = sent
+
+    def place(self, box):
+        if self._marks: self._remember(box)
+        BasicField.place(self, box)
+
+    def unplace(self, box):
+        if self._marks and self._field[box.y][box.x] is box:
+            self._remember(box)
+        BasicField.unplace(self, box)
+
+    def tick(self):
+        if self._marks:
+            for t in self._tickers.values(): self._remember(t)
+        return BasicField.tick(self)
+
+    # Drop boxes in and take a turn, remembering how to take it back
+    # with unmake; returns the value of the gems broken. The boxes can
+    # be used again once the move is unmade.
+    def make(self, boxes, col, orientation):
+        self.mark()
+        self.drop(boxes, col, orientation)
+        return self.take_turn()
+
+    def unmake(self): self.undo()
+
+    # Take a turn (move all pieces down, tick, merge, break, repeat,
+    # then boning if we're doing that). Returns the value of gems broken.
     def take_turn(self):
-        while self.fall(): pass
+        self.settle()
         self.tick()
         while self.merge(): pass
         value, dead = self.breaking()
+        killed = value
+        chain = 0
         while len(dead) > 0:
-            while self.fall(): pass
+            self.settle()
             while self.merge(): pass
             newv, dead = self.breaking()
             value += newv
+            chain += 1
+            killed += newv * (1 + chain / 2.0)
+        self.chain = chain
+        if self.boning is not None: self._boning(int(killed))
         return value
 
+    # What Field's FIXING2, BONING and BONING2 states do at the end of a
+    # turn: cancel rows with what we broke (with engine.debone, as the
+    # game does), then drop the rest in a row at a time.
+    def _boning(self, value):
+        rows = []
+        for row in self.boning:
+            boxes = []
+            for cell in row:
+                if cell:
+                    box = TickBox(cell[0], [-1, -1])
+                    box.time_left = cell[1]
+                    boxes.append(box)
+                else: boxes.append(None)
+            rows.append(boxes)
+        self.boning = ()
+        self.sent += debone(rows, value)
+        if rows:
+            for row in rows:
+                for x, box in enumerate(row):
+                    if box is not None and self._field[0][x] is None:
+                        self.add_box([x, 0], box)
+                self.fall()
+            self.settle()
+
     def can_drop1(self, col):
         return (self._field[0][col] is None)
 
@@ -117,17 +215,9 @@ class AIField(BasicField):
             self.add_box([col, 0], box)
             return True
 
-    def get_height(self, col):
-        for y in range(self.height):
-            if self._field[y][col] != None: return self.height - y
-        else: return 0
-
-    def max_height(self):
-        return max([self.get_height(i) for i in range(self.width)])
-
     def average_height(self):
         s = 4 * self.get_height(3) # This is very bad to fill up
-        s += sum([self.get_height(x) for x in range(self.width)])
+        s += self.total_height()
         return s / self.width
 
     def stddev_height(self):
@@ -147,13 +237,14 @@ class AIField(BasicField):
         for col in columns:
             if self.can_drop1(col):
                 f = AIField(self)
-                newbox = copy_box(box)
+                newbox = box.copy()
                 f.drop1(newbox, col)
                 yield 0, col, f, [newbox]
 
-    # Expand the state space based on the boxes given. 4 orientations,
-    # width of 6 = 22 expansions (after illegal ones removed).
-    def expand(self, boxes, rand = True):
+    # The (orientation, column) pairs a piece can be dropped at. 4
+    # orientations, width of 6 = 22 moves (after illegal ones removed).
+    # Given the moves the piece can really get to (see plan), only those.
+    def moves(self, rand = True, reach = None):
         orientations = range(4)
         columns = range(self.width)
         if rand:
@@ -161,56 +252,348 @@ class AIField(BasicField):
             random.shuffle(columns)
             columns.remove(3); columns.append(3)
 
+        moves = []
         for orientation in orientations:
             for col in columns:
-                if self.can_drop(col, orientation):
-                    f = AIField(self)
-                    newboxes = [copy_box(b) for b in boxes]
-                    f.drop(newboxes, col, orientation)
-                    yield orientation, col, f, newboxes
+                if (self.can_drop(col, orientation) and
+                    (reach is None or (orientation, col) in reach)):
+                    moves.append((orientation, col))
+        return moves
+
+    # Expand the state space based on the boxes given, as new fields.
+    def expand(self, boxes, rand = True):
+        for orientation, col in self.moves(rand):
+            f = AIField(self)
+            newboxes = [b.copy() for b in boxes]
+            f.drop(newboxes, col, orientation)
+            yield orientation, col, f, newboxes
+
+# Where a piece at (x, y), in orientation orient, can be moved to by
+# the real rules (FallingPiece's), and how: a breadth-first search over
+# where it could be, which way round, and whether its boxes have been
+# swapped, so each place is found with the fewest keys pressed. Returns
+# {(orientation, column): keys} for the moves (as AIField.drop takes
+# them) it can make from somewhere above everything in the columns it
+# will fall down. A piece can sometimes be slid in under an overhang,
+# but we never try to. The piece falling while it's being moved isn't
+# taken into account; AIPlayer plans again after each key.
+def plan(field, x, y, orient, swapped = False):
+    piece = FallingPiece(1, 2, field)
+    presses = [(ROT_CC, piece.rot_cc), (LEFT, piece.go_left),
+               (RIGHT, piece.go_right), (ROT_CW, piece.rot_cw)]
+    start = (x, y, orient, 1 + int(bool(swapped)))
+    paths = {start: []}
+    queue = [start]
+    moves = {}
+    for state in queue:
+        _put(piece, state)
+        move = _landing(field, piece)
+        if move is not None and move not in moves: moves[move] = paths[state]
+        for key, press in presses:
+            _put(piece, state)
+            press()
+            new = (piece.x, piece.y, piece._orient, piece._box1)
+            if new not in paths:
+                paths[new] = paths[state] + [key]
+                queue.append(new)
+    return moves
+
+# Put piece where plan's state says; both boxes, since a swap changes
+# which is which.
+def _put(piece, state):
+    piece.x, piece.y, piece._orient, piece._box1 = state
+    piece._box2 = 3 - state[3]
+
+# The move a piece makes if it falls straight down from where it is, or
+# None if it's under something.
+def _landing(field, piece):
+    x, y, orient = piece.x, piece.y, piece._orient
+    if orient == 0: cells = [(x, y), (x, y - 1)]
+    elif orient == 1: cells = [(x, y), (x - 1, y)]
+    elif orient == 2: cells = [(x, y), (x, y + 1)]
+    else: cells = [(x, y), (x + 1, y)]
+    for cx, cy in cells:
+        if cy >= field.height - field.get_height(cx): return None
+    if piece._box1 == 1: return (orient, x)
+    # With the boxes swapped, it's the same as the other way up (or
+    # round) without.
+    elif orient == 0: return (2, x)
+    elif orient == 1: return (3, x - 1)
+    elif orient == 2: return (0, x)
+    else: return (1, x + 1)
+
+# Remembers the results of searches, keyed on the field's state_hash
+# and what was being searched for, so a position seen before (earlier
+# in this search, or on an earlier turn) isn't searched again. Holds at
+# most capacity entries, and forgets the least recently used first.
+class TranspositionTable(object):
+    def __init__(self, capacity = 20000):
+        self.capacity = capacity
+        self.hits = self.misses = self.evictions = 0
+        self._table = {}
+        # A circular doubly-linked list of [prev, next, key, value]
+        # nodes, most recently used first.
+        self._head = [None, None, None, None]
+        self._head[0] = self._head[1] = self._head
+
+    def __len__(self): return len(self._table)
+
+    def _unlink(self, node):
+        node[0][1] = node[1]
+        node[1][0] = node[0]
+
+    def _push(self, node):
+        head = self._head
+        node[0] = head
+        node[1] = head[1]
+        head[1][0] = node
+        head[1] = node
+
+    # The value stored for key, or None.
+    def get(self, key):
+        node = self._table.get(key)
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._unlink(node)
+        self._push(node)
+        return node[3]
+
+    def put(self, key, value):
+        node = self._table.get(key)
+        if node is not None:
+            node[3] = value
+            self._unlink(node)
+        else:
+            if len(self._table) >= self.capacity:
+                last = self._head[0]
+                self._unlink(last)
+                del(self._table[last[2]])
+                self.evictions += 1
+            node = [None, None, key, value]
+            self._table[key] = node
+        self._push(node)
+
+    def clear(self):
+        self._table = {}
+        self._head[0] = self._head[1] = self._head
+
+    # Hold at most capacity entries from now on, forgetting the least
+    # recently used ones if there are too many already.
+    def resize(self, capacity):
+        self.capacity = capacity
+        while len(self._table) > capacity:
+            last = self._head[0]
+            self._unlink(last)
+            del(self._table[last[2]])
+            self.evictions += 1
+
+    # Roughly how many bytes the table takes up, keys and values and
+    # everything in them (None if we can't tell, which is before Python
+    # 2.6). Anything shared, like the moves, is only counted once.
+    def memory(self):
+        try: from sys import getsizeof
+        except ImportError: return None
+        seen = {}
+        def size(obj):
+            if id(obj) in seen: return 0
+            seen[id(obj)] = True
+            total = getsizeof(obj)
+            if isinstance(obj, (tuple, list)):
+                for item in obj: total += size(item)
+            elif isinstance(obj, dict):
+                for key, value in obj.iteritems():
+                    total += size(key) + size(value)
+            return total
+        total = getsizeof(self._table)
+        for node in self._table.itervalues():
+            # Not the links to the other nodes, which get counted too.
+            total += getsizeof(node) + size(node[2]) + size(node[3])
+        return total
+
+    def hit_rate(self):
+        if self.hits + self.misses == 0: return 0.0
+        else: return self.hits / float(self.hits + self.misses)
+
+    # Everything report says, as numbers (e.g. to add up over games).
+    def stats(self):
+        return { "entries": len(self), "capacity": self.capacity,
+                 "hits": self.hits, "misses": self.misses,
+                 "evictions": self.evictions, "memory": self.memory() }
+
+    def report(self):
+        memory = self.memory()
+        if memory is None: memory = "?"
+        else: memory = "%dkB" % (memory / 1024)
+        return ("%d/%d entries, %.1f%% hits (%d of %d), %d evicted, %s" %
+                (len(self), self.capacity, 100 * self.hit_rate(), self.hits,
+                 self.hits + self.misses, self.evictions, memory))
 
 class AI(object):
+    # The most positions to remember (see resize_table).
+    table_size = 20000
+    # Whether to think about the rows on their way to us (see
+    # AIField.boning), if we're told about them.
+    garbage = False
+    # Attributes the player might change, that a worker needs to know.
+    SETTINGS = ["table_size"]
+
     def __init__(self, player):
         self.player = player
         self.insane = False
         self.drops = 70
         self.delta = 120
+        self.table = TranspositionTable(self.table_size)
+        self.plans = TranspositionTable(1000)
+        self.at = self.reach = None
+
+    # Remember at most size positions from now on; workers pick this up
+    # as a setting.
+    def resize_table(self, size):
+        self.table_size = size
+        self.table.resize(size)
+
+    # The transposition table key for searching field for where to put
+    # boxes, scored by h; how is anything else the result depends on.
+    def _key(self, field, boxes, h, *how):
+        return ((field.state_hash, getattr(h, "__name__", None),
+                 getattr(field, "boning", None)) +
+                tuple([(b.kind, b.color) for b in boxes]) + how)
 
-    # Expand and find the highest value for the given callback; it
-    # defaults to the value of the gems broken if no callback is
-    # passed in.
+    # Try every move and find the highest value for the given callback;
+    # it defaults to the value of the gems broken if no callback is
+    # passed in. Moves are made and unmade on our one field.
     def find_high(self, h = (lambda *args: args[1])):
+        key = self._key(self.field, self.falling, h, True, self.at)
+        found = self.table.get(key)
+        if found is not None:
+            yield found[1]
+            return
         best_score = None
         best_move = (0, 0)
-        for orient, col, field, boxes in self.field.expand(self.falling):
-            fscore = field.take_turn()
+        field = self.field
+        boxes = [b.copy() for b in self.falling]
+        for orient, col in field.moves(reach = self.reach):
+            fscore = field.make(boxes, col, orient)
             score = h(orient, col, field, boxes, fscore)
+            field.unmake()
             if best_score is None or score > best_score:
                 best_score = score
                 best_move = (orient, col)
             yield None
+        self.table.put(key, (best_score, best_move))
         yield best_move
         return
 
-    # Expand and find the lowest value for the given callback; if
+    # Try every move and find the lowest value for the given callback; if
     # the value is 0, it returns it and doesn't expand anymore.
     def find_low(self, h, halt_on_zero = True):
+        key = self._key(self.field, self.falling, h, False, halt_on_zero,
+                        self.at)
+        found = self.table.get(key)
+        if found is not None:
+            yield found[1]
+            return
         best_score = None
         best_move = (0, 0)
-        for orient, col, field, boxes in self.field.expand(self.falling):
-            fscore = field.take_turn()
+        field = self.field
+        boxes = [b.copy() for b in self.falling]
+        for orient, col in field.moves(reach = self.reach):
+            fscore = field.make(boxes, col, orient)
             score = h(orient, col, field, boxes, fscore)
+            field.unmake()
             if best_score is None or score < best_score:
                 best_score = score
                 best_move = (orient, col)
             if best_score == 0 and halt_on_zero: break
             yield None
+        self.table.put(key, (best_score, best_move))
         yield best_move
         return
 
-    def incoming(self, field, falling):
+    # A new piece is falling; nextpiece is the one after it, if we
+    # get to know that.
+    def incoming(self, field, falling, nextpiece = None):
+        if nextpiece: nextpiece = [nextpiece._box1, nextpiece._box2]
+        self.setup(field, [falling._box1, falling._box2], nextpiece,
+                   (falling.x, falling.y, falling._orient),
+                   _player_boning(self.player))
+
+    # The same, given the boxes of each piece, and where the falling
+    # one is (x, y, orientation), if we know; then we only think about
+    # the moves it can get to. boning is the rows coming at us, as
+    # boning_rows gives them, if we know.
+    def setup(self, field, falling, nextpiece = None, at = None,
+              boning = None):
         self.field = AIField(field)
-        self.falling = [falling._box1, falling._box2]
+        if self.garbage: self.field.boning = tuple(boning or ())
+        self.falling = falling
+        self.next = nextpiece
+        self.at = at
+        if at is None: self.reach = None
+        else: self.reach = self.plan(field, at)
+
+    # plan(field, *at), remembered for as long as the field stays the
+    # same.
+    def plan(self, field, at):
+        key = (field.state_hash, field.width, field.height) + tuple(at)
+        moves = self.plans.get(key)
+        if moves is None:
+            moves = plan(field, *at)
+            self.plans.put(key, moves)
+        return moves
+
+    # The keys to press to get the falling piece to where move puts it
+    # (fewest first), or None if it can't get there. box1 was the
+    # piece's first box when the move was decided on; rotating it
+    # might have swapped them since.
+    def route(self, field, falling, move, box1):
+        at = (falling.x, falling.y, falling._orient, falling._box1 is not box1)
+        return self.plan(field, at).get(tuple(move))
+
+    # Start thinking about the falling boxes landing on field at (x, y,
+    # orientation), before we know what comes after them (if speculates
+    # is set; otherwise there's no point); returns an iterator like
+    # iter(self). Unless looks_ahead is set, the move it comes up with
+    # is the one we'd make anyway, so it can be used as it is if that's
+    # how things turn out (see situation); if it is set, thinking now
+    # only saves some time later.
+    speculates = True
+    looks_ahead = False
+
+    def speculate(self, field, falling, at):
+        self.setup(field, falling, None, at)
+        return iter(self)
+
+    # Where the opening book (see book.py) says to go, if it has this
+    # position for us and the piece can get there.
+    def from_book(self):
+        book = opening_book()
+        if book is None or self.next is None or self.field.boning: return None
+        move = book.get(self.__class__.__name__, self.field, self.falling,
+                        self.next)
+        if move is None or not self.field.can_drop(move[1], move[0]):
+            return None
+        elif self.reach is not None and move not in self.reach: return None
+        else: return move
+
+    # Whether a position on field might be in the book, so it's no use
+    # thinking about it before we know the piece after.
+    def in_book(self, field):
+        book = opening_book()
+        return (book is not None and self.__class__.__name__ in book.names
+                and field.max_height() <= book.height)
+
+    # Something to tell whether two positions are the same to us.
+    def situation(self, field, falling, at):
+        return self._key(field, falling, None, tuple(at))
+
+    # Think until we know where to go, without giving anyone else a turn.
+    def decide(self):
+        for move in self:
+            if move is not None: return move
+        return (0, 0)
 
     def __iter__(self):
         # Override this function to change how the AI moves. It should
@@ -257,7 +640,7 @@ class RandomAI(AI):
     def __iter__(self):
         yield None
         yield (random.randrange(0, 4),
-               random.randrange(0, self.player.field.width))
+               random.randrange(0, self.field.width))
 
 # Another test AI, just tries to keep average field height low
 class KeepLowAI(AI):
@@ -265,33 +648,49 @@ class KeepLowAI(AI):
         return self.find_low(self._total_height)
 
     def _total_height(self, orient, col, field, boxes, score):
-        return sum([field.get_height(x) for x in range(field.width)])
+        return field.total_height()
 
+# GoodAI plays by a handful of numbers. They're class attributes, so a
+# subclass (or a profile, see load_profiles) can play by others, and
+# WEIGHTS lists them for tuning.py to tune.
 class GoodAI(AI):
+    emergency = 8     # The middle column is too tall above this.
+    too_high = 9      # Bring the tallest column down when it's above this.
+    build_below = 7   # Build big gems when the average height is below this.
+    safe_height = 10  # The tallest column is safe below this.
+    big_break = 25    # Breaking more than this beats anything else.
+    same_color = 3    # Each box touching one of its color is worth this,
+    other_color = -1  # and each touching another color this.
+
+    WEIGHTS = ["emergency", "too_high", "build_below", "safe_height",
+               "big_break", "same_color", "other_color"]
+
     def __iter__(self):
-        if self.field.get_height(3) > 8:
+        move = self.from_book()
+        if move is not None: return iter([move])
+        elif self.field.get_height(3) > self.emergency:
             return self.find_low(self._emergency)
-        elif self.field.max_height() > 9:
+        elif self.field.max_height() > self.too_high:
             return self.find_high(self._lower_max)
-        elif self.field.average_height() < 7:
+        elif self.field.average_height() < self.build_below:
             return self.find_high(self._form_boxes)
         else:
             return self.find_high()
 
     def _emergency(self, orient, col, field, boxes, score):
-        return (score > 25, field.get_height(3), score)
+        return (score > self.big_break, field.get_height(3), score)
 
     def _lower_max(self, orient, col, field, boxes, score):
         return (
-            score > 25,
+            score > self.big_break,
             -field.max_height(),
             score,
             self._gemsize(field))
 
     def _form_boxes(self, orient, col, field, boxes, score):
         return (
-            score > 25,
-            field.max_height() < 10,
+            score > self.big_break,
+            field.max_height() < self.safe_height,
             self._gemsize(field),
             self._adjacencies(field, boxes))
 
@@ -300,14 +699,355 @@ class GoodAI(AI):
         for box in filter(None, boxes):
             if not box.crashed:
                 for adjbox in filter(None, box.adjacent(field)):
-                    if adjbox.color == box.color: adj += 3
-                    else: adj -= 1
+                    if adjbox.color == box.color: adj += self.same_color
+                    else: adj += self.other_color
         return adj
 
-    def _gemsize(self, field):
-        return max([1] + [box.size[0] * box.size[1]
-                          for box in util.flatten(field)
-                          if box])
+    def _gemsize(self, field): return field.largest_gem()
+
+# Looks at where the next piece could go as well as this one: GoodAI's
+# heuristics, but scored on the field after both pieces land. To keep
+# it quick, only the best few first moves (by how they look on their
+# own) get a second look, best first, and it thinks for at most a few
+# milliseconds each time the player asks it for a move.
+#
+# Given a deadline it's an anytime search, going a piece deeper while
+# there's time: first it scores every first move on its own, then it
+# scores them by the best reply with the next piece. If time runs out
+# before that second pass is done, it goes with the first pass's best
+# move rather than the best of the ones it got to. Pieces after the
+# next one aren't known, so it never looks more than two deep; a fast
+# machine finishes the second pass more often and a slow one less,
+# rather than either one taking a different number of frames to move.
+class LookaheadAI(GoodAI):
+    beam = 8         # How many first moves to look past (None for all).
+    think = 0.004    # Seconds to think per frame.
+    deadline = None  # Seconds to think per move, if there's a limit.
+    looks_ahead = True
+    garbage = True
+
+    def __iter__(self):
+        move = self.from_book()
+        if move is not None: return iter([move])
+        elif self.field.get_height(3) > self.emergency:
+            return self.search(self._emergency, False)
+        elif self.field.max_height() > self.too_high:
+            return self.search(self._lower_max)
+        elif self.field.average_height() < self.build_below:
+            return self.search(self._form_boxes)
+        else: return self.search(self._broken)
+
+    def _broken(self, orient, col, field, boxes, score): return score
+
+    # Search both pieces for the highest (or lowest) value of h. For the
+    # second piece h is given its boxes and the value broken by both, so
+    # the best reply depends only on the field after the first move (and
+    # what that broke), and goes in the transposition table. Searches
+    # cut short by the deadline aren't remembered.
+    def search(self, h, high = True):
+        pieces = self.falling + (self.next or [])
+        key = self._key(self.field, pieces, h, high, self.beam, self.at)
+        found = self.table.get(key)
+        if found is not None:
+            yield found[1]
+            return
+        field = self.field
+        first = [b.copy() for b in self.falling]
+        if high: better = lambda a, b: b is None or a > b
+        else: better = lambda a, b: b is None or a < b
+        now = time.time()
+        end = now + self.think
+        if self.deadline is None: stop = None
+        else: stop = now + self.deadline
+        out_of_time = False
+
+        # Order the first moves by how good they look alone. That
+        # doesn't depend on the next piece, so it's remembered on its
+        # own (and can be worked out before we know it; see speculate).
+        rank_key = self._key(field, self.falling, h, high, self.at, "rank")
+        ranked = self.table.get(rank_key)
+        if ranked is None:
+            ranked = []
+            for orient, col in field.moves(reach = self.reach):
+                value = field.make(first, col, orient)
+                ranked.append((h(orient, col, field, first, value), value,
+                               (orient, col)))
+                field.unmake()
+                now = time.time()
+                if stop is not None and now > stop:
+                    out_of_time = True
+                    break
+                elif now > end:
+                    yield None
+                    end = time.time() + self.think
+            ranked.sort()
+            if high: ranked.reverse()
+            if not out_of_time: self.table.put(rank_key, ranked)
+        if not ranked:
+            yield (0, 0)
+            return
+
+        # The best move one piece deep, and what we fall back on if
+        # we can't finish looking two deep.
+        best_score = None
+        best_move = first_best = ranked[0][2]
+        if self.next is None or out_of_time: ranked = []
+        else: second = [b.copy() for b in self.next]
+        for alone, value, (orient, col) in ranked[:self.beam]:
+            field.make(first, col, orient)
+            reply_key = self._key(field, second, h, high, value)
+            reply = self.table.get(reply_key)
+            if reply is None:
+                reply = (None, None)
+                for orient2, col2 in field.moves():
+                    value2 = field.make(second, col2, orient2)
+                    score = h(orient2, col2, field, second, value + value2)
+                    field.unmake()
+                    if better(score, reply[0]):
+                        reply = (score, (orient2, col2))
+                    now = time.time()
+                    if stop is not None and now > stop:
+                        out_of_time = True
+                        break
+                    elif now > end:
+                        yield None
+                        end = time.time() + self.think
+                if not out_of_time: self.table.put(reply_key, reply)
+            field.unmake()
+            if out_of_time: break
+            # No reply at all means the first move loses.
+            elif reply[1] is not None and better(reply[0], best_score):
+                best_score = reply[0]
+                best_move = (orient, col)
+        if out_of_time: yield first_best
+        else:
+            self.table.put(key, (best_score, best_move))
+            yield best_move
+
+# LookaheadAI with a time limit instead of a beam.
+class AnytimeAI(LookaheadAI):
+    beam = None
+    deadline = 0.5
+
+# Monte Carlo tree search: rather than scoring each move by a rule of
+# thumb, it plays lots of quick games on from each one and keeps the
+# moves that work out best. Each playout goes down the tree of moves
+# tried before, picking the ones that have done well (or haven't been
+# tried much) at each step, adds one new move to the tree, then plays
+# on past it, a bit at random, for a piece or so. Pieces we don't know
+# yet are made up, and so, now and then, are rows of gems from the
+# other player, in their character's pattern, on top of the rows
+# already on their way. A playout scores what it broke, less how tall
+# the field ended up; losing scores much worse.
+#
+# It thinks for deadline seconds a move, a few milliseconds a frame,
+# and grows the tree to at most max_nodes moves. Thinking in a worker
+# process, it doesn't know who the other player is, so it only
+# expects the rows it's been sent already.
+class MCTSAI(AI):
+    deadline = 0.5      # Seconds to think per move.
+    think = 0.004       # Seconds to think per frame.
+    max_nodes = 20000   # The most moves to keep in the tree.
+    depth = 1           # Pieces to play past the tree,
+    tries = 3           # each in the best of this many random places.
+    explore = 4.0       # How much to try moves that haven't been much.
+    pressure = 0.2      # The chance of rows coming in after each piece.
+    lost = -100.0       # The score of a playout that loses.
+    garbage = True
+    SETTINGS = AI.SETTINGS + ["deadline", "max_nodes"]
+    # Every playout starts from scratch, so there's nothing to save.
+    speculates = False
+    looks_ahead = True
+
+    def __init__(self, *args):
+        AI.__init__(self, *args)
+        self.rand = random.Random()
+        self.nodes = 0
+
+    def __iter__(self):
+        player = self.player
+        colors = getattr(player, "colors", None) or COLORS[:4]
+        self._gen = BoxGen(self.rand, colors, False, False)
+        self._pattern = _their_pattern(player)
+        return self.search()
+
+    # A tree node is [visits, total score, {move: node}].
+    def search(self):
+        root = [0, 0.0, {}]
+        self.nodes = 1
+        now = time.time()
+        end = now + self.think
+        stop = now + self.deadline
+        while now < stop:
+            self._playout(root)
+            now = time.time()
+            if now > end:
+                yield None
+                end = time.time() + self.think
+        best = None
+        for move, node in root[2].items():
+            if best is None or node[0] > best[0]: best = (node[0], move)
+        if best is None: yield (0, 0)
+        else: yield best[1]
+
+    def _playout(self, root):
+        field = self.field
+        # make moves the boxes it drops, so never the player's own.
+        pieces = [[b.copy() for b in self.falling]]
+        if self.next: pieces.append([b.copy() for b in self.next])
+        path = [root]
+        node = root
+        placed = 0
+        score = 0.0
+        alive = True
+        # Down the tree, until a move that wasn't in it.
+        while alive:
+            if placed == 0: moves = field.moves(False, self.reach)
+            else: moves = field.moves(False)
+            if not moves:
+                alive = False
+                break
+            move, child, new = self._choose(node, moves)
+            boxes = self._piece(pieces, placed)
+            score += field.make(boxes, move[1], move[0])
+            placed += 1
+            alive = self._incoming()
+            if child is not None: path.append(child)
+            if child is None or new: break
+            node = child
+        # Then a few more pieces, each put in the best of a few places
+        # picked at random.
+        for i in range(self.depth):
+            if not alive: break
+            moves = field.moves(False)
+            if not moves:
+                alive = False
+                break
+            boxes = self._piece(pieces, placed)
+            best = None
+            for j in range(self.tries):
+                orient, col = self.rand.choice(moves)
+                value = field.make(boxes, col, orient)
+                field.unmake()
+                if best is None or value > best[0]: best = (value, orient, col)
+            score += field.make(boxes, best[2], best[1])
+            placed += 1
+            alive = self._incoming()
+        if alive: score -= field.max_height() + field.get_height(3)
+        else: score += self.lost
+        # Each piece and what came in after it was made separately.
+        for i in range(2 * placed): field.unmake()
+        for node in path:
+            node[0] += 1
+            node[1] += score
+
+    # The move to try next from node, by UCB1: any that hasn't been
+    # tried yet first, which is added to the tree if there's room.
+    # Returns the move, its node (None if it didn't fit), and whether
+    # it's new.
+    def _choose(self, node, moves):
+        children = node[2]
+        best = None
+        log = math.log(node[0] + 1)
+        for move in moves:
+            child = children.get(move)
+            if child is None:
+                if self.nodes >= self.max_nodes: return move, None, True
+                child = children[move] = [0, 0.0, {}]
+                self.nodes += 1
+                return move, child, True
+            value = (child[1] / child[0] +
+                     self.explore * math.sqrt(log / child[0]))
+            if best is None or value > best[0]: best = (value, move, child)
+        return best[1], best[2], False
+
+    # The boxes of the nth piece from now, made up if we don't know.
+    def _piece(self, pieces, n):
+        if n < len(pieces): return pieces[n]
+        else: return [self._gen.get([-1, -1]), self._gen.get([-1, -1])]
+
+    # Make up some rows coming in after the piece just placed, now and
+    # then; they land after the next one (see AIField.boning). Like make,
+    # it has to be unmade. Returns False if we've lost.
+    def _incoming(self):
+        field = self.field
+        field.mark()
+        if self._pattern and self.rand.random() < self.pressure:
+            rows = self._pattern.multiply(self.rand.randrange(2, 12))
+            field.boning += tuple([tuple([(c and (c, 5)) for c in row])
+                                   for row in rows])
+        return field[0][int(field.width / 2)] is None
+
+# The rows on their way to player, if it has any.
+def _player_boning(player):
+    return boning_rows(getattr(player, "_pending_boning", None) or [])
+
+# The DropPattern whoever player is playing against sends gems in, if
+# we know.
+def _their_pattern(player):
+    for other in getattr(player, "others", []):
+        # Headless players (see tournament.py) keep it themselves.
+        drop = getattr(other, "drop", None)
+        if drop is None: drop = getattr(other.char, "drop", None)
+        if drop is not None: return drop
+    return None
+
+# Thinking in a pool of worker processes. The field and pieces go out
+# as plain tuples and the move comes back; each worker keeps one AI of
+# each class it's asked for, so their transposition tables last.
+_pool = None
+_workers = None
+_ais = {}
+
+# The pool, started the first time it's needed; None if there isn't
+# one (no multiprocessing, or workers is 0).
+def pool(workers = None):
+    global _pool, _workers
+    if multiprocessing is None or workers == 0: return None
+    elif _pool is None or (workers is not None and workers != _workers):
+        if _pool is not None: _pool.terminate()
+        _pool = multiprocessing.Pool(workers)
+        _workers = workers
+    return _pool
+
+def _decide(name, settings, width, height, boxes, falling, nextpiece, at,
+            boning):
+    ai = _ais.get(name)
+    if ai is None: ai = _ais[name] = globals()[name](None)
+    for key, value in settings: setattr(ai, key, value)
+    ai.table.resize(ai.table_size)
+    field = BasicField(width, height)
+    for state in boxes: field.place(thaw(state))
+    if nextpiece is not None: nextpiece = map(thaw, nextpiece)
+    ai.setup(field, map(thaw, falling), nextpiece, at, boning)
+    return ai.decide()
+
+# Start ai thinking about field and pieces in the pool, like
+# ai.incoming; returns something to poll with ready() and get(), or
+# None if there's no pool.
+def decide_async(ai, field, falling, nextpiece = None, workers = None):
+    if nextpiece: nextpiece = [nextpiece._box1, nextpiece._box2]
+    return setup_async(ai, field, [falling._box1, falling._box2], nextpiece,
+                       (falling.x, falling.y, falling._orient), workers,
+                       _player_boning(ai.player))
+
+# The same, given the boxes of each piece, like ai.setup.
+def setup_async(ai, field, falling, nextpiece, at, workers = None,
+                boning = None):
+    p = pool(workers)
+    if p is None: return None
+    boxes = []
+    for y, row in enumerate(field):
+        for x, box in enumerate(row):
+            if box is not None and box.x == x and box.y == y:
+                boxes.append(freeze(box))
+    falling = map(freeze, falling)
+    if nextpiece: nextpiece = map(freeze, nextpiece)
+    else: nextpiece = None
+    settings = [(key, getattr(ai, key)) for key in ai.SETTINGS]
+    return p.apply_async(_decide, (ai.__class__.__name__, settings,
+                                   field.width, field.height, boxes,
+                                   falling, nextpiece, at, boning))
 
 class StupidAI(RandomAI, SlowAI): pass
 class VeryEasyAI(KeepLowAI, SlowAI): pass
@@ -315,3 +1055,85 @@ class EasyAI(KeepLowAI, MediumAI): pass
 class NormalAI(GoodAI, MediumAI): pass
 class HardAI(GoodAI, FastAI): pass
 class InsaneAI(GoodAI, SuperFastAI): pass
+class ExpertAI(AnytimeAI, SuperFastAI): pass
+class MasterAI(MCTSAI, SuperFastAI): pass
+
+# Profiles are AIs that play like another AI class but by different
+# numbers (usually tuned ones, from tuning.py), kept in a ConfigParser
+# file; each section is a new AI class, e.g.
+#   [TunedAI]
+#   base = InsaneAI
+#   emergency = 7.5
+# Any number not given stays as the base class has it.
+
+# An AI class called name, playing like the class called base but by
+# the given {name: number} weights.
+def profile(name, base, weights):
+    cls = globals().get(base)
+    if not (isinstance(cls, type) and issubclass(cls, AI)):
+        raise ValueError("%s isn't an AI" % base)
+    for key in weights:
+        if key not in GoodAI.WEIGHTS or not issubclass(cls, GoodAI):
+            raise ValueError("%s has no weight called %s" % (base, key))
+    return type(name, (cls,), dict(weights))
+
+# Make the AIs in a profiles file, so they can be used like the ones
+# above; returns their names. Profiles with no base, a base that isn't
+# an AI here, or numbers that aren't numbers, are left out.
+def load_profiles(filename):
+    from ConfigParser import ConfigParser, Error
+    parser = ConfigParser()
+    parser.optionxform = str
+    parser.read([filename])
+    names = []
+    for name in parser.sections():
+        try:
+            weights = {}
+            for key, value in parser.items(name):
+                if key != "base": weights[key] = float(value)
+            cls = profile(name, parser.get(name, "base"), weights)
+        except (Error, ValueError): continue
+        globals()[name] = cls
+        names.append(name)
+    return names
+
+# Write an AI's weights to a profiles file as a profile of base,
+# replacing any profile of the same name already there.
+def save_profile(filename, name, base, weights):
+    from ConfigParser import ConfigParser
+    parser = ConfigParser()
+    parser.optionxform = str
+    parser.read([filename])
+    if parser.has_section(name): parser.remove_section(name)
+    parser.add_section(name)
+    parser.set(name, "base", base)
+    for key in GoodAI.WEIGHTS:
+        if key in weights: parser.set(name, key, repr(weights[key]))
+    f = file(filename, "w")
+    try: parser.write(f)
+    finally: f.close()
+
+# The profiles in PROFILES, which the game offers after its own AIs. A
+# file that can't be read at all is skipped, as a bad book is.
+PROFILES = os.path.join(angrydd_path, "ai-profiles")
+PROFILE_NAMES = []
+if os.path.exists(PROFILES):
+    from ConfigParser import Error
+    try: PROFILE_NAMES = load_profiles(PROFILES)
+    except (EnvironmentError, Error): pass
+    del(Error)
+
+# The opening book, if one's been made (see book.py); it's opened the
+# first time an AI looks in it.
+BOOK = os.path.join(angrydd_path, "ai-book")
+_book = None
+
+def opening_book():
+    global _book
+    if _book is None:
+        _book = False
+        if os.path.exists(BOOK):
+            import book
+            try: _book = book.Book(BOOK)
+            except (EnvironmentError, ValueError): pass
+    return _book or None
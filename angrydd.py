@@ -154,6 +154,7 @@ def setup(menu_, platform, pos, key):
         (config.get_speed(), menu.entry(config.set_speed)),
         (config.get_rotup(), menu.entry(config.set_rotup)),
         (config.get_space(), menu.entry(config.set_space)),
+        (config.get_hints(), menu.entry(config.set_hints)),
 
         ("Back", menu.break_menu)
         ]
@@ -238,7 +239,7 @@ if __name__ == "__main__":
     elif double_ai:
         # Hack to run two AIs versus each other; use --double-ai AI1,Ai2
         # on the command line. Bypasses main(), very buggy, for testing
-        # use only.
+        # use only. tournament.py plays AIs against each other headless.
         init()
         ai1, ai2 = sys.argv[sys.argv.index("--double-ai") + 1].split(",")
         game.AIGame([Character.available[0], Character.available[0]],
@@ -0,0 +1,272 @@
+# batch.py -- many playing fields at once, as NumPy arrays
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# A BatchField holds N boards of the same size in the same planes as a
+# PlaneField (see planes.py), but as [N, height, width] arrays, and runs
+# a turn on all of them together. Falling (for boards without crystals),
+# ticking and labelling what breaks are done for every board in a few
+# array operations; merging, and boards with crystals or diamonds on
+# them, fall back to a PlaneField for that board. The results are the
+# same as taking a turn on each board with AIField or PlaneField.
+#
+# So scoring all the placements from AIField.expand is
+#   BatchField.from_fields([f for o, c, f, b in field.expand(boxes)])
+# followed by one take_turn.
+#
+# NumPy is optional; without it this module imports, but making a
+# BatchField raises ImportError.
+
+import array
+
+try: import numpy
+except ImportError: numpy = None
+
+from engine import EMPTY, BOX, BREAK, DIAMOND, TICK
+from planes import PlaneField
+
+# The planes, in the order PlaneField has them.
+PLANES = ["color", "kind", "crystal", "cw", "ch", "extra"]
+
+class BatchField(object):
+    def __init__(self, count, width, height):
+        if numpy is None:
+            raise ImportError("BatchField needs NumPy (python-numpy), which "
+                              "isn't installed; nothing else in the game "
+                              "uses it")
+        self.width = width
+        self.height = height
+        shape = (count, height, width)
+        self.color = numpy.empty(shape, numpy.int8)
+        self.color.fill(-1)
+        self.kind = numpy.zeros(shape, numpy.int8)
+        self.crystal = numpy.empty(shape, numpy.int16)
+        self.crystal.fill(-1)
+        self.cw = numpy.zeros(shape, numpy.int8)
+        self.ch = numpy.zeros(shape, numpy.int8)
+        self.extra = numpy.zeros(shape, numpy.int8)
+        self.max_gemsize = numpy.zeros(count, numpy.int32)
+
+    # Build a batch from a list of fields (BasicFields, or anything else
+    # PlaneField.from_field takes, or PlaneFields) of the same size.
+    def from_fields(cls, fields):
+        batch = cls(len(fields), fields[0].width, fields[0].height)
+        for n, field in enumerate(fields):
+            if not isinstance(field, PlaneField):
+                field = PlaneField.from_field(field)
+            batch.set_field(n, field)
+        return batch
+
+    from_fields = classmethod(from_fields)
+
+    def __len__(self): return len(self.kind)
+
+    # A copy of board n as a PlaneField.
+    def field(self, n):
+        planes = PlaneField(self.width, self.height)
+        for name in PLANES:
+            plane = getattr(planes, name)
+            setattr(planes, name, array.array(
+                plane.typecode, getattr(self, name)[n].tostring()))
+        planes.max_gemsize = int(self.max_gemsize[n])
+        return planes
+
+    # Replace board n with the contents of a PlaneField.
+    def set_field(self, n, planes):
+        for name in PLANES:
+            plane = getattr(self, name)
+            plane[n] = numpy.frombuffer(getattr(planes, name),
+                                        plane.dtype).reshape(plane.shape[1:])
+        self.max_gemsize[n] = planes.max_gemsize
+
+    # Which boards to work on: all of them, or the given indices.
+    def _boards(self, boards):
+        if boards is None: return numpy.arange(len(self))
+        else: return numpy.asarray(boards, numpy.intp)
+
+    # Run fn on a PlaneField copy of each board in boards and store
+    # the result back; returns what fn returned for each one.
+    def _each(self, boards, fn):
+        results = []
+        for n in boards:
+            planes = self.field(n)
+            results.append(fn(planes))
+            self.set_field(n, planes)
+        return results
+
+    # The number of each cell, as PlaneField numbers them.
+    def _cells(self):
+        cells = numpy.arange(self.width * self.height, dtype = numpy.int16)
+        return cells.reshape(self.height, self.width)
+
+    # Whether each board in a [N, height, width] array of flags has
+    # any flag set.
+    def _any(self, cells):
+        return cells.any(2).any(1)
+
+    # Drop everything as far as it will go. Boards with nothing above
+    # an empty cell are already settled. Without crystals every column
+    # just packs down, keeping its order, so that's a stable sort of
+    # each column with the empty cells first.
+    def settle(self, boards = None):
+        boards = self._boards(boards)
+        full = (self.kind[boards] != EMPTY)
+        boards = boards[self._any(full[:, :-1] & ~full[:, 1:])]
+        crystals = self._any(self.cw[boards] > 1)
+        simple = boards[~crystals]
+        if len(simple):
+            order = numpy.argsort(self.kind[simple] != EMPTY, axis = 1,
+                                  kind = "mergesort")
+            n = numpy.arange(len(simple))[:, None, None]
+            x = numpy.arange(self.width)[None, None, :]
+            for name in PLANES:
+                plane = getattr(self, name)
+                plane[simple] = plane[simple][n, order, x]
+            self.crystal[simple] = numpy.where(self.kind[simple] != EMPTY,
+                                               self._cells(), -1)
+        self._each(boards[crystals], PlaneField.settle)
+
+    # Tick every ticking box; ones that run out become normal boxes.
+    # Returns how many boxes ticked, and how many ran out, per board.
+    def tick(self, boards = None):
+        boards = self._boards(boards)
+        kind = self.kind[boards]
+        extra = self.extra[boards]
+        ticking = (kind == TICK)
+        extra[ticking] -= 1
+        expired = ticking & (extra == 0)
+        kind[expired] = BOX
+        self.kind[boards] = kind
+        self.extra[boards] = extra
+        return (ticking.sum(2).sum(1),
+                expired.sum(2).sum(1))
+
+    # Merge gems until nothing more will merge. Only boards with a 2x2
+    # square of one color of 1x1 boxes, or a crystal with a box of its
+    # color (that isn't part of it) beside it, can merge at all; the
+    # rest are left alone.
+    def merge(self, boards = None):
+        boards = self._boards(boards)
+        color = self.color[boards]
+        box = (self.kind[boards] == BOX)
+        small = box & (self.cw[boards] == 1)
+        c = color[:, :-1, :-1]
+        square = (small[:, :-1, :-1] & small[:, :-1, 1:] &
+                  small[:, 1:, :-1] & small[:, 1:, 1:] &
+                  (c == color[:, :-1, 1:]) & (c == color[:, 1:, :-1]) &
+                  (c == color[:, 1:, 1:]))
+        big = box & (self.cw[boards] > 1)
+        crystal = self.crystal[boards]
+        grow = (box[:, :-1] & box[:, 1:] & (big[:, :-1] | big[:, 1:]) &
+                (color[:, :-1] == color[:, 1:]) &
+                (crystal[:, :-1] != crystal[:, 1:]))
+        could = self._any(square) | self._any(grow)
+        grow = (box[:, :, :-1] & box[:, :, 1:] &
+                (big[:, :, :-1] | big[:, :, 1:]) &
+                (color[:, :, :-1] == color[:, :, 1:]) &
+                (crystal[:, :, :-1] != crystal[:, :, 1:]))
+        could |= self._any(grow)
+        def merge_all(planes):
+            while planes.merge(): pass
+        self._each(boards[could], merge_all)
+
+    # Break everything that will break. A break gem with a neighbour of
+    # its own color breaks the whole same-colored region it's in (ticking
+    # boxes don't join regions), and any ticking box touching that region.
+    # Regions are labelled by spreading the smallest cell number through
+    # each one until nothing changes. Returns the value of what broke and
+    # how many gems broke, per board.
+    def breaking(self, boards = None):
+        boards = self._boards(boards)
+        value = numpy.zeros(len(boards))
+        dead = numpy.zeros(len(boards), numpy.int32)
+
+        diamonds = self._any(self.kind[boards] == DIAMOND)
+        def breaking(planes):
+            killed_count, cells = planes.breaking()
+            return killed_count, len(cells)
+        for i, (v, d) in zip(numpy.nonzero(diamonds)[0],
+                             self._each(boards[diamonds], breaking)):
+            value[i] = v
+            dead[i] = d
+
+        rest = numpy.nonzero(~diamonds)[0]
+        if len(rest) == 0: return value, dead
+        some = boards[rest]
+        kind = self.kind[some]
+        color = self.color[some]
+        solid = (kind != EMPTY) & (kind != TICK)
+        down = (solid[:, :-1] & solid[:, 1:] &
+                (color[:, :-1] == color[:, 1:]))
+        right = (solid[:, :, :-1] & solid[:, :, 1:] &
+                 (color[:, :, :-1] == color[:, :, 1:]))
+
+        big = len(some) * self.width * self.height
+        label = numpy.arange(big).reshape(kind.shape)
+        label[~solid] = big
+        while True:
+            new = label.copy()
+            new[:, :-1][down] = numpy.minimum(new[:, :-1], label[:, 1:])[down]
+            new[:, 1:][down] = numpy.minimum(new[:, 1:], label[:, :-1])[down]
+            new[:, :, :-1][right] = numpy.minimum(new[:, :, :-1],
+                                                  label[:, :, 1:])[right]
+            new[:, :, 1:][right] = numpy.minimum(new[:, :, 1:],
+                                                 label[:, :, :-1])[right]
+            if (new == label).all(): break
+            label = new
+
+        linked = numpy.zeros(kind.shape, bool)
+        linked[:, :-1] |= down
+        linked[:, 1:] |= down
+        linked[:, :, :-1] |= right
+        linked[:, :, 1:] |= right
+        seeds = label[(kind == BREAK) & linked]
+        crashed = numpy.in1d(label.ravel(), seeds).reshape(kind.shape)
+        crashed &= solid
+
+        near = numpy.zeros(kind.shape, bool)
+        near[:, :-1] |= crashed[:, 1:]
+        near[:, 1:] |= crashed[:, :-1]
+        near[:, :, :-1] |= crashed[:, :, 1:]
+        near[:, :, 1:] |= crashed[:, :, :-1]
+        ticks = (kind == TICK) & near
+
+        # Every cell of a w x h gem is worth (w + h) / 2, so the gem
+        # is worth w * h * ((w + h) / 2), as in AbstractBox._crash_one.
+        cw = self.cw[some].astype(numpy.int32)
+        ch = self.ch[some].astype(numpy.int32)
+        worth = numpy.where(crashed, (cw + ch) // 2, 0)
+        value[rest] = (worth.sum(2).sum(1) +
+                       0.5 * ticks.sum(2).sum(1))
+        area = numpy.where(crashed & (cw > 1), cw * ch, 0)
+        self.max_gemsize[some] = numpy.maximum(
+            self.max_gemsize[some], area.max(2).max(1))
+
+        gone = crashed | ticks
+        tops = gone & (self.crystal[some] == self._cells())
+        dead[rest] = tops.sum(2).sum(1)
+        for name, empty in [("color", -1), ("kind", EMPTY), ("crystal", -1),
+                            ("cw", 0), ("ch", 0), ("extra", 0)]:
+            plane = getattr(self, name)[some]
+            plane[gone] = empty
+            getattr(self, name)[some] = plane
+        return value, dead
+
+    # Take a turn on every board (move all pieces down, tick, merge,
+    # break, repeat), like AIField.take_turn. Returns the value of gems
+    # broken on each board.
+    def take_turn(self, boards = None):
+        boards = self._boards(boards)
+        self.settle(boards)
+        self.tick(boards)
+        self.merge(boards)
+        total, dead = self.breaking(boards)
+        which = numpy.nonzero(dead)[0]
+        while len(which):
+            self.settle(boards[which])
+            self.merge(boards[which])
+            value, dead = self.breaking(boards[which])
+            total[which] += value
+            which = which[dead > 0]
+        return total
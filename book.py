@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# book.py -- opening book for the AIs
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# Early in a game the field is nearly empty, and the AIs work out the
+# same few placements over and over. This works them out once, ahead
+# of time and more thoroughly, and keeps them in a file the AIs look
+# in before they think (see AI.from_book). Usage:
+#   book.py [--depth N] [--height N] [--workers N] [--book FILE] AI ...
+#
+# Starting from an empty field it tries every first piece and every
+# piece after it, and puts the first one where the AI would if it
+# looked at both pieces as hard as it can (LookaheadAI with no beam
+# and no deadline, playing by the AI's own weights). Each field that
+# leaves is tried again with every piece after that, and so on for
+# --depth pieces, as long as the field stays --height or lower.
+#
+# Positions are looked up by the field and both pieces, with colors
+# numbered in the order they turn up, so one entry does for all the
+# positions that are the same but for that. Fields aren't flipped left
+# to right: pieces come in over column width / 2, which isn't the
+# middle, so a position and its mirror image can't reach the same
+# moves (see ai.plan). Only positions with nothing but plain and break
+# gems in them are in the book.
+#
+# The file is a header (the tallest field in it and the names of the
+# AIs it has moves for), then for each position the first 8 bytes of
+# an MD5 hash of it, which AI it's for (as a byte, its place in the
+# names) and the move as a byte, sorted, so it can be searched where
+# it is (memory-mapped) without being read in. Making the book again
+# for an AI replaces all of that AI's positions.
+
+import os, sys, mmap, struct
+
+try: from hashlib import md5
+except ImportError: from md5 import new as md5
+
+# Python 2.6 and later can solve several positions at once.
+try: import multiprocessing
+except ImportError: multiprocessing = None
+
+import ai
+from engine import BasicField, Box, BreakBox, BOX, BREAK, freeze, thaw
+from constants import COLORS
+
+MAGIC = "ADDBOOK2"
+RECORD = 10
+
+# The position as a string.
+def _encode(boxes, pieces):
+    items = [(box.y, box.x, box.size[0], box.size[1], box.kind, box.color)
+             for box in boxes]
+    items.sort()
+    names = {}
+    parts = []
+    for kind, color in pieces:
+        names.setdefault(color, len(names))
+        parts.append("%d%d" % (kind, names[color]))
+    for y, x, w, h, kind, color in items:
+        names.setdefault(color, len(names))
+        parts.append("%d,%d,%d,%d,%d,%d" % (x, y, w, h, kind, names[color]))
+    return " ".join(parts)
+
+# The book's key for an AI called name to put falling on field, with
+# nextpiece after it; or None if the position can't be in the book.
+def canonical(name, field, falling, nextpiece):
+    if not nextpiece: return None
+    else: return _key(name, field, falling + nextpiece)
+
+# The same, for any number of pieces.
+def _key(name, field, boxes):
+    pieces = []
+    for box in boxes:
+        if box.kind not in [BOX, BREAK]: return None
+        pieces.append((box.kind, box.color))
+    boxes = []
+    for y, row in enumerate(field):
+        for x, box in enumerate(row):
+            if box is not None and box.x == x and box.y == y:
+                if box.kind not in [BOX, BREAK]: return None
+                boxes.append(box)
+    key = "%s %dx%d %s" % (name, field.width, field.height,
+                           _encode(boxes, pieces))
+    return md5(key).digest()[:8]
+
+class Book(object):
+    def __init__(self, filename):
+        f = file(filename, "rb")
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally: f.close()
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s isn't an opening book" % filename)
+        start = len(MAGIC)
+        self.height, size = struct.unpack(">II", self._map[start:start + 8])
+        start += 8
+        self.names = self._map[start:start + size].split()
+        self._start = start + size
+        self._count = (len(self._map) - self._start) / RECORD
+
+    def __len__(self): return self._count
+
+    def _record(self, i):
+        start = self._start + i * RECORD
+        return self._map[start:start + RECORD]
+
+    # Every (key, AI name, move) in the book, in order.
+    def items(self):
+        for i in range(self._count):
+            record = self._record(i)
+            yield record[:8], self.names[ord(record[8])], _unpack(record[9])
+
+    # The move for a key, or None if it isn't in the book.
+    def lookup(self, key):
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) / 2
+            record = self._record(mid)
+            if record[:8] < key: low = mid + 1
+            elif record[:8] > key: high = mid
+            else: return _unpack(record[9])
+        return None
+
+    # Where an AI called name should put falling on field, given
+    # nextpiece, or None if the book doesn't say.
+    def get(self, name, field, falling, nextpiece):
+        if name not in self.names or field.max_height() > self.height:
+            return None
+        key = canonical(name, field, falling, nextpiece)
+        if key is None: return None
+        else: return self.lookup(key)
+
+def _pack(move): return chr(move[0] * 16 + move[1])
+
+def _unpack(byte): return divmod(ord(byte), 16)
+
+# Write a book of {key: (AI name, move)} for the AIs called names, for
+# fields up to height tall.
+def write(filename, height, names, moves):
+    keys = moves.keys()
+    keys.sort()
+    index = dict([(name, chr(i)) for i, name in enumerate(names)])
+    names = " ".join(names)
+    f = file(filename, "wb")
+    try:
+        f.write(MAGIC + struct.pack(">II", height, len(names)) + names)
+        for key in keys:
+            name, move = moves[key]
+            f.write(key + index[name] + _pack(move))
+    finally: f.close()
+
+# The AI that makes the book's moves for an AI called name.
+_solvers = {}
+
+def solver(name):
+    if name not in _solvers:
+        cls = getattr(ai, name)
+        if issubclass(cls, ai.LookaheadAI): bases = (cls,)
+        else: bases = (ai.LookaheadAI, cls)
+        cls = type(name + "Book", bases, { "beam": None, "deadline": None })
+        _solvers[name] = cls(None)
+    return _solvers[name]
+
+# The job of solving a position goes to a worker as plain tuples, as
+# in ai._decide.
+def _job(name, field, falling, nextpiece):
+    boxes = []
+    for y, row in enumerate(field):
+        for x, box in enumerate(row):
+            if box is not None and box.x == x and box.y == y:
+                boxes.append(freeze(box))
+    return (name, field.width, field.height, boxes, map(freeze, falling),
+            map(freeze, nextpiece))
+
+def solve(name, width, height, boxes, falling, nextpiece):
+    field = BasicField(width, height)
+    for state in boxes: field.place(thaw(state))
+    player = solver(name)
+    player.setup(field, map(thaw, falling), map(thaw, nextpiece))
+    return player.decide()
+
+def _solve(args): return solve(*args)
+
+# Every piece the book knows about: two plain or break gems, in any
+# of the colors.
+def pieces():
+    found = []
+    for kind1 in [Box, BreakBox]:
+        for kind2 in [Box, BreakBox]:
+            for color1 in COLORS[:4]:
+                for color2 in COLORS[:4]:
+                    found.append([kind1(color1, [-1, -1]),
+                                  kind2(color2, [-1, -1])])
+    return found
+
+# The positions for the book, a piece at a time: each is a field and
+# the piece to put on it, and the next piece can be any of them.
+# Returns {key: move} for the AI called name.
+def generate(name, depth, height, workers = None):
+    if multiprocessing is None or workers == 0: pool = None
+    else: pool = multiprocessing.Pool(workers)
+    moves = {}
+    level = [(ai.AIField(BasicField(6, 13)), piece) for piece in pieces()]
+    try:
+        for n in range(depth):
+            todo = []
+            jobs = []
+            for field, falling in level:
+                for nextpiece in pieces():
+                    key = canonical(name, field, falling, nextpiece)
+                    if key is None or key in moves: continue
+                    moves[key] = None
+                    todo.append((field, falling, nextpiece, key))
+                    jobs.append(_job(name, field, falling, nextpiece))
+            if pool is None: solved = map(_solve, jobs)
+            else: solved = pool.map(_solve, jobs, 16)
+            print "%s: %d positions after %d pieces" % (name, len(jobs), n)
+
+            level = []
+            seen = {}
+            for (field, falling, nextpiece, key), move in zip(todo, solved):
+                # Nowhere for the piece to go (when there isn't, decide
+                # gives up with a move that can't be made), so nothing
+                # to put in the book.
+                if move is None or not field.can_drop(move[1], move[0]):
+                    del(moves[key])
+                    continue
+                moves[key] = move
+                if n + 1 == depth: continue
+                # The field after the move, for the next piece to go on.
+                after = ai.AIField(field)
+                after.drop([b.copy() for b in falling], move[1], move[0])
+                after.take_turn()
+                if after.max_height() > height: continue
+                key = _key(name, after, nextpiece)
+                if key is None or key in seen: continue
+                seen[key] = True
+                level.append((after, nextpiece))
+    finally:
+        if pool is not None: pool.terminate()
+    return moves
+
+def main(argv):
+    from optparse import OptionParser
+    parser = OptionParser(usage = "%prog [options] AI ...")
+    parser.add_option("--depth", type = "int", default = 2,
+                      help = "pieces into the game to go (default 2)")
+    parser.add_option("--height", type = "int", default = 4,
+                      help = "the tallest field to keep going from "
+                      "(default 4)")
+    parser.add_option("--workers", type = "int", default = None,
+                      help = "processes to solve in (default one per CPU, "
+                      "0 for none)")
+    parser.add_option("--book", default = ai.BOOK,
+                      help = "book file (default %default)")
+    options, names = parser.parse_args(argv)
+    if not names: parser.error("no AIs given")
+    for name in names:
+        cls = getattr(ai, name, None)
+        if not (isinstance(cls, type) and issubclass(cls, ai.GoodAI)):
+            parser.error("%s isn't a kind of GoodAI" % name)
+
+    # Positions for other AIs already in the book stay there; the ones
+    # for the AIs we're doing again go.
+    moves = {}
+    height = options.height
+    known = []
+    if os.path.exists(options.book):
+        try: old = Book(options.book)
+        except ValueError:
+            print "%s is in an old format; starting over." % options.book
+        else:
+            for key, name, move in old.items():
+                if name not in names: moves[key] = (name, move)
+            height = max(height, old.height)
+            known = old.names
+            del(old)
+    for name in names:
+        for key, move in generate(name, options.depth, options.height,
+                                  options.workers).items():
+            moves[key] = (name, move)
+        if name not in known: known.append(name)
+    write(options.book, height, known, moves)
+    print "%d positions in %s." % (len(moves), options.book)
+
+if __name__ == "__main__": main(sys.argv[1:])
@@ -4,7 +4,6 @@
 __revision__ = "$Id: characters.py 286 2004-09-04 03:51:59Z piman $"
 
 import os
-import math
 import pygame
 from pygame import transform
 
@@ -12,7 +11,7 @@ import dirstore; dirstore.require("0.1")
 from dirstore import DirStore
 
 import config
-import random
+import engine
 import load
 
 from constants import *
@@ -82,44 +81,8 @@ class Character(object):
 
         return surf
 
-# The pattern which a character drops gems in.
-class DropPattern(object):
-    color_map = { "b": "blue", "g": "green", "y": "yellow", "r": "red",
-                  "p": "purple", "c": "cyan", "o": "orange" }
-
-    def __init__(self, array):
-        self._array = [[DropPattern.color_map[c] for c in s] for s in array]
-        self.cost = self._calculate_cost()
-
-    # Given a number of gems to drop, return the actual rows of blocks
-    # to be dropped.
-    def multiply(self, count):
-        rows = []
-        array = list(self._array)
-        if self.cost < 1: count = int(math.ceil(count * self.cost))
-        elif self.cost > 1: count = int(math.floor(count * self.cost))
-        while count >= 6:
-            rows.append(list(array.pop()))
-            array.insert(0, list(rows[-1]))
-            count -= 6
-        if count != 0:
-            possible = [0, 1, 2, 4, 5]
-            to_fill = []
-            rows.append(list(array.pop()))
-            array.insert(0, list(rows[-1]))
-            while count > 0 and len(possible) > 0:
-                to_fill.append(random.choice(possible))
-                possible.remove(to_fill[-1])
-                count -= 1
-
-            # Column 3 (where pieces fall) is filled in last
-            if count == 1: to_fill.append(3)
-
-            for i in range(len(rows[-1])):
-                if i not in to_fill: rows[-1][i] = None
-            
-        return rows
-
+# The pattern which a character drops gems in, and how to draw it.
+class DropPattern(engine.DropPattern):
     # Draw our gem pattern as an image, for the character selection screen.
     def render(self):
         pattern = pygame.Surface([32 * 6, 32 * 4])
@@ -131,33 +94,6 @@ class DropPattern(object):
         pattern = transform.rotozoom(pattern, 0, 0.8).convert()
         return pattern
 
-    def _calculate_cost(self):
-        # Patterns that are more complicated drop less stones, to be
-        # fair. Thus, we have to calculate the "randomness" of the drop
-        # pattern, and get some kind of multiplier to make it fair. So:
-        #
-        # For each stone, look at the stones to the left, and below
-        # it. If both are the same color, add 1. If neither are the
-        # same color, subtract 1. If one is the same and one is
-        # different, add 0. This gives us an initial score; higher
-        # means the grid is "easier", and so the multiplier should be
-        # higher.
-        #
-        # Thus, -20 is the "worst" (.5x) and 20 is the "best" (2x).
-        
-        s = 0
-        for i in range(4):
-            for j in range(5):
-                c = self._array[i][j]
-                c1 = self._array[(i + 1) % 4][j]
-                c2 = self._array[i][j + 1]
-
-                if c1 == c2 == c: s += 1
-                elif c1 != c and c2 != c: s -= 1
-
-        if s < 0: return 1 - s / -40.0
-        else: return 1 + (s / 20.0)
-
 # Load all characters found in our resource paths
 def init():
     char_base = os.path.join(angrydd_path, "characters")
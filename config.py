@@ -25,6 +25,18 @@ def init(rc_file):
     _config.set("settings", "rotate_on_space", "yes")
     _config.set("settings", "matches", "3")
     _config.set("settings", "ai", "2")
+    # Worker processes for the AI to think in; 0 thinks in the game.
+    _config.set("settings", "ai_workers", "0")
+    # The most positions each AI remembers from one search to the next.
+    _config.set("settings", "ai_table_size", "20000")
+    # How long (in ms) the Master AI thinks per move, and the most moves
+    # it remembers while it does.
+    _config.set("settings", "mcts_time", "500")
+    _config.set("settings", "mcts_nodes", "20000")
+    # Show human players where the AI would put their piece.
+    _config.set("settings", "hints", "no")
+    # Save human players' matches, to go over with review.py.
+    _config.set("settings", "record_matches", "no")
     _config.set("settings", "speed", "750")
     _config.set("settings", "combat", "no")
     _config.set("settings", "fullscreen", "yes")
@@ -141,15 +153,37 @@ def get_combat():
     if _config.getboolean("settings", "combat"): return "Combat Blocks"
     else: return "No Combat Blocks"
 
+def set_hints(menu, platform, pos, key):
+    r = _config.getboolean("settings", "hints")
+    r ^= True
+    _config.set("settings", "hints", str(r).lower())
+    platform.text = get_hints()
+    return False
+
+def get_hints():
+    if _config.getboolean("settings", "hints"): return "Hints"
+    else: return "No Hints"
+
+# The AIs to pick from: the game's own, then any profiles (see
+# ai.PROFILES), by name. game.AIPlayer goes by the same list.
+def _ai_names():
+    import ai
+    return ["Stupid", "Very Easy", "Easy", "Normal",
+            "Hard", "Insane", "Expert", "Master"] + ai.PROFILE_NAMES
+
 def set_ai(menu, platform, pos, key):
+    count = len(_ai_names())
     m = _config.getint("settings", "ai")
-    if key == CONFIRM: m = (m + 1) % 6
-    elif key == UP or key == ROT_CW: m = min(5, m + 1)
+    if key == CONFIRM: m = (m + 1) % count
+    elif key == UP or key == ROT_CW: m = min(count - 1, m + 1)
     else: m = max(0, m - 1)
     _config.set("settings", "ai", str(m))
     platform.text = get_ai()
     return False
 
+# A profile that's gone since it was picked plays as Normal.
 def get_ai():
-    return "AI: %s" % ["Stupid", "Very Easy", "Easy", "Normal",
-                       "Hard", "Insane"][_config.getint("settings", "ai")]
+    names = _ai_names()
+    m = _config.getint("settings", "ai")
+    if m >= len(names): m = NORMAL
+    return "AI: %s" % names[m]
@@ -7,7 +7,11 @@ __revision__ = "$Id: constants.py 295 2005-08-13 07:22:00Z piman $"
 # Accordingly, this really should only contain constants and nothing else!
 
 import os
-from pygame.locals import *
+
+# The rules (engine.py) need some of these, but none of pygame's, and
+# have to work without it.
+try: from pygame.locals import *
+except ImportError: USEREVENT = 24
 
 angrydd_path = os.path.split(os.path.realpath(__file__))[0]
 
@@ -33,7 +37,7 @@ UP, LEFT, RIGHT, DOWN, ROT_CW, ROT_CC, CONFIRM = range(7)
 HEALTHY, CLEAR, REVERSE, FLIP, BLINK, GRAY, SCRAMBLE = range(7)
 
 # AI difficulties
-STUPID, VEASY, EASY, NORMAL, HARD, INSANE = range(6)
+STUPID, VEASY, EASY, NORMAL, HARD, INSANE, EXPERT, MASTER = range(8)
 
 CREDITS = [
     "Angry, Drunken Programmers",
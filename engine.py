@@ -0,0 +1,954 @@
+# engine.py -- the rules of the game, without any graphics
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# Everything needed to play the game without showing it: the boxes, the
+# field they sit in, and how gems get dropped on players. Nothing here
+# (or in what it imports) needs pygame, so the AI, simulations and tests
+# can run where there's no SDL at all. boxes.py, game.py and
+# characters.py build the graphical game on top of this.
+
+import math
+import random
+import config
+
+try: from hashlib import md5
+except ImportError: from md5 import new as md5
+
+from constants import *
+
+# Kinds of gem, for code that keeps fields as plain numbers rather
+# than box objects (see planes.py).
+EMPTY, BOX, BREAK, SPECIAL, DIAMOND, TICK = range(6)
+
+# Abstract class from which other block types inherit. Boxes are
+# pure game logic, and the AI makes a lot of them, so they use slots
+# and know nothing about how they're drawn; see boxes.SpriteBox for that.
+class AbstractBox(object):
+    __slots__ = ["size", "color", "x", "y", "crashed"]
+
+    def __init__(self, color, topleft):
+        self.size = [1, 1]      # How big are we; [1,1] except for Box.
+        self.color = color
+        self.x, self.y = topleft
+        self.crashed = False     # If we've been hit by a crash gem/diamond.
+
+    # A new box just like this one, not on any field.
+    def copy(self):
+        box = object.__new__(self.__class__)
+        box.size = list(self.size)
+        box.color = self.color
+        box.x = self.x
+        box.y = self.y
+        box.crashed = self.crashed
+        return box
+
+    # Accessors for coordinates. FIXME: Make these properties.
+    def _get_top(self): return self.y
+    def _get_bottom(self): return self.y + self.size[1]
+    def _get_left(self): return self.x
+    def _get_right(self): return self.x + self.size[0]
+
+    # Blocks adjacent to it on the top...
+    def _adj_top(self, field):
+        adj = []
+        if self.y != 0:
+            for x in range(self.x, self._get_right()):
+                adj.append(field[self.y - 1][x])
+        return filter(None, adj)
+
+    # And so on.
+    def _adj_bottom(self, field):
+        adj = []
+        b = self._get_bottom()
+        if b != field.height:
+            for x in range(self.x, self._get_right()):
+                adj.append(field[b][x])
+        return filter(None, adj)
+
+    def _adj_left(self, field):
+        adj = []
+        if self.x != 0:
+            for y in range(self.y, self._get_bottom()):
+                adj.append(field[y][self.x - 1])
+        return filter(None, adj)
+
+    def _adj_right(self, field):
+        adj = []
+        r = self._get_right()
+        if r != field.width:
+            for y in range(self.y, self._get_bottom()):
+                adj.append(field[y][r])
+        return filter(None, adj)
+
+    # All blocks adjacent to this one.
+    def adjacent(self, field):
+        adj = self._adj_left(field)
+        adj.extend(self._adj_right(field))
+        adj.extend(self._adj_top(field))
+        adj.extend(self._adj_bottom(field))
+        return adj
+
+    # Mark us as gone, and remove us from the field map.
+    def remove_from(self, field):
+        self.crashed = True
+        field.unplace(self)
+
+    # Check if something is below us on the field (or we're at the bottom).
+    def is_blocked_down(self, field):
+        bot = self._get_bottom()
+        if bot == field.height: return True
+        else:
+            for x in range(self.x, self._get_right()):
+                if field[bot][x] is not None: return True
+            return False
+
+    # Actually move down space.
+    def fall(self, field): self.drop(field, 1)
+
+    # Move down dist spaces at once; the space below must be clear.
+    def drop(self, field, dist):
+        field.unplace(self)
+        self.y += dist
+        field.place(self)
+
+    # Move to an entirely new location. This is done when blocks are
+    # moved from a FallingBlock onto the field.
+    def move(self, xy):
+        self.x, self.y = xy
+
+    # Destroy just self if appropriate (gem is the box that hit us,
+    # immed is True if it was a crash gem). Returns our value, and
+    # whether the crash spreads to the boxes around us.
+    def _crash_one(self, field, gem, immed):
+        if not self.crashed and gem.color == self.color:
+            self.crashed = True
+            if self.size != [1, 1]:
+                field.max_gemsize = max(field.max_gemsize,
+                                        self.size[0] * self.size[1])
+            return self.size[0] * self.size[1] * (sum(self.size) / 2), True
+        else: return 0, False
+
+    # Called once everything our crash spread to has been crashed.
+    def _crashed(self, field): pass
+
+    # Destroy self and everything of the same color connected to us,
+    # if appropriate; return the value of the gems destroyed. This
+    # labels the region with an explicit stack rather than recursing,
+    # but visits boxes in the same order the recursive version did.
+    def crash(self, field, gem, immed = False):
+        broken, spread = self._crash_one(field, gem, immed)
+        if not spread: return broken
+        stack = [(self, iter(self.adjacent(field)))]
+        while stack:
+            box, adj = stack[-1]
+            for other in adj:
+                value, spread = other._crash_one(field, box, False)
+                broken += value
+                if spread:
+                    stack.append((other, iter(other.adjacent(field))))
+                    break
+            else:
+                stack.pop()
+                box._crashed(field)
+        return broken
+
+# A generator for random boxes. Whether specials show up comes from the
+# settings, unless combat is given (for running without a config).
+class BoxGen(object):
+    def __init__(self, rand, colors, single, combat = None):
+        self.rand = rand
+        if combat is None: combat = config.getboolean("settings", "combat")
+        self.combat = (combat and not single)
+        self.colors = colors
+
+    def get(self, topleft):
+        f = self.rand.random()
+        color = self.rand.choice(self.colors)
+        if self.combat:
+            if f <= 0.004: return Diamond("diamond", topleft)
+            elif f <= 0.20: return BreakBox(color, topleft)
+            elif f <= 0.27: return Special(color, topleft)
+            else: return Box(color, topleft)
+        else:
+            if f <= 0.006: return Diamond("diamond", topleft)
+            elif f <= 0.20: return BreakBox(color, topleft)
+            else: return Box(color, topleft)
+
+# Find all instances of a given type in a sequence.
+def instances_in(sequence, typ):
+    return filter(lambda x: isinstance(x, typ), sequence)
+
+# A basic box type; grows when put near other boxes in the field.
+class Box(AbstractBox):
+    __slots__ = []
+    kind = BOX
+
+    # Resize ourselve, and put ourself in the right place in the
+    # field. Our topleft only changes when we grow up or left.
+    def set_size(self, size, field, topleft = None):
+        field.unplace(self)
+        if topleft: self.x, self.y = topleft
+        self.size = size
+        field.place(self)
+
+    # Try to form larger blocks; return the blocks removed from merging.
+    def try_merge(self, field):
+        if self.size == [1,1]:
+            # Special case the 1,1 size, because we don't want 2x1 or 1x2
+            # blocks forming.
+            if self.x == field.width - 1 or self.y == field.height - 1:
+                return []
+            b1 = field[self.y][self.x + 1]
+            b2 = field[self.y + 1][self.x]
+            b3 = field[self.y + 1][self.x + 1]
+            if (isinstance(b1, Box) and isinstance(b2, Box) and
+                isinstance(b3, Box) and
+                self.color == b1.color == b2.color == b3.color and
+                b1.size == b2.size == b3.size == [1, 1]):
+                # Remove the boxes from the field
+                b1.remove_from(field)
+                b2.remove_from(field)
+                b3.remove_from(field)
+                self.set_size([2, 2], field)
+                return [b1, b2, b3]
+        else:
+            # test all four directions
+            blocks = self._adj_top(field)
+            # there are blocks above us, and they are not special blocks,
+            # and they are the same color, and they all share the same
+            # top location, the leftmost border and rightmost border
+            # match up with ours. We need these last checks to avoid
+            # oddly shaped structures like
+            # XXYY merging into XZZY
+            #  ZZ                ZZ
+            if (len(blocks) == self.size[0] and
+                len(instances_in(blocks, Box)) == len(blocks) and
+                [b.color for b in blocks].count(self.color) == len(blocks) and
+                not [b for b in blocks if b.y != blocks[0].y] and
+                blocks[0].x == self.x and
+                blocks[-1]._get_right() == self._get_right()):
+                dead = []
+                for b in blocks:
+                    b.remove_from(field)
+                    dead.append(b)
+                self.set_size([self.size[0], self._get_bottom() - blocks[0].y],
+                              field, [self.x, blocks[0].y])
+                return dead
+
+            blocks = self._adj_bottom(field)
+            if (len(blocks) == self.size[0] and
+                len(instances_in(blocks, Box)) == len(blocks) and
+                [b.color for b in blocks].count(self.color) == len(blocks) and
+                not [b for b in blocks if
+                     b._get_bottom() != blocks[0]._get_bottom()] and
+                blocks[0].x == self.x and
+                blocks[-1]._get_right() == self._get_right()):
+                dead = []
+                for b in blocks:
+                    b.remove_from(field)
+                    dead.append(b)
+                bot = blocks[0]._get_bottom()
+                self.set_size([self.size[0],  bot - self.y], field)
+                return dead
+
+            blocks = self._adj_left(field)
+            if (len(blocks) == self.size[1] and
+                len(instances_in(blocks, Box)) == len(blocks) and
+                [b.color for b in blocks].count(self.color) == len(blocks) and
+                not [b for b in blocks if b.x != blocks[1].x] and
+                blocks[0].y == self.y and
+                blocks[-1]._get_bottom() == self._get_bottom()):
+                dead = []
+                for b in blocks:
+                    b.remove_from(field)
+                    dead.append(b)
+                self.set_size([self._get_right() - blocks[0].x, self.size[1]],
+                              field, [blocks[0].x, self.y])
+                return dead
+
+            blocks = self._adj_right(field)
+            if (len(blocks) == self.size[1] and
+                len(instances_in(blocks, Box)) == len(blocks) and
+                [b.color for b in blocks].count(self.color) == len(blocks) and
+                not [b for b in blocks if
+                     b._get_right() != blocks[0]._get_right()] and
+                blocks[0].y == self.y and
+                blocks[-1]._get_bottom() == self._get_bottom()):
+                dead = []
+                for b in blocks:
+                    b.remove_from(field)
+                    dead.append(b)
+                right = blocks[0]._get_right()
+                self.set_size([right - self.x, self.size[1]], field)
+                return dead
+
+        return []
+
+# A gem that breaks gems of the same color when it lands by them.
+class BreakBox(AbstractBox):
+    __slots__ = []
+    kind = BREAK
+
+    # Called by the field to see if we can break anything.
+    # THIS DOESN'T BREAK SELF! self will break when its
+    # crashed method gets called by the gem *it* breaks.
+    def try_crash(self, field):
+        broken = 0
+        for box in self.adjacent(field):
+            broken += box.crash(field, self, True)
+        return broken
+
+# Now when you say special...
+# These are the blocks used in "combat" mode, they don't form crystals,
+# and when they break you get the 'item' in them.
+class Special(AbstractBox):
+    __slots__ = ["special"]
+    kind = SPECIAL
+    names = ["", "cleared", "reversed", "flipped", "blinking",
+             "incoming", "scrambled"]
+    
+    def __init__(self, color, topleft, special = None):
+        AbstractBox.__init__(self, color, topleft)
+        self.special = (special or random.randint(1, 6))
+
+    def copy(self):
+        box = AbstractBox.copy(self)
+        box.special = self.special
+        return box
+
+    def _crashed(self, field): field.pick_up(self.special)
+
+# Diamonds break all of the color they land on, but "specially" -
+# no bonuses for larger gems. So we just count the number of
+# spaces of that color on the field, and then remove them.
+# Extend BreakBox so that we find Diamonds when we filter for
+# break boxes to crash.
+class Diamond(BreakBox):
+    __slots__ = []
+    kind = DIAMOND
+
+    def try_crash(self, field):
+        broken = 0
+        self.crashed = True
+        if self.y == field.height - 1:
+            field.tech_bonus()
+            return 0
+        else: color = field[self.y + 1][self.x].color
+
+        for x, y in field.cells(color):
+            box = field[y][x]
+            if isinstance(box, TickBox): broken += 0.5
+            else: broken += 1
+            box.crashed = True
+        return broken
+
+# Box with a counter on it. When it counts down, it replaces itself
+# with a normal Box.
+class TickBox(AbstractBox):
+    __slots__ = ["time_left"]
+    kind = TICK
+
+    def __init__(self, color, topleft):
+        AbstractBox.__init__(self, color, topleft)
+        self.time_left = 5
+
+    def copy(self):
+        box = AbstractBox.copy(self)
+        box.time_left = self.time_left
+        return box
+
+    def tick(self):
+        self.time_left -= 1
+
+    def _crash_one(self, field, gem, immed):
+        # Tick boxes don't crash adjacent boxes, though they do
+        # get destroyed themselves. They are also destroyed irrespective
+        # of color.
+        if not self.crashed and not immed:
+            self.crashed = True
+            return 0.5, False
+        else: return 0.0, False
+
+_CLASSES = { BOX: Box, BREAK: BreakBox, SPECIAL: Special,
+             DIAMOND: Diamond, TICK: TickBox }
+
+# A box as a tuple of plain values, for sending to another process
+# (or anywhere else objects can't go), and back again.
+def freeze(box):
+    if box.kind == TICK: extra = box.time_left
+    elif box.kind == SPECIAL: extra = box.special
+    else: extra = 0
+    return (box.kind, box.color, box.x, box.y, box.size[0], box.size[1],
+            extra)
+
+def thaw(state):
+    kind, color, x, y, w, h, extra = state
+    if kind == SPECIAL: box = Special(color, [x, y], extra)
+    else: box = _CLASSES[kind](color, [x, y])
+    if kind == TICK: box.time_left = extra
+    box.size = [w, h]
+    return box
+
+# Zobrist keys: a random 64-bit number for everything a box on the
+# field can be -- (x, y, color, kind, width, height, ticks left).
+# They're made from the key itself rather than drawn from a generator,
+# so every process, and every machine, agrees on them.
+_zobrist_keys = {}
+def zobrist(key):
+    try: return _zobrist_keys[key]
+    except KeyError:
+        z = _zobrist_keys[key] = long(md5(repr(key)).hexdigest()[:16], 16)
+        return z
+
+# A simple non-graphical playing field.
+class BasicField(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.max_gemsize = 0
+        self.max_chain = 0
+        BasicField.clear(self)
+
+    # Empty the field, and everything we know about it.
+    def clear(self):
+        self._field = [[None] * self.width for i in range(self.height)]
+        self._dirty = {}
+        # Bitsets of the cells (bit y * width + x) holding each color
+        # and kind, and a count of the boxes of each size.
+        self._colors = {}
+        self._kinds = {}
+        self._sizes = {}
+        # Every TickBox on the field, by id.
+        self._tickers = {}
+        # The Zobrist keys of all the boxes on the field XORed together;
+        # equal fields have equal hashes, whatever order they got there.
+        self.state_hash = 0L
+        # How tall each column is (from the bottom to the top of the
+        # highest box in it), and some things about the surface they
+        # make, kept up to date as boxes come and go.
+        self._heights = [0] * self.width
+        self._max_height = 0
+        self._total_height = 0
+        self._roughness = 0
+
+    def __getitem__(self, i): return self._field[i]
+    def __iter__(self): return iter(self._field)
+
+    def add_box(self, xy, box):
+        box.move(xy)
+        self.place(box)
+
+    # Boxes change the field only through place and unplace, so the
+    # field can keep track of what changed.
+    def place(self, box):
+        for y in range(box.y, box._get_bottom()):
+            row = self._field[y]
+            for x in range(box.x, box._get_right()): row[x] = box
+        bits = self._bits(box)
+        self._colors[box.color] = self._colors.get(box.color, 0) | bits
+        self._kinds[box.kind] = self._kinds.get(box.kind, 0) | bits
+        area = box.size[0] * box.size[1]
+        self._sizes[area] = self._sizes.get(area, 0) + 1
+        if box.kind == TICK: self._tickers[id(box)] = box
+        self.state_hash ^= self._zobrist(box)
+        top = self.height - box.y
+        for x in range(box.x, box._get_right()):
+            if top > self._heights[x]: self._set_height(x, top)
+        self._touch(box)
+
+    def unplace(self, box):
+        # Boxes can be removed more than once (e.g. they show up
+        # several times in a list of dead boxes).
+        if self._field[box.y][box.x] is not box: return
+        for y in range(box.y, box._get_bottom()):
+            row = self._field[y]
+            for x in range(box.x, box._get_right()): row[x] = None
+        bits = ~self._bits(box)
+        self._colors[box.color] &= bits
+        self._kinds[box.kind] &= bits
+        area = box.size[0] * box.size[1]
+        self._sizes[area] -= 1
+        if self._sizes[area] == 0: del(self._sizes[area])
+        if box.kind == TICK: del(self._tickers[id(box)])
+        self.state_hash ^= self._zobrist(box)
+        # If it was the top of a column, the column's now as tall as
+        # whatever's under it.
+        top = self.height - box.y
+        for x in range(box.x, box._get_right()):
+            if self._heights[x] == top:
+                self._set_height(x, self._height_below(x, box._get_bottom()))
+
+    def _height_below(self, x, y):
+        for y in range(y, self.height):
+            if self._field[y][x] is not None: return self.height - y
+        return 0
+
+    def _set_height(self, x, height):
+        heights = self._heights
+        old = heights[x]
+        if x > 0:
+            self._roughness += (abs(height - heights[x - 1]) -
+                                abs(old - heights[x - 1]))
+        if x < self.width - 1:
+            self._roughness += (abs(height - heights[x + 1]) -
+                                abs(old - heights[x + 1]))
+        self._total_height += height - old
+        heights[x] = height
+        if height > self._max_height: self._max_height = height
+        elif old == self._max_height: self._max_height = max(heights)
+
+    # How tall column x is.
+    def get_height(self, x): return self._heights[x]
+
+    # How tall the tallest column is.
+    def max_height(self): return self._max_height
+
+    # The heights of all the columns added up.
+    def total_height(self): return self._total_height
+
+    # How bumpy the top is: the differences in height between each
+    # column and the next, added up.
+    def roughness(self): return self._roughness
+
+    # The Zobrist key for a box where it is now.
+    def _zobrist(self, box):
+        if box.kind == TICK: ticks = box.time_left
+        else: ticks = 0
+        return zobrist((box.x, box.y, box.color, box.kind,
+                        box.size[0], box.size[1], ticks))
+
+    # The cells a box covers, as a bitset.
+    def _bits(self, box):
+        line = ((1 << box.size[0]) - 1) << box.x
+        bits = 0
+        for y in range(box.y, box._get_bottom()):
+            bits |= line << (y * self.width)
+        return bits
+
+    # The cells holding the given color and/or kind (or anything at
+    # all, given neither), as a bitset.
+    def _select(self, color = None, kind = None):
+        if color is None and kind is None:
+            bits = 0
+            for b in self._kinds.values(): bits |= b
+        else:
+            bits = -1
+            if color is not None: bits &= self._colors.get(color, 0)
+            if kind is not None: bits &= self._kinds.get(kind, 0)
+        return bits
+
+    # The (x, y) of every cell holding the given color and/or kind,
+    # top to bottom and left to right.
+    def cells(self, color = None, kind = None):
+        return self._cells(self._select(color, kind))
+
+    # Costs a step per row plus one per cell found.
+    def _cells(self, bits):
+        cells = []
+        mask = (1 << self.width) - 1
+        y = 0
+        while bits:
+            row, x = bits & mask, 0
+            while row:
+                if row & 1: cells.append((x, y))
+                row >>= 1
+                x += 1
+            bits >>= self.width
+            y += 1
+        return cells
+
+    # How many cells hold the given color and/or kind.
+    def count(self, color = None, kind = None):
+        bits = self._select(color, kind)
+        count = 0
+        while bits:
+            bits &= bits - 1
+            count += 1
+        return count
+
+    # The area of the largest box on the field (1 if it's empty).
+    def largest_gem(self): return max([1] + self._sizes.keys())
+
+    # Remember the boxes that might be able to merge now that box has
+    # arrived or grown: itself, and anything touching it (diagonally
+    # too, since a 1x1 box looks down and right for its 2x2). Boxes
+    # going away never let anything merge that couldn't before.
+    def _touch(self, box):
+        dirty = self._dirty
+        left, right = max(0, box.x - 1), min(self.width, box._get_right() + 1)
+        for y in range(max(0, box.y - 1),
+                       min(self.height, box._get_bottom() + 1)):
+            for b in self._field[y][left:right]:
+                if b is not None: dirty[id(b)] = b
+
+    # Move all pieces down one step; return True if pieces moved
+    # or False otherwise.
+    def fall(self):
+        could_move = False
+        for i in range(len(self._field) - 2, -1, -1):
+            # Things on the first row won't fall, so we don't
+            # need to check it.
+            for j, box in enumerate(self._field[i]):
+                if (box and not box.is_blocked_down(self)):
+                    box.fall(self)
+                    could_move = True
+        return could_move
+
+    # Work out how far everything has to fall to come to rest, in one
+    # pass from the bottom up; floor[x] is the highest row anything in
+    # column x will rest on. Returns (box, distance) pairs for the
+    # boxes that need to move, lowest first. Nothing is moved.
+    def drops(self):
+        floor = [self.height] * self.width
+        moves = []
+        for y in range(self.height - 1, -1, -1):
+            for x, box in enumerate(self._field[y]):
+                # Look at each box once, from its bottom-left corner.
+                if box is None or box.x != x or box._get_bottom() != y + 1:
+                    continue
+                right = box._get_right()
+                dist = min(floor[x:right]) - y - 1
+                if dist > 0: moves.append((box, dist))
+                for col in range(x, right): floor[col] = box.y + dist
+        return moves
+
+    # Move all pieces down until they come to rest, in one pass;
+    # return the (box, distance) pairs of what moved.
+    def settle(self):
+        moves = self.drops()
+        for box, dist in moves: box.drop(self, dist)
+        return moves
+
+    # Tick all ticking boxes; replace them if their time runs out.
+    def tick(self):
+        tickers = [(t.y, t.x, t) for t in self._tickers.values()]
+        tickers.sort()
+        tickers = [t for y, x, t in tickers]
+        extickers = []
+        for t in tickers:
+            self.state_hash ^= self._zobrist(t)
+            t.tick()
+            self.state_hash ^= self._zobrist(t)
+            if t.time_left == 0:
+                t.remove_from(self)
+                extickers.append(t)
+                b = Box(t.color, [t.x, t.y])
+                self.add_box([t.x, t.y], b)
+        return tickers, extickers
+
+    # How many ticking boxes have each number of turns left.
+    def expirations(self):
+        counts = {}
+        for t in self._tickers.values():
+            counts[t.time_left] = counts.get(t.time_left, 0) + 1
+        return counts
+
+    def pick_up(self, special): pass
+
+    # BasicField doesn't know what a "player" is, so it can't
+    # give a bonus.
+    def tech_bonus(self): pass
+
+    # Try to merge boxes into bigger ones; return True if one
+    # merged successfully (only merges one). Boxes are tried in the
+    # order they always have been, though it's not quite bottom up and
+    # left to right (boxes in the same row all sort as equal); which
+    # box merges first decides how crystals grow, so it matters. Only
+    # the ones that changed (or had something change around them) since
+    # they were last tried get tried; the rest would fail the same way
+    # they did then.
+    def merge(self):
+        dirty = self._dirty
+        if not dirty: return []
+        boxes = [b for row in self._field for b in row if isinstance(b, Box)]
+        boxes.sort(lambda a, b: cmp(b.y, a.y) and cmp(a.x, b.x))
+        self._dirty = {}
+        for i, box in enumerate(boxes):
+            if id(box) not in dirty: continue
+            dead = box.try_merge(self)
+            if len(dead) > 0:
+                # Anything we didn't get to still needs a try.
+                for b in boxes[i + 1:]:
+                    if id(b) in dirty: self._dirty[id(b)] = b
+                return dead
+        return []
+
+    # Break everything that will break; return the "value" of
+    # the broken 
+    def breaking(self):
+        bits = self._kinds.get(BREAK, 0) | self._kinds.get(DIAMOND, 0)
+        breakers = [self._field[y][x] for x, y in self._cells(bits)]
+        killed_count = sum([b.try_crash(self) for b in breakers
+                            if not b.crashed])
+        dead = []
+        for row in self._field:
+            dead.extend(filter(lambda b: b and b.crashed, row))
+        for box in dead: box.remove_from(self)
+        return killed_count, dead
+
+# Two boxes falling down the field as one piece, and the rules for how
+# the player can move them.
+class FallingPiece(object):
+    # Orientation/rotation rules:
+    # There are 4 possible orientations for the boxes:
+    #  2
+    #  1 21  1  12    (left to right, rotate counter-clockwise)
+    #        2
+    #
+    #  0  1  2  3
+
+    def __init__(self, box1, box2, field):
+        self.y = 0
+        self.x = int(field.width / 2)
+        self._box1 = box1
+        self._box2 = box2
+        self._orient = 0
+        self.locked = False
+        self._field = field
+        self.bonus = False
+
+    # Predicates to see if we're blocked in the directions we want to go.
+    def _is_blocked_left(self):
+        l = self._get_left()
+        return ((l == 0) or
+                (self._field[self._get_top()][l - 1] or
+                 self._field[self._get_bottom()][l - 1]))
+
+    def _is_blocked_right(self):
+        r = self._get_right()
+        return ((r == self._field.width - 1) or
+                (self._field[self._get_top()][r + 1] or
+                 self._field[self._get_bottom()][r + 1]))
+
+    def _is_blocked_down(self):
+        b = self._get_bottom()
+        return ((b == self._field.height - 1) or
+                (self._field[b + 1][self._get_left()] or
+                 self._field[b + 1][self._get_right()]))
+
+    # Actually go right or left, after checking.
+    def go_left(self):
+        if not (self.locked or self._is_blocked_left()): self.x -= 1
+    def go_right(self):
+        if not (self.locked or self._is_blocked_right()): self.x += 1
+
+    # Go down. If we can't go down, lock ourself in place.
+    def go_down(self):
+        if not self._is_blocked_down(): self.y += 1
+        else:
+            self.locked = True
+            self.bonus = True
+
+    def _get_top(self): return max(0, self.y - int(self._orient == 0))
+    def _get_left(self): return self.x - int(self._orient == 1)
+    def _get_bottom(self): return self.y + int(self._orient == 2)
+    def _get_right(self): return self.x + int(self._orient == 3)
+
+    # Drop our contained boxes onto the field and let them fall.
+    def deposit(self):
+        if self._orient == 0:
+            self._field.add_box([self.x, self.y], self._box1)
+            if self.y != 0:
+                self._field.add_box([self.x, self.y - 1], self._box2)
+        elif self._orient == 1:
+            self._field.add_box([self.x, self.y], self._box1)
+            self._field.add_box([self.x - 1, self.y], self._box2)
+        elif self._orient == 2:
+            self._field.add_box([self.x, self.y], self._box1)
+            self._field.add_box([self.x, self.y + 1], self._box2)
+        elif self._orient == 3:
+            self._field.add_box([self.x, self.y], self._box1)
+            self._field.add_box([self.x + 1, self.y], self._box2)
+        return self._box1, self._box2
+
+    # When a falling block can't rotate properly, the boxes are
+    # swapped instead of rotated.
+    def _swap(self):
+        self._box1, self._box2 = self._box2, self._box1
+
+    # Try to rotate the piece; push it away from a wall if we need to;
+    # swap if we can't. Takes the new orientation and as an argument.
+    def _rotate(self, new_o):
+        if self.locked: return
+        blocked = False
+        pushable = False
+        dx, dy = 0, 0
+        if new_o == 3:
+            blocked = (self._get_right() == self._field.width - 1 or
+                       self._field[self.y][self.x + 1] is not None)
+            pushable = (blocked and
+                        self._get_left() != 0 and
+                        self._field[self.y][self.x - 1] is None)
+            dx = -1
+        elif new_o == 0:
+            blocked = (self._field[self.y - 1][self.x] is not None)
+            pushable = (blocked and
+                        self._field[self.y + 1][self.x] is None)
+            dy = 1
+        elif new_o == 1:
+            blocked = (self._get_left() == 0 or
+                       self._field[self.y][self.x - 1] is not None)
+            pushable = (blocked and
+                        self._get_right() != self._field.width - 1 and
+                        self._field[self.y][self.x + 1] is None)
+            dx = 1
+        elif new_o == 2:
+            blocked = (self.y == self._field.height - 1 or
+                       self._field[self.y + 1][self.x] is not None)
+
+        if blocked and not pushable:
+            self._swap()
+        else:
+            if pushable:
+                self.x += dx
+                self.y += dy
+            self._orient = new_o
+
+    # Rotate clockwise or counterclockwise.
+    def rot_cw(self): self._rotate((self._orient - 1) % 4)
+    def rot_cc(self): self._rotate((self._orient + 1) % 4)
+
+
+# Manage boning counter for single player mode. Keep track of the number
+# of turns and blocks left, and drop the blocks (randomly) when that
+# number reaches 0. This replaces DropPattern in single player.
+class TensionBoner(object):
+    def __init__(self):
+        self.turns_left = 10
+        self.turns_left_max = 10
+        self.next_boning = 2
+        self.next_boning_max = 2
+
+    # A piece hit the bottom
+    def tick(self):
+        self.turns_left -= 1
+
+    # The player cleared some gems.
+    def debone(self, player, val):
+        self.next_boning -= val
+        if self.next_boning <= 0:
+            player.score.score += (-50 * self.next_boning)
+            self.next_boning_max = self.next_boning_max * (5.0/3.0)
+            self.turns_left_max += 2
+            self.next_boning = int(self.next_boning_max)
+            player.score.score += 100 * self.turns_left
+            self.turns_left = self.turns_left_max
+        return 0
+
+    # No turns left. Drop random blocks.
+    # This shares a lot of code with the DropPattern algorithm.
+    def bone(self):
+        count = self.next_boning
+        rows = []
+        while count >= 15:
+            rows.append([random.choice(COLORS) for i in range(15)])
+            count -= 15
+        if count != 0:
+            possible = range(15)
+            to_fill = []
+            rows.append([random.choice(COLORS) for i in range(15)])
+            while count > 0 and len(possible) > 0:
+                to_fill.append(random.choice(possible))
+                possible.remove(to_fill[-1])
+                count -= 1
+
+            for i in range(len(rows[-1])):
+                if i not in to_fill: rows[-1][i] = None
+            
+        self.next_boning_max = self.next_boning_max * (1.5)
+        self.turns_left_max += 2
+        self.next_boning = int(self.next_boning_max)
+        self.turns_left = self.turns_left_max
+        return rows
+
+# Cancel rows of gems on their way to a player with value (what they
+# just broke, chain bonus and all). Each place in the last row costs 2
+# to cancel, whether there's a gem in it or not, from the left; rows
+# with nothing left go. If value was at least the number of gems, the
+# rest are put on three ticks. rows is a list of lists of TickBoxes
+# (or None), changed in place; returns what's left of value, to send
+# on to the other players. game.VersusPlayer, the tournament and
+# AIField all cancel rows with this.
+def debone(rows, value):
+    if len(rows) == 0: return value
+    total = sum([len(row) - row.count(None) for row in rows])
+    half_time = (value >= total)
+    while value > 0 and rows:
+        row = rows[-1]
+        for i in range(len(row)):
+            if value > 0:
+                row[i] = None
+                value -= 2
+        if row.count(None) == len(row): rows.pop()
+    if half_time:
+        for row in rows:
+            for box in row:
+                if box is not None: box.time_left = 3
+    return max(0, value)
+
+# The pattern which a character drops gems in.
+class DropPattern(object):
+    color_map = { "b": "blue", "g": "green", "y": "yellow", "r": "red",
+                  "p": "purple", "c": "cyan", "o": "orange" }
+
+    def __init__(self, array):
+        self._array = [[DropPattern.color_map[c] for c in s] for s in array]
+        self.cost = self._calculate_cost()
+
+    # Given a number of gems to drop, return the actual rows of blocks
+    # to be dropped.
+    def multiply(self, count):
+        rows = []
+        array = list(self._array)
+        if self.cost < 1: count = int(math.ceil(count * self.cost))
+        elif self.cost > 1: count = int(math.floor(count * self.cost))
+        while count >= 6:
+            rows.append(list(array.pop()))
+            array.insert(0, list(rows[-1]))
+            count -= 6
+        if count != 0:
+            possible = [0, 1, 2, 4, 5]
+            to_fill = []
+            rows.append(list(array.pop()))
+            array.insert(0, list(rows[-1]))
+            while count > 0 and len(possible) > 0:
+                to_fill.append(random.choice(possible))
+                possible.remove(to_fill[-1])
+                count -= 1
+
+            # Column 3 (where pieces fall) is filled in last
+            if count == 1: to_fill.append(3)
+
+            for i in range(len(rows[-1])):
+                if i not in to_fill: rows[-1][i] = None
+            
+        return rows
+
+    def _calculate_cost(self):
+        # Patterns that are more complicated drop less stones, to be
+        # fair. Thus, we have to calculate the "randomness" of the drop
+        # pattern, and get some kind of multiplier to make it fair. So:
+        #
+        # For each stone, look at the stones to the left, and below
+        # it. If both are the same color, add 1. If neither are the
+        # same color, subtract 1. If one is the same and one is
+        # different, add 0. This gives us an initial score; higher
+        # means the grid is "easier", and so the multiplier should be
+        # higher.
+        #
+        # Thus, -20 is the "worst" (.5x) and 20 is the "best" (2x).
+        
+        s = 0
+        for i in range(4):
+            for j in range(5):
+                c = self._array[i][j]
+                c1 = self._array[(i + 1) % 4][j]
+                c2 = self._array[i][j + 1]
+
+                if c1 == c2 == c: s += 1
+                elif c1 != c and c2 != c: s -= 1
+
+        if s < 0: return 1 - s / -40.0
+        else: return 1 + (s / 20.0)
@@ -14,8 +14,9 @@ from pygame import mixer, transform
 from constants import *
 
 import events; from events import Event, EventManager
-from boxes import Box, TickBox, BreakBox, Special, Diamond, BoxGen
-from boxes import BoxSprite, TickBoxSprite, SpecialSprite
+from engine import TickBox, BreakBox, Special, BoxGen
+from engine import BasicField, TensionBoner, FallingPiece, debone
+from boxes import SpecialSprite, sprite_for
 
 from characters import Character
 
@@ -23,59 +24,6 @@ import textfx
 import config
 import wipes
 import load
-import util
-
-# Manage boning counter for single player mode. Keep track of the number
-# of turns and blocks left, and drop the blocks (randomly) when that
-# number reaches 0. This replaces DropPattern in single player.
-class TensionBoner(object):
-    def __init__(self):
-        self.turns_left = 10
-        self.turns_left_max = 10
-        self.next_boning = 2
-        self.next_boning_max = 2
-
-    # A piece hit the bottom
-    def tick(self):
-        self.turns_left -= 1
-
-    # The player cleared some gems.
-    def debone(self, player, val):
-        self.next_boning -= val
-        if self.next_boning <= 0:
-            player.score.score += (-50 * self.next_boning)
-            self.next_boning_max = self.next_boning_max * (5.0/3.0)
-            self.turns_left_max += 2
-            self.next_boning = int(self.next_boning_max)
-            player.score.score += 100 * self.turns_left
-            self.turns_left = self.turns_left_max
-        return 0
-
-    # No turns left. Drop random blocks.
-    # This shares a lot of code with the DropPattern algorithm.
-    def bone(self):
-        count = self.next_boning
-        rows = []
-        while count >= 15:
-            rows.append([random.choice(COLORS) for i in range(15)])
-            count -= 15
-        if count != 0:
-            possible = range(15)
-            to_fill = []
-            rows.append([random.choice(COLORS) for i in range(15)])
-            while count > 0 and len(possible) > 0:
-                to_fill.append(random.choice(possible))
-                possible.remove(to_fill[-1])
-                count -= 1
-
-            for i in range(len(rows[-1])):
-                if i not in to_fill: rows[-1][i] = None
-            
-        self.next_boning_max = self.next_boning_max * (1.5)
-        self.turns_left_max += 2
-        self.next_boning = int(self.next_boning_max)
-        self.turns_left = self.turns_left_max
-        return rows
 
 # Display messages over the field when things happen. Usually a chain,
 # but sometimes other things.
@@ -107,136 +55,55 @@ class ChainText(Sprite):
             self.rect = self.image.get_rect()
             self._ntime = None
 
-# The boxes that fall down with time.
-class FallingBoxes(Sprite):
-    # Orientation/rotation rules:
-    # There are 4 possible orientations for the boxes:
-    #  2
-    #  1 21  1  12    (left to right, rotate counter-clockwise)
-    #        2
-    #
-    #  0  1  2  3
-
+# Where the hint (see hints.py) says the falling piece should go: its
+# boxes, faint, where they'd land, and the chain they'd set off.
+class Ghost(object):
+    def __init__(self, hint, boxes):
+        self.hint = hint
+        self._blits = []
+        for box, (x, y) in zip(boxes, hint.cells):
+            image = sprite_for(box).image.copy()
+            image.set_alpha(96)
+            self._blits.append((image, [x * 32, y * 32]))
+        if hint.chain > 1 and hint.cells:
+            text = textfx.shadow("%d chain" % hint.chain, 24)
+            x = sum([c[0] for c in hint.cells]) * 32 / len(hint.cells) + 16
+            y = min([c[1] for c in hint.cells]) * 32
+            self._blits.append((text, text.get_rect(midbottom = [x, y])))
+
+    def draw(self, image):
+        for surface, pos in self._blits: image.blit(surface, pos)
+
+# The boxes that fall down with time. The rules for moving them are
+# engine.FallingPiece's; this is how they look.
+class FallingBoxes(FallingPiece, Sprite):
     def __init__(self, box1, box2, field):
         Sprite.__init__(self)
-        self.y = 0
-        self.x = int(field.width / 2)
-        self._box1 = box1
-        self._box2 = box2
-        self._orient = 0
-        self.locked = False
-        self._field = field
+        FallingPiece.__init__(self, box1, box2, field)
+        self._spr1 = sprite_for(box1)
+        self._spr2 = sprite_for(box2)
         self._ntime = None
-        self.bonus = False
         self._render()
 
     # This sprite just appeared on the screen and is now falling.
     def start(self, time): self._ntime = time + 750
 
-    # Predicates to see if we're blocked in the directions we want to go.
-    def _is_blocked_left(self):
-        l = self._get_left()
-        return ((l == 0) or
-                (self._field[self._get_top()][l - 1] or
-                 self._field[self._get_bottom()][l - 1]))
-
-    def _is_blocked_right(self):
-        r = self._get_right()
-        return ((r == self._field.width - 1) or
-                (self._field[self._get_top()][r + 1] or
-                 self._field[self._get_bottom()][r + 1]))
-
-    def _is_blocked_down(self):
-        b = self._get_bottom()
-        return ((b == self._field.height - 1) or
-                (self._field[b + 1][self._get_left()] or
-                 self._field[b + 1][self._get_right()]))
-
-    # Actually go right or left, after checking.
-    def go_left(self):
-        if not (self.locked or self._is_blocked_left()): self.x -= 1
-    def go_right(self):
-        if not (self.locked or self._is_blocked_right()): self.x += 1
-
-    # Go down. If we can't go down, lock ourself in place.
+    # Going down puts off the next fall.
     def go_down(self):
         if not self._is_blocked_down():
             self._ntime = pygame.time.get_ticks() + self._field.speed
-            self.y += 1
-        else:
-            self.locked = True
-            self.bonus = True
-
-    def _get_top(self): return max(0, self.y - int(self._orient == 0))
-    def _get_left(self): return self.x - int(self._orient == 1)
-    def _get_bottom(self): return self.y + int(self._orient == 2)
-    def _get_right(self): return self.x + int(self._orient == 3)
-
-    # Drop our contained boxes onto the field and let them fall.
-    def deposit(self):
-        if self._orient == 0:
-            self._field.add_box([self.x, self.y], self._box1)
-            if self.y != 0:
-                self._field.add_box([self.x, self.y - 1], self._box2)
-        elif self._orient == 1:
-            self._field.add_box([self.x, self.y], self._box1)
-            self._field.add_box([self.x - 1, self.y], self._box2)
-        elif self._orient == 2:
-            self._field.add_box([self.x, self.y], self._box1)
-            self._field.add_box([self.x, self.y + 1], self._box2)
-        elif self._orient == 3:
-            self._field.add_box([self.x, self.y], self._box1)
-            self._field.add_box([self.x + 1, self.y], self._box2)
-        return self._box1, self._box2
+        FallingPiece.go_down(self)
 
-    # When a falling block can't rotate properly, the boxes are
-    # swapped instead of rotated.
-    def _swap(self): self._box1, self._box2 = self._box2, self._box1
+    def _swap(self):
+        FallingPiece._swap(self)
+        self._spr1, self._spr2 = self._spr2, self._spr1
 
-    # Try to rotate the piece; push it away from a wall if we need to;
-    # swap if we can't. Takes the new orientation and as an argument.
     def _rotate(self, new_o):
         if self.locked: return
-        blocked = False
-        pushable = False
-        dx, dy = 0, 0
-        if new_o == 3:
-            blocked = (self._get_right() == self._field.width - 1 or
-                       self._field[self.y][self.x + 1] is not None)
-            pushable = (blocked and
-                        self._get_left() != 0 and
-                        self._field[self.y][self.x - 1] is None)
-            dx = -1
-        elif new_o == 0:
-            blocked = (self._field[self.y - 1][self.x] is not None)
-            pushable = (blocked and
-                        self._field[self.y + 1][self.x] is None)
-            dy = 1
-        elif new_o == 1:
-            blocked = (self._get_left() == 0 or
-                       self._field[self.y][self.x - 1] is not None)
-            pushable = (blocked and
-                        self._get_right() != self._field.width - 1 and
-                        self._field[self.y][self.x + 1] is None)
-            dx = 1
-        elif new_o == 2:
-            blocked = (self.y == self._field.height - 1 or
-                       self._field[self.y + 1][self.x] is not None)
-
         FallingBoxes.rotate_sound.play()
-        if blocked and not pushable:
-            self._swap()
-        else:
-            if pushable:
-                self.x += dx
-                self.y += dy
-            self._orient = new_o
+        FallingPiece._rotate(self, new_o)
         self._render()
 
-    # Rotate clockwise or counterclockwise.
-    def rot_cw(self): self._rotate((self._orient - 1) % 4)
-    def rot_cc(self): self._rotate((self._orient + 1) % 4)
-
     def update(self, time):
         if self._ntime is None: return
         if time > self._ntime:
@@ -260,91 +127,20 @@ class FallingBoxes(Sprite):
         self.image.set_colorkey(self.image.get_at([0, 0]))
 
         if self._orient == 0:
-            self.image.blit(self._box1.image, [0, 32])
-            self.image.blit(self._box2.image, [0, 0])
+            self.image.blit(self._spr1.image, [0, 32])
+            self.image.blit(self._spr2.image, [0, 0])
         elif self._orient == 1:
-            self.image.blit(self._box1.image, [32, 0])
-            self.image.blit(self._box2.image, [0, 0])
+            self.image.blit(self._spr1.image, [32, 0])
+            self.image.blit(self._spr2.image, [0, 0])
         elif self._orient == 2:
-            self.image.blit(self._box1.image, [0, 0])
-            self.image.blit(self._box2.image, [0, 32])
+            self.image.blit(self._spr1.image, [0, 0])
+            self.image.blit(self._spr2.image, [0, 32])
         elif self._orient == 3:
-            self.image.blit(self._box1.image, [0, 0])
-            self.image.blit(self._box2.image, [32, 0])
+            self.image.blit(self._spr1.image, [0, 0])
+            self.image.blit(self._spr2.image, [32, 0])
 
         self.rect = self.image.get_rect()
 
-# A simple non-graphical playing field.
-class BasicField(object):
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
-        self.max_gemsize = 0
-        self.max_chain = 0
-        self._field = [[None] * width for i in range(height)]
-
-    def __getitem__(self, i): return self._field[i]
-    def __iter__(self): return iter(self._field)
-
-    def add_box(self, xy, box):
-        box.move(xy)
-        self._field[box.y][box.x] = box
-
-    # Move all pieces down one step; return True if pieces moved
-    # or False otherwise.
-    def fall(self):
-        could_move = False
-        for i in range(len(self._field) - 2, -1, -1):
-            # Things on the first row won't fall, so we don't
-            # need to check it.
-            for j, box in enumerate(self._field[i]):
-                if (box and not box.is_blocked_down(self)):
-                    box.fall(self)
-                    could_move = True
-        return could_move
-
-    # Tick all ticking boxes; replace them if their time runs out.
-    def tick(self, Box = Box):
-        tickers = filter(lambda b: isinstance(b, TickBox),
-                         util.flatten(self._field))
-        extickers = []
-        for t in tickers:
-            t.tick()
-            if t.time_left == 0:
-                t.remove_from(self)
-                extickers.append(t)
-                b = Box(t.color, [t.x, t.y])
-                self.add_box([t.x, t.y], b)
-        return tickers, extickers
-
-    def pick_up(self, special): pass
-
-    # BasicField doesn't know what a "player" is, so it can't
-    # give a bonus.
-    def tech_bonus(self): pass
-
-    # Try to merge boxes into bigger ones; return True if one
-    # merged successfully (only merges one)
-    def merge(self):
-        boxes = filter(lambda b: isinstance(b, Box),
-                       util.flatten(self._field))
-        boxes.sort(lambda a, b: cmp(b.y, a.y) and cmp(a.x, b.x))
-        for box in boxes:
-            dead = box.try_merge(self)
-            if len(dead) > 0: return dead
-        return []
-
-    # Break everything that will break; return the "value" of
-    # the broken 
-    def breaking(self):
-        breakers = filter(lambda b: isinstance(b, BreakBox),
-                          util.flatten(self._field))
-        killed_count = sum([b.try_crash(self) for b in breakers
-                            if not b.crashed])
-        dead = filter(lambda b: b and b.crashed, util.flatten(self._field))
-        for box in dead: box.remove_from(self)
-        return killed_count, dead
-
 # Graphics for the above field, and a state machine to manage gameplay.
 class Field(BasicField, Sprite):
     # The six stages of each "turn":
@@ -366,15 +162,16 @@ class Field(BasicField, Sprite):
         BasicField.__init__(self, width, height)
         Sprite.__init__(self)
         self._sprites = RenderUpdates()
+        self._box_sprites = {}
         self.falling = None
         self._break_time = None
         self.speed = config.getint("settings", "speed")
-        self._field = [[None] * width for i in range(height)]
         self._player = player
         self.state = Field.FIXING1
         self._insrow = int((width / 2))
         self._ntime = pygame.time.get_ticks()
         self._broke_any_last = False
+        self._falls = None
         self._killed = 0
         self._disease = HEALTHY
         self._disease_end = 0
@@ -436,14 +233,17 @@ class Field(BasicField, Sprite):
     image = property(_get_image)
 
     def clear(self):
-        self._field = [[None] * self.width for i in range(self.height)]
+        BasicField.clear(self)
+        self._falls = None
         self._sprites.empty()
+        self._box_sprites = {}
 
     def _render(self):
         image = pygame.Surface([self.width * 32, self.height * 32])
         image.set_colorkey(image.get_at([0, 0]))
         self._sprites.draw(image)
         if self.falling:
+            if self._player.ghost: self._player.ghost.draw(image)
             image.blit(self.falling.image, self.falling.rect)
         self._image = pygame.Surface([self.width * 32 + 20,
                                       self.height * 32 + 20])
@@ -454,10 +254,20 @@ class Field(BasicField, Sprite):
     def pick_up(self, special):
         self._player.pick_up(special)
 
-    # Remove has to be done by the box itself, but this we can do here...
-    def add_box(self, xy, box):
-        BasicField.add_box(self, xy, box)
-        self._sprites.add(box)
+    # The boxes themselves don't know how to draw; we keep a sprite for
+    # each box we're showing, by its id, and move it when the box moves.
+    def place(self, box):
+        BasicField.place(self, box)
+        spr = self._box_sprites.get(id(box))
+        if spr is None:
+            spr = self._box_sprites[id(box)] = sprite_for(box)
+            self._sprites.add(spr)
+        spr.sync()
+
+    # Stop showing a box that's gone from the field.
+    def _kill(self, box):
+        spr = self._box_sprites.pop(id(box), None)
+        if spr is not None: spr.kill()
 
     def move(self, ev):
         if self._disease == REVERSE:
@@ -486,27 +296,36 @@ class Field(BasicField, Sprite):
             self.speed = max(250, self.speed - 5)
             self.state = Field.FIXING1
             self._ntime = time + 20
+            self._player.placed(self.falling, time)
             self.falling.deposit()
             self.falling = None
 
+    # Replay the result of settle() one row at a time, so things still
+    # look like they fall. Work out the distances on the first step and
+    # then just count them down; return True if anything moved.
+    def _fall_step(self):
+        if self._falls is None: self._falls = self.drops()
+        falls = self._falls
+        self._falls = [(box, dist - 1) for box, dist in falls if dist > 1]
+        # Lowest first, so the space below each box is already clear.
+        for box, dist in falls: box.fall(self)
+        if len(falls) == 0: self._falls = None
+        return len(falls) != 0
+
     def _state_fixing1(self, time):
-        # Strictly speaking, this loop is overkill, since we know
-        # that at most one thing will fall...
-        # So, if we need to, optimize this by using the return
-        # value of deposit later.
         if time > self._ntime: 
             self._ntime = time + 20
-            if not self.fall(): self.state = Field.TICKING
+            if not self._fall_step(): self.state = Field.TICKING
 
     def _state_ticking(self, time):
-        tickers, extickers = self.tick(BoxSprite)
+        tickers, extickers = self.tick()
         if len(tickers) != 0: TickBox.sound.play()
-        for t in extickers: t.kill()
+        for t in extickers: self._kill(t)
         self.state = Field.MERGING
 
     def _state_merging(self, time):
         dead = self.merge()
-        for spr in dead: spr.kill()
+        for box in dead: self._kill(box)
         if len(dead) == 0: self.state = Field.BREAKING
 
     def _state_breaking(self, time):
@@ -522,7 +341,7 @@ class Field(BasicField, Sprite):
             else:
                 self.state = Field.FIXING2
         elif time > self._break_time:
-            for spr in self._dead: spr.kill()
+            for box in self._dead: self._kill(box)
             self._break_time = None
             self.state = Field.FIXING2
 
@@ -539,7 +358,7 @@ class Field(BasicField, Sprite):
         # and falling...
         elif time > self._ntime: 
             self._ntime = time + 20
-            if not self.fall():
+            if not self._fall_step():
                 self._chain += 1
                 if self._chain > 1:
                     self.max_chain = max(self.max_chain, self._chain)
@@ -549,10 +368,7 @@ class Field(BasicField, Sprite):
     def _state_boning(self, time):
         for x, box in enumerate(self._player.get_boning_row()):
             if box:
-                if self._field[0][x] is None:
-                    self._field[0][x] = box
-                    box.move([x, 0])
-                    self._sprites.add(box)
+                if self._field[0][x] is None: self.add_box([x, 0], box)
         self.state = Field.BONING2
         self._ntime = time
 
@@ -678,6 +494,14 @@ class Score(Sprite):
     score = property(_get_score, _set_score)
 
 class AbstractPlayer(object):
+    # Where the hint service says our piece should go, if we're getting
+    # hints.
+    ghost = None
+    _hints = None
+    # Each piece the player puts down, if we're recording (see
+    # review.py).
+    _recording = None
+
     def __init__(self, pid, char):
         self._pid = pid
         self.char = char
@@ -756,6 +580,21 @@ class AbstractPlayer(object):
         self.sprites = RenderUpdates([self.field,self._next_disp,self.score])
         self._next_disp.set_next(self._next)
 
+        self._hint_for = self.ghost = None
+        if not self.is_ai and config.getboolean("settings", "hints"):
+            import hints
+            self._hints = hints.service(self._pid)
+            self._hints.cancel()
+        else: self._hints = None
+
+        if not self.is_ai and config.getboolean("settings", "record_matches"):
+            import review
+            self._recording = review.Recording(self.char.name,
+                                               self.field.width,
+                                               self.field.height)
+            self._started = pygame.time.get_ticks()
+        else: self._recording = None
+
     def reset(self):
         self.dead = False
 
@@ -777,7 +616,47 @@ class AbstractPlayer(object):
     def deboning(self, value): abstract
     def enqueue(self, value): abstract
 
+    # Keep the hint up with the piece that's falling: ask about each
+    # new one (which cancels the last), and show the answer once it
+    # comes.
+    def _update_hint(self):
+        falling = self.field.falling
+        if falling is not self._hint_for:
+            self._hint_for = falling
+            self.ghost = None
+            if falling is None: self._hints.cancel()
+            else:
+                import ai
+                self._hint_boxes = [falling._box1, falling._box2]
+                self._hints.ask(self.field, self._hint_boxes,
+                                [self._next._box1, self._next._box2],
+                                (falling.x, falling.y, falling._orient),
+                                ai.boning_rows(self._pending_boning))
+        elif falling is not None and self.ghost is None:
+            hint = self._hints.poll()
+            if hint is not None: self.ghost = Ghost(hint, self._hint_boxes)
+
+    # The falling piece has locked where it is, and is about to be put
+    # down.
+    def placed(self, falling, time):
+        if self._recording is None: return
+        import ai
+        self._recording.add(time - self._started, self.field,
+                            [falling._box1, falling._box2],
+                            (falling.x, falling.y, falling._orient),
+                            [self._next._box1, self._next._box2],
+                            ai.boning_rows(self._pending_boning))
+
+    # The match is over; save the recording, if we're making one.
+    def finish(self):
+        if self._recording is None: return
+        self._recording.dead = self.dead
+        try: print "Recorded in %s." % self._recording.save()
+        except EnvironmentError, err: print "Couldn't record match: %s" % err
+        self._recording = None
+
     def update(self, time):
+        if self._hints: self._update_hint()
         self.sprites.update(time)
 
 class VersusPlayer(AbstractPlayer):
@@ -805,7 +684,7 @@ class VersusPlayer(AbstractPlayer):
         for row in rows:
             self.drop_count.count += (len(row) - row.count(None))
             # Hacky -- the and acts like a conditional.
-            row = [(c and TickBoxSprite(c, [-1, -1])) for c in row]
+            row = [(c and TickBox(c, [-1, -1])) for c in row]
             self._pending_boning.append(row)
 
     def distribute_boning(self, value):
@@ -830,25 +709,13 @@ class VersusPlayer(AbstractPlayer):
         
 
     def deboning(self, value):
-        if len(self._pending_boning) == 0: return value
-
         rows = self._pending_boning
-        total = sum([len(row) - row.count(None) for row in rows])
-        half_time = False
-        if value >= total: half_time = True
-        while value > 0:
-            if len(rows) == 0: break
-            for i in range(len(rows[-1])):
-                if rows[-1] is not None and value > 0:
-                    rows[-1][i] = None
-                    value -= 2
-                    self.drop_count.count -= 1
-            if rows[-1].count(None) == len(rows[-1]): rows.pop()
-        if half_time:
-            for row in rows:
-                for box in row:
-                    if isinstance(box, TickBox): box.time_left = 3
-        return max(0, value)
+        # The count goes down by one for each place debone cancels: two
+        # points each, as far as the rows go.
+        if rows and value > 0:
+            places = sum([len(row) for row in rows])
+            self.drop_count.count -= min(places, int(-(-value // 2)))
+        return debone(rows, value)
 
 class AIPlayer(VersusPlayer):
     AIS = { STUPID: "StupidAI",
@@ -856,7 +723,9 @@ class AIPlayer(VersusPlayer):
             EASY: "EasyAI",
             NORMAL: "NormalAI",
             HARD: "HardAI",
-            INSANE: "InsaneAI" }
+            INSANE: "InsaneAI",
+            EXPERT: "ExpertAI",
+            MASTER: "MasterAI" }
     
     def __init__(self, pid, char, ai_name = None):
         # I, for one, welcome our new robot overlords.
@@ -864,24 +733,101 @@ class AIPlayer(VersusPlayer):
         self.is_ai = True
         import ai
         if ai_name == None:
-            ai_name = AIPlayer.AIS[config.getint("settings", "ai")]
+            level = config.getint("settings", "ai")
+            # After our own AIs come the profiles (see config.set_ai).
+            profile = level - len(AIPlayer.AIS)
+            if level in AIPlayer.AIS: ai_name = AIPlayer.AIS[level]
+            elif profile < len(ai.PROFILE_NAMES):
+                ai_name = ai.PROFILE_NAMES[profile]
+            else: ai_name = AIPlayer.AIS[NORMAL]
         self._ai = ai.__dict__[ai_name](self)
+        self._ai.resize_table(config.getint("settings", "ai_table_size"))
+        if isinstance(self._ai, ai.MCTSAI):
+            self._ai.deadline = config.getint("settings", "mcts_time") / 1000.0
+            self._ai.max_nodes = config.getint("settings", "mcts_nodes")
 
     def start(self, *args):
         VersusPlayer.start(self, *args)
         self._iter = None
+        self._pending = None
         self._goal = None
         self._moved = False
         self._aimove_ntime = 0
-
+        self._spec = None
+        self._spec_pending = None
+        self._guess = None
+
+    # Think about the new piece in a worker process if we can; otherwise
+    # a bit at a time in update. If we already worked out where it goes
+    # while the last one was falling, and things turned out the way we
+    # thought, there's nothing to think about.
     def tick(self):
-        self._ai.incoming(self.field, self.field.falling)
-        self._iter = iter(self._ai)
+        import ai
+        falling = self.field.falling
+        at = (falling.x, falling.y, falling._orient)
+        guess = self._guess
+        self._spec = self._spec_pending = self._guess = None
+        self._iter = None
+        self._pending = None
+        self._box1 = falling._box1
         self._goal = None
         self._moved = False
+        # An AI that thinks about boning needs to think again if some
+        # is on its way.
+        if (guess and not self._ai.looks_ahead and
+            not (self._ai.garbage and self._pending_boning) and guess[0] ==
+            self._ai.situation(self.field, [falling._box1, falling._box2],
+                               at)):
+            self._goal = guess[1]
+            return
+        self._pending = ai.decide_async(self._ai, self.field, falling,
+                                        self._next,
+                                        config.getint("settings",
+                                                      "ai_workers"))
+        if self._pending is None: self._think_here()
+
+    def _think_here(self):
+        self._ai.incoming(self.field, self.field.falling, self._next)
+        self._iter = iter(self._ai)
+
+    # The piece is on its way to where it's going, so we know how the
+    # field will look once it's landed, unless something gets dropped on
+    # us first. Start thinking about the next piece landing there.
+    def _speculate(self, move):
+        import ai
+        if self._pending_boning or not self._ai.speculates: return
+        workers = config.getint("settings", "ai_workers")
+        # An AI that looks ahead never goes by the guess, only by what
+        # working it out leaves in its table. In a pool that's whichever
+        # worker was free, and the real piece could wait behind it.
+        if self._ai.looks_ahead and ai.pool(workers) is not None: return
+        falling = self.field.falling
+        if falling._box1 is self._box1: other = falling._box2
+        else: other = falling._box1
+        field = ai.AIField(self.field)
+        if not field.drop([self._box1.copy(), other.copy()],
+                          move[1], move[0]): return
+        field.take_turn()
+        if self._ai.in_book(field): return
+        boxes = [self._next._box1, self._next._box2]
+        at = (self._next.x, self._next.y, self._next._orient)
+        self._guess_key = self._ai.situation(field, boxes, at)
+        self._spec_pending = ai.setup_async(self._ai, field, boxes, None, at,
+                                            workers)
+        if self._spec_pending is None:
+            self._spec = self._ai.speculate(field, boxes, at)
 
     def update(self, time):
         VersusPlayer.update(self, time)
+        if self._pending and self._pending.ready():
+            try:
+                self._goal = self._pending.get()
+                self._aimove_ntime = time - 1
+            except Exception:
+                # The worker died or broke; work it out ourselves.
+                self._think_here()
+            self._pending = None
+
         if self._iter:
             move = self._iter.next()
             if move != None:
@@ -889,14 +835,35 @@ class AIPlayer(VersusPlayer):
                 self._goal = move
                 self._aimove_ntime = time - 1
 
+        if self._spec_pending and self._spec_pending.ready():
+            try: self._guess = (self._guess_key, self._spec_pending.get())
+            except Exception: pass
+            self._spec_pending = None
+
+        if self._spec:
+            move = self._spec.next()
+            if move != None:
+                self._spec = None
+                self._guess = (self._guess_key, move)
+
         if self._goal and time > self._aimove_ntime and self.field.falling:
-            if self._goal[0] != self.field.falling._orient:
+            keys = self._ai.route(self.field, self.field.falling,
+                                  self._goal, self._box1)
+            if keys:
+                events.post(Event(PLAYER, key = keys[0], player = self._pid))
+            elif keys is not None:
+                self._speculate(self._goal)
+                self._goal = None
+                self._moved = True
+            # It can't get there (any more); head that way anyway.
+            elif self._goal[0] != self.field.falling._orient:
                 events.post(Event(PLAYER, key = ROT_CC, player = self._pid))
             elif self._goal[1] < self.field.falling.x:
                 events.post(Event(PLAYER, key = LEFT, player = self._pid))
             elif self._goal[1] > self.field.falling.x:
                 events.post(Event(PLAYER, key = RIGHT, player = self._pid))
             else:
+                self._speculate(self._goal)
                 self._goal = None
                 self._moved = True
             self._aimove_ntime = time + self._ai.delta
@@ -939,7 +906,7 @@ class SinglePlayer(AbstractPlayer):
     def enqueue(self, rows):
         for row in rows:
             # Hacky -- the and acts like a conditional.
-            row = [(c and TickBoxSprite(c, [-1, -1])) for c in row]
+            row = [(c and TickBox(c, [-1, -1])) for c in row]
             self._pending_boning.append(row)
 
     def deboning(self, value):
@@ -1057,6 +1024,7 @@ class Game(object):
                     pygame.display.update(p.sprites.draw(screen))
 
             pygame.time.clock.tick(60)
+        for p in self._players: p.finish()
         pygame.key.set_repeat(200, 75)
         events.DELAY = 200
 
@@ -0,0 +1,159 @@
+# hints.py -- telling human players where their piece should go
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# A hint is where an AI (HINT_AI) would put the piece a player has
+# falling, given the piece after it, and what that would do: the gems
+# it would break and the chain it would set off.
+#
+# Each player asking for hints gets a service that does the thinking
+# in a process of its own, so the game loop only ever sends it the
+# position and checks for an answer. Asking about a new piece cancels
+# the one before: the worker looks for new work every time the AI
+# stops to let the game have a turn (a few milliseconds), and drops
+# what it was doing. Without multiprocessing, the service thinks in
+# the game instead, a step a frame, as AIPlayer does.
+
+from engine import BasicField, freeze, thaw
+import ai
+
+# Python 2.6 and later can think in other processes.
+try: import multiprocessing
+except ImportError: multiprocessing = None
+
+HINT_AI = "ExpertAI"
+
+# Where to go and what it does. cells are where each of the boxes of
+# the falling piece would land (as (x, y), in the order they were
+# given), before anything breaks.
+class Hint(object):
+    def __init__(self, move, value, chain, cells):
+        self.move = move
+        self.value = value
+        self.chain = chain
+        self.cells = cells
+
+# Drop falling on field by move, and see what happens.
+def analyse(field, falling, move):
+    field = ai.AIField(field)
+    boxes = [b.copy() for b in falling]
+    if not field.drop(boxes, move[1], move[0]): return None
+    field.settle()
+    cells = [(b.x, b.y) for b in boxes]
+    value = field.take_turn()
+    return Hint(move, value, field.chain, cells)
+
+# The position, as plain tuples a worker can be sent (as in
+# ai.setup_async).
+def _job(field, falling, nextpiece, at, boning):
+    boxes = []
+    for y, row in enumerate(field):
+        for x, box in enumerate(row):
+            if box is not None and box.x == x and box.y == y:
+                boxes.append(freeze(box))
+    if nextpiece: nextpiece = map(freeze, nextpiece)
+    else: nextpiece = None
+    return (field.width, field.height, boxes, map(freeze, falling),
+            nextpiece, at, boning)
+
+# Each process keeps one AI, so its transposition table lasts.
+_ai = None
+
+# Think about a position from _job; yields None while thinking, like
+# an AI, then the Hint.
+def _think(width, height, boxes, falling, nextpiece, at, boning):
+    global _ai
+    if _ai is None: _ai = getattr(ai, HINT_AI)(None)
+    field = BasicField(width, height)
+    for state in boxes: field.place(thaw(state))
+    falling = map(thaw, falling)
+    if nextpiece is not None: nextpiece = map(thaw, nextpiece)
+    _ai.setup(field, falling, nextpiece, at, boning)
+    for move in _ai:
+        if move is None: yield None
+        else:
+            yield analyse(field, falling, move)
+            return
+
+_CANCEL, _QUIT = "cancel", "quit"
+
+# The worker: think about each (serial,) + _job it's sent, and send
+# back (serial, hint), unless something newer comes in first.
+def _serve(conn):
+    try:
+        job = conn.recv()
+        while job != _QUIT:
+            if job == _CANCEL: job = None
+            else:
+                serial, args = job[0], job[1:]
+                job = None
+                for hint in _think(*args):
+                    if conn.poll():
+                        job = conn.recv()
+                        break
+                    elif hint is not None:
+                        conn.send((serial, hint))
+                        break
+            if job is None: job = conn.recv()
+    except (EOFError, KeyboardInterrupt): pass
+
+class HintService(object):
+    def __init__(self):
+        self._serial = 0
+        self._iter = None
+        self.hint = None
+        if multiprocessing is None: self._conn = self._process = None
+        else:
+            self._conn, child = multiprocessing.Pipe()
+            self._process = multiprocessing.Process(target = _serve,
+                                                    args = (child,))
+            self._process.daemon = True
+            self._process.start()
+
+    # A new piece is falling at (x, y, orientation) on field; start
+    # thinking about it, and forget about the last one.
+    def ask(self, field, falling, nextpiece = None, at = None,
+            boning = None):
+        self._serial += 1
+        self.hint = None
+        job = _job(field, falling, nextpiece, at, boning)
+        if self._conn is None: self._iter = _think(*job)
+        else: self._conn.send((self._serial,) + job)
+
+    # Stop thinking about the last piece, without starting on another.
+    def cancel(self):
+        self._serial += 1
+        self.hint = None
+        self._iter = None
+        if self._conn is not None: self._conn.send(_CANCEL)
+
+    # Get on with it; returns the Hint for the piece last asked about,
+    # or None if it isn't known yet (or the piece was cancelled).
+    def poll(self):
+        if self._iter is not None:
+            try: hint = self._iter.next()
+            except StopIteration: hint = self._iter = None
+            if hint is not None:
+                self._iter = None
+                self.hint = hint
+        elif self._conn is not None:
+            while self._conn.poll():
+                serial, hint = self._conn.recv()
+                if serial == self._serial: self.hint = hint
+        return self.hint
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.send(_QUIT)
+            self._process.join()
+            self._conn = self._process = None
+        self._iter = None
+
+# One service per player, started the first time they ask, and kept
+# from game to game.
+_services = {}
+
+def service(pid):
+    if pid not in _services: _services[pid] = HintService()
+    return _services[pid]
@@ -0,0 +1,377 @@
+# planes.py -- a compact, array-backed playing field
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# BasicField keeps a grid of box objects, and every pass over it calls
+# methods on each of them. PlaneField keeps the same game in a handful
+# of flat typed arrays ("planes"), one entry per cell, indexed by
+# y * width + x:
+#
+#   color   - index into PLANE_COLORS, or -1 for an empty cell
+#   kind    - one of the kinds from engine.py (EMPTY, BOX, ...)
+#   crystal - the cell index of the top-left corner of the gem here
+#   cw, ch  - the width and height of the gem here (1, 1 unless a crystal)
+#   extra   - turns left for a TickBox, the special for a Special
+#
+# The rules are the same as BasicField's (tests/test_planes.py checks
+# them against AIField's). A PlaneField can be built from any field,
+# and turned back into boxes or read as field[y][x] itself, so anything
+# that takes a field (AIField, BatchField, ...) can take a PlaneField,
+# and anything that wants objects can have them as a view on top.
+# Copying one is a few array copies rather than one object per gem.
+
+import array
+
+from engine import Box, BreakBox, Special, Diamond, TickBox
+from engine import EMPTY, BOX, BREAK, SPECIAL, DIAMOND, TICK
+from constants import COLORS
+
+# Colors are stored as their index into this list.
+PLANE_COLORS = COLORS + ["gray", "diamond"]
+COLOR_IDS = dict([(c, i) for i, c in enumerate(PLANE_COLORS)])
+
+_CLASSES = { BOX: Box, BREAK: BreakBox, SPECIAL: Special,
+             DIAMOND: Diamond, TICK: TickBox }
+
+class PlaneField(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.max_gemsize = 0
+        self.max_chain = 0
+        n = width * height
+        self.color = array.array("b", [-1]) * n
+        self.kind = array.array("b", [EMPTY]) * n
+        self.crystal = array.array("h", [-1]) * n
+        self.cw = array.array("b", [0]) * n
+        self.ch = array.array("b", [0]) * n
+        self.extra = array.array("b", [0]) * n
+
+    # Build a PlaneField holding the same gems as a BasicField (or
+    # anything else that can be indexed as field[y][x]).
+    def from_field(cls, field):
+        planes = cls(field.width, field.height)
+        planes.max_gemsize = field.max_gemsize
+        planes.max_chain = field.max_chain
+        for y in range(field.height):
+            for x in range(field.width):
+                box = field[y][x]
+                # Only add a box at its topleft.
+                if box is not None and box.x == x and box.y == y:
+                    planes.add_box([x, y], box)
+        return planes
+
+    from_field = classmethod(from_field)
+
+    def copy(self):
+        planes = PlaneField.__new__(PlaneField)
+        planes.__dict__.update(self.__dict__)
+        for name in ["color", "kind", "crystal", "cw", "ch", "extra"]:
+            setattr(planes, name, getattr(self, name)[:])
+        return planes
+
+    def add_box(self, xy, box):
+        if box.kind == TICK: extra = box.time_left
+        elif box.kind == SPECIAL: extra = box.special
+        else: extra = 0
+        self._put(xy[1] * self.width + xy[0], box.kind, COLOR_IDS[box.color],
+                  box.size[0], box.size[1], extra)
+
+    # Turn the planes back into (non-sprite) boxes, for display or for
+    # code that wants to work with objects.
+    def boxes(self):
+        boxes = []
+        for i in range(self.width * self.height):
+            if self.kind[i] != EMPTY and self.crystal[i] == i:
+                xy = [i % self.width, i / self.width]
+                color = PLANE_COLORS[self.color[i]]
+                if self.kind[i] == SPECIAL:
+                    box = Special(color, xy, self.extra[i])
+                else: box = _CLASSES[self.kind[i]](color, xy)
+                if self.kind[i] == TICK: box.time_left = self.extra[i]
+                box.size = [self.cw[i], self.ch[i]]
+                boxes.append(box)
+        return boxes
+
+    # The same boxes laid out as field[y][x], a gem in every cell it
+    # covers, so a PlaneField can be read anywhere a BasicField can be
+    # (AIField(planes), BatchField.from_fields, ...). It's a copy, so
+    # changing it doesn't change the planes.
+    def rows(self):
+        rows = [[None] * self.width for y in range(self.height)]
+        for box in self.boxes():
+            for y in range(box.y, box.y + box.size[1]):
+                for x in range(box.x, box.x + box.size[0]): rows[y][x] = box
+        return rows
+
+    def __getitem__(self, y): return self.rows()[y]
+    def __iter__(self): return iter(self.rows())
+
+    # Fill in a gem whose top-left cell is i.
+    def _put(self, i, kind, color, w, h, extra):
+        for y in range(h):
+            for j in range(i + y * self.width, i + y * self.width + w):
+                self.kind[j] = kind
+                self.color[j] = color
+                self.crystal[j] = i
+                self.cw[j] = w
+                self.ch[j] = h
+                self.extra[j] = extra
+
+    # Empty out the gem whose top-left cell is i.
+    def _clear(self, i):
+        w, h = self.cw[i], self.ch[i]
+        for y in range(h):
+            for j in range(i + y * self.width, i + y * self.width + w):
+                self.kind[j] = EMPTY
+                self.color[j] = -1
+                self.crystal[j] = -1
+                self.cw[j] = 0
+                self.ch[j] = 0
+                self.extra[j] = 0
+
+    def _move(self, i, j):
+        kind, color, extra = self.kind[i], self.color[i], self.extra[i]
+        w, h = self.cw[i], self.ch[i]
+        self._clear(i)
+        self._put(j, kind, color, w, h, extra)
+
+    # Drop everything as far as it will go, in one pass from the bottom
+    # up, like BasicField.settle. floor[x] is the highest occupied row
+    # seen so far in column x. Returns (new top-left cell, distance)
+    # pairs for the gems that moved, lowest first.
+    def settle(self):
+        w = self.width
+        floor = [self.height] * w
+        moved = []
+        for y in range(self.height - 1, -1, -1):
+            for x in range(w):
+                i = y * w + x
+                if self.kind[i] == EMPTY: continue
+                top = self.crystal[i]
+                # Look at each gem once, from its bottom-left cell.
+                if top % w != x or top / w + self.ch[i] - 1 != y: continue
+                gw = self.cw[i]
+                dist = min(floor[x:x + gw]) - 1 - y
+                if dist > 0:
+                    self._move(top, top + dist * w)
+                    moved.append((top + dist * w, dist))
+                for col in range(x, x + gw):
+                    floor[col] = top / w + dist
+        return moved
+
+    def pick_up(self, special): pass
+    def tech_bonus(self): pass
+
+    # Tick all ticking boxes; turn them into normal boxes if their time
+    # runs out. Returns the cells ticked and the cells that ran out.
+    def tick(self):
+        tickers, extickers = [], []
+        for i in range(self.width * self.height):
+            if self.kind[i] == TICK:
+                tickers.append(i)
+                self.extra[i] -= 1
+                if self.extra[i] == 0:
+                    self.kind[i] = BOX
+                    extickers.append(i)
+        return tickers, extickers
+
+    # Top-left cells of the gems along each side of the gem at i, one
+    # entry per cell (so large gems show up more than once), like
+    # AbstractBox's _adj_* methods.
+    def _adj_top(self, i):
+        w = self.width
+        if i < w: return []
+        return [self.crystal[j] for j in range(i - w, i - w + self.cw[i])
+                if self.kind[j] != EMPTY]
+
+    def _adj_bottom(self, i):
+        w = self.width
+        b = i + self.ch[i] * w
+        if b >= w * self.height: return []
+        return [self.crystal[j] for j in range(b, b + self.cw[i])
+                if self.kind[j] != EMPTY]
+
+    def _adj_left(self, i):
+        w = self.width
+        if i % w == 0: return []
+        return [self.crystal[j]
+                for j in range(i - 1, i - 1 + self.ch[i] * w, w)
+                if self.kind[j] != EMPTY]
+
+    def _adj_right(self, i):
+        w = self.width
+        r = i + self.cw[i]
+        if r % w == 0: return []
+        return [self.crystal[j] for j in range(r, r + self.ch[i] * w, w)
+                if self.kind[j] != EMPTY]
+
+    def _adjacent(self, i):
+        return (self._adj_left(i) + self._adj_right(i) +
+                self._adj_top(i) + self._adj_bottom(i))
+
+    # Same checks as Box.try_merge, on cell indices; returns the cells
+    # of the gems absorbed.
+    def _try_merge(self, i):
+        w = self.width
+        x, y = i % w, i / w
+        color = self.color[i]
+        cw, ch = self.cw[i], self.ch[i]
+        if cw == 1 and ch == 1:
+            if x == w - 1 or y == self.height - 1: return []
+            others = [i + 1, i + w, i + w + 1]
+            for j in others:
+                if (self.kind[j] != BOX or self.color[j] != color or
+                    self.cw[j] != 1 or self.ch[j] != 1):
+                    return []
+            for j in others: self._clear(j)
+            self._put(i, BOX, color, 2, 2, 0)
+            return others
+
+        for side in range(4):
+            if side == 0: blocks = self._adj_top(i)
+            elif side == 1: blocks = self._adj_bottom(i)
+            elif side == 2: blocks = self._adj_left(i)
+            else: blocks = self._adj_right(i)
+            if len(blocks) != [cw, cw, ch, ch][side]: continue
+            ok = True
+            for j in blocks:
+                if self.kind[j] != BOX or self.color[j] != color:
+                    ok = False
+                    break
+            if not ok: continue
+            first, last = blocks[0], blocks[-1]
+            if side == 0:
+                ok = ([j for j in blocks if j / w != first / w] == [] and
+                      first % w == x and
+                      last % w + self.cw[last] == x + cw)
+            elif side == 1:
+                bot = first / w + self.ch[first]
+                ok = ([j for j in blocks
+                       if j / w + self.ch[j] != bot] == [] and
+                      first % w == x and
+                      last % w + self.cw[last] == x + cw)
+            elif side == 2:
+                ok = ([j for j in blocks if j % w != first % w] == [] and
+                      first / w == y and
+                      last / w + self.ch[last] == y + ch)
+            else:
+                right = first % w + self.cw[first]
+                ok = ([j for j in blocks
+                       if j % w + self.cw[j] != right] == [] and
+                      first / w == y and
+                      last / w + self.ch[last] == y + ch)
+            if not ok: continue
+
+            dead = []
+            for j in blocks:
+                if j not in dead: dead.append(j)
+            if side == 0:
+                top, nw, nh = first, cw, y + ch - first / w
+            elif side == 1:
+                top, nw, nh = i, cw, first / w + self.ch[first] - y
+            elif side == 2:
+                top, nw, nh = first, x + cw - first % w, ch
+            else:
+                top, nw, nh = i, first % w + self.cw[first] - x, ch
+            for j in dead: self._clear(j)
+            self._clear(i)
+            self._put(top, BOX, color, nw, nh, 0)
+            return dead
+        return []
+
+    # Try to merge gems into bigger ones, in the same order as
+    # BasicField.merge (each cell's gem, sorted the same way); return
+    # the cells removed (only merges one).
+    def merge(self):
+        w = self.width
+        boxes = [self.crystal[i] for i in range(w * self.height)
+                 if self.kind[i] == BOX]
+        boxes.sort(lambda a, b: cmp(b / w, a / w) and cmp(a % w, b % w))
+        for i in boxes:
+            dead = self._try_merge(i)
+            if len(dead) > 0: return dead
+        return []
+
+    # Same as AbstractBox.crash (including Special and TickBox), on cell
+    # indices. Walks with an explicit stack rather than recursing.
+    def _crash(self, i, gem_color, immed, crashed):
+        if i in crashed: return 0
+        elif self.kind[i] == TICK:
+            if immed: return 0
+            crashed[i] = True
+            return 0.5
+        elif self.color[i] != gem_color: return 0
+
+        broken = 0
+        crashed[i] = True
+        stack = [(i, iter(self._adjacent(i)))]
+        while stack:
+            j, adj = stack[-1]
+            for k in adj:
+                if k in crashed: continue
+                elif self.kind[k] == TICK:
+                    crashed[k] = True
+                    broken += 0.5
+                elif self.color[k] == self.color[j]:
+                    crashed[k] = True
+                    stack.append((k, iter(self._adjacent(k))))
+                    break
+            else:
+                stack.pop()
+                cw, ch = self.cw[j], self.ch[j]
+                broken += cw * ch * ((cw + ch) / 2)
+                if cw != 1 or ch != 1:
+                    self.max_gemsize = max(self.max_gemsize, cw * ch)
+                if self.kind[j] == SPECIAL: self.pick_up(self.extra[j])
+        return broken
+
+    def _diamond(self, i, crashed):
+        crashed[i] = True
+        if i / self.width == self.height - 1:
+            self.tech_bonus()
+            return 0
+        color = self.color[i + self.width]
+        broken = 0
+        for j in range(self.width * self.height):
+            if self.color[j] != color: continue
+            elif self.kind[j] == TICK:
+                broken += 0.5
+                crashed[self.crystal[j]] = True
+            elif self.kind[j] != EMPTY:
+                broken += 1
+                crashed[self.crystal[j]] = True
+        return broken
+
+    # Break everything that will break; return the "value" of the
+    # broken gems and the cells they were in.
+    def breaking(self):
+        crashed = {}
+        killed_count = 0
+        for i in range(self.width * self.height):
+            if i in crashed: continue
+            elif self.kind[i] == BREAK:
+                for j in self._adjacent(i):
+                    killed_count += self._crash(j, self.color[i], True,
+                                                crashed)
+            elif self.kind[i] == DIAMOND:
+                killed_count += self._diamond(i, crashed)
+        dead = crashed.keys()
+        dead.sort()
+        for i in dead: self._clear(i)
+        return killed_count, dead
+
+    # Take a turn (move all pieces down, tick, merge, break, repeat),
+    # like AIField.take_turn. Returns the value of gems broken.
+    def take_turn(self):
+        self.settle()
+        self.tick()
+        while self.merge(): pass
+        value, dead = self.breaking()
+        while len(dead) > 0:
+            self.settle()
+            while self.merge(): pass
+            newv, dead = self.breaking()
+            value += newv
+        return value
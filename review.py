@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# review.py -- going over recorded matches, move by move
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# With record_matches on (in the settings), each human player's pieces
+# are saved as they land, one file per player per match, in MATCHES.
+# This plays every one of them again and compares it with the best
+# place the piece could have gone, and prints how each match went as
+# a timeline of the points lost on each move. Usage:
+#   review.py [--workers N] [--worst N] [MATCH ...]
+# With no matches given, it reviews the last one recorded.
+#
+# A move is worth the points (100 a gem, as the game scores them) it
+# breaks, and the most the piece after it could then break, since the
+# player could see that one coming. The best move is the one worth
+# most, out of those the piece could get to from where it came in;
+# what a move is worth less than that is the points lost. A move that
+# leaves no room for the next piece loses the game, which is worse
+# than any number of points. The rows on their way when the piece
+# landed are played out after it, as the game would.
+#
+# Every move of every match is worked out separately, so they're all
+# done in one pass, in a pool of worker processes if we can.
+
+import os, sys, time
+
+try: import cPickle as pickle
+except ImportError: import pickle
+
+# Python 2.6 and later can review several moves at once.
+try: import multiprocessing
+except ImportError: multiprocessing = None
+
+import ai
+from engine import BasicField, freeze, thaw
+
+if os.name == "posix":
+    MATCHES = os.path.join(os.environ["HOME"], ".angrydd-matches")
+else: MATCHES = "matches"
+
+# The piece's boxes where it locked at (x, y) in orientation orient, as
+# FallingPiece.deposit puts them; None for a box that doesn't fit.
+def landed(x, y, orient):
+    if orient == 0:
+        if y == 0: return [(x, y), None]
+        else: return [(x, y), (x, y - 1)]
+    elif orient == 1: return [(x, y), (x - 1, y)]
+    elif orient == 2: return [(x, y), (x, y + 1)]
+    else: return [(x, y), (x + 1, y)]
+
+# One player's side of a match, as it's played.
+class Recording(object):
+    def __init__(self, char, width, height):
+        self.char = char
+        self.width = width
+        self.height = height
+        self.started = time.time()
+        self.dead = False
+        # (ms into the match, boxes on the field, falling boxes, where
+        # they landed, next piece's boxes, rows on their way) for each
+        # piece; boxes are frozen (engine.freeze).
+        self.turns = []
+
+    # The falling piece (box1, box2) is about to be put down where it
+    # locked, on field; nextpiece and boning (as ai.boning_rows has it)
+    # are what's coming after it.
+    def add(self, ms, field, falling, at, nextpiece, boning):
+        boxes = []
+        for y, row in enumerate(field):
+            for x, box in enumerate(row):
+                if box is not None and box.x == x and box.y == y:
+                    boxes.append(freeze(box))
+        self.turns.append((ms, boxes, map(freeze, falling), landed(*at),
+                           map(freeze, nextpiece), boning))
+
+    def save(self, directory = MATCHES):
+        if not os.path.isdir(directory): os.makedirs(directory)
+        stamp = time.strftime("%Y%m%d-%H%M%S",
+                              time.localtime(self.started))
+        n = 1
+        while True:
+            filename = os.path.join(directory, "%s-%d.match" % (stamp, n))
+            if not os.path.exists(filename): break
+            n += 1
+        f = file(filename, "wb")
+        try: pickle.dump(self, f, 2)
+        finally: f.close()
+        return filename
+
+def load(filename):
+    f = file(filename, "rb")
+    try: return pickle.load(f)
+    finally: f.close()
+
+# The most the boxes could break dropped on field, or None if there's
+# nowhere for them to go.
+def _best_reply(field, boxes):
+    best = None
+    for orient, col in field.moves(False):
+        value = field.make(boxes, col, orient)
+        field.unmake()
+        if best is None or value > best: best = value
+    return best
+
+# What field, having just had a piece land on it, is worth, given the
+# piece after it; None if that piece can't come in.
+def _worth(field, value, second):
+    if field[0][field.width / 2] is not None: return None
+    elif not second: return int(value * 100)
+    reply = _best_reply(field, second)
+    if reply is None: return None
+    else: return int((value + reply) * 100)
+
+# How one move went: (the best move and what it was worth, what the
+# player's move was worth). Takes a turn of a Recording, and the
+# field's size.
+def evaluate(width, height, turn):
+    ms, boxes, falling, cells, nextpiece, boning = turn
+    field = BasicField(width, height)
+    for state in boxes: field.place(thaw(state))
+    field = ai.AIField(field)
+    field.boning = boning
+    first = map(thaw, falling)
+    second = map(thaw, nextpiece)
+
+    best = (None, None)
+    reach = ai.plan(field, field.width / 2, 0, 0)
+    for orient, col in field.moves(False, reach):
+        value = field.make(first, col, orient)
+        worth = _worth(field, value, second)
+        field.unmake()
+        if best[1] is None or (worth is not None and worth > best[1]):
+            best = ((orient, col), worth)
+
+    # The player's own move, just as it was made.
+    for box, cell in zip(first, cells):
+        if cell is not None: field.add_box(cell, box)
+    value = field.take_turn()
+    return best, _worth(field, value, second)
+
+def _evaluate(args): return evaluate(*args)
+
+# Review every move in the recordings in one pass; returns a list of
+# evaluate's results for each recording.
+def review(recordings, workers = None):
+    jobs = []
+    for rec in recordings:
+        jobs.extend([(rec.width, rec.height, turn) for turn in rec.turns])
+    if multiprocessing is None or workers == 0: done = map(_evaluate, jobs)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try: done = pool.map(_evaluate, jobs, 8)
+        finally: pool.terminate()
+    results = []
+    for rec in recordings:
+        results.append(done[:len(rec.turns)])
+        done = done[len(rec.turns):]
+    return results
+
+# Points lost by a move that was worth worth when the best was best;
+# None if the move lost the game and it didn't need to. A piece slid in
+# under an overhang can do better than the best we found.
+def lost(best, worth):
+    if worth is None:
+        if best is None: return 0
+        else: return None
+    elif best is None: return 0
+    else: return max(0, best - worth)
+
+# The move the player made, as (orientation, column) for AIField.drop.
+def _played(turn):
+    cells = turn[3]
+    # Only the bottom box of an upright piece fit in.
+    if cells[1] is None: return (0, cells[0][0])
+    (x1, y1), (x2, y2) = cells
+    if x2 == x1: return (int(y2 > y1) * 2, x1)
+    elif x2 < x1: return (1, x1)
+    else: return (3, x1)
+
+# A move as the column (counting from 1) the piece's first box went
+# down, and which way round it was (see FallingPiece).
+def _describe(move):
+    if move is None: return "-"
+    else: return "%d/%d" % (move[1] + 1, move[0])
+
+def _points(worth):
+    if worth is None: return "dead"
+    else: return "%d" % worth
+
+# The timeline for a recording and its results, as lines of text.
+def timeline(rec, results, worst = 5):
+    lines = []
+    total = 0
+    losses = []
+    lines.append("%s, %d pieces%s" % (rec.char, len(rec.turns),
+                                      (rec.dead and ", lost") or ""))
+    lines.append(" move   time  played  points  best    points   lost")
+    for n, (turn, ((move, best), worth)) in enumerate(zip(rec.turns,
+                                                          results)):
+        cost = lost(best, worth)
+        seconds = turn[0] / 1000
+        if cost is None:
+            bar = "game over"
+            cost = 0
+            losses.append((None, n))
+        else:
+            bar = "#" * min(40, (cost + 99) / 100)
+            total += cost
+            if cost: losses.append((cost, n))
+        lines.append("%5d %3d:%02d  %-6s  %6s  %-6s  %6s  %5s %s" %
+                     (n + 1, seconds / 60, seconds % 60,
+                      _describe(_played(turn)), _points(worth),
+                      _describe(move), _points(best), cost or "", bar))
+    lines.append("%d points lost in %d moves" % (total, len(losses)))
+    # Moves that lost the game sort first, then the costliest.
+    losses.sort(lambda a, b: cmp(b[0] is None, a[0] is None) or
+                cmp(b[0], a[0]))
+    for cost, n in losses[:worst]:
+        if cost is None: lines.append("  move %d lost the game" % (n + 1))
+        else: lines.append("  move %d lost %d points" % (n + 1, cost))
+    return lines
+
+def main(argv):
+    from optparse import OptionParser
+    parser = OptionParser(usage = "%prog [options] [MATCH ...]")
+    parser.add_option("--workers", type = "int", default = None,
+                      help = "processes to review in (default one per CPU, "
+                      "0 for none)")
+    parser.add_option("--worst", type = "int", default = 5,
+                      help = "how many of the worst moves to list "
+                      "(default 5)")
+    options, filenames = parser.parse_args(argv)
+    if not filenames:
+        if os.path.isdir(MATCHES): names = os.listdir(MATCHES)
+        else: names = []
+        names = [n for n in names if n.endswith(".match")]
+        if not names: parser.error("no matches recorded in %s" % MATCHES)
+        names.sort()
+        filenames = [os.path.join(MATCHES, names[-1])]
+
+    recordings = map(load, filenames)
+    start = time.time()
+    results = review(recordings, options.workers)
+    moves = sum([len(rec.turns) for rec in recordings])
+    for filename, rec, res in zip(filenames, recordings, results):
+        print filename
+        for line in timeline(rec, res, options.worst): print line
+        print
+    print "%d moves reviewed in %.1f seconds." % (moves, time.time() - start)
+
+if __name__ == "__main__": main(sys.argv[1:])
@@ -0,0 +1,92 @@
+# Tests for AIField.make and unmake: taking a move back has to put
+# every index the field keeps back the way it was, not just the grid.
+
+import random, unittest
+
+import ai
+from engine import BasicField, Box, BreakBox, TickBox
+from constants import COLORS
+
+# A field with some of everything on it: plain boxes (some merged into
+# crystals), break gems, and ticking boxes.
+def busy(rand, width = 6, height = 13):
+    field = BasicField(width, height)
+    for x in range(width):
+        for y in range(rand.randrange(height / 2, height), height):
+            f = rand.random()
+            color = rand.choice(COLORS[:4])
+            if f < 0.1: box = BreakBox(color, [x, y])
+            elif f < 0.3:
+                box = TickBox(color, [x, y])
+                box.time_left = rand.randrange(1, 5)
+            else: box = Box(color, [x, y])
+            field.place(box)
+    field = ai.AIField(field)
+    while field.merge(): pass
+    return field
+
+# Some rows of ticking boxes on their way, as ai.boning_rows has them.
+def rows(rand, width = 6):
+    found = []
+    for i in range(rand.randrange(3)):
+        found.append([rand.choice([None, (rand.choice(COLORS[:4]), 3)])
+                      for x in range(width)])
+    return found
+
+# A dict of bitsets or counts, without the ones that are 0 (which
+# unplace leaves behind, and mean the same as none).
+def nonzero(d):
+    return dict([(k, v) for k, v in d.items() if v])
+
+# Everything about the field, as plain values.
+def snapshot(field):
+    grid = []
+    for row in field:
+        for box in row:
+            if box is None: grid.append(None)
+            else:
+                grid.append((id(box), box.kind, box.color, box.x, box.y,
+                             tuple(box.size), getattr(box, "time_left", 0),
+                             box.crashed))
+    return (grid, field.state_hash, field._heights[:], field._max_height,
+            field._total_height, field._roughness, nonzero(field._colors),
+            nonzero(field._kinds), nonzero(field._sizes),
+            sorted(field._tickers.keys()), sorted(field._dirty.keys()),
+            field.max_gemsize, field.max_chain, field.boning, field.sent)
+
+def piece(rand):
+    return [Box(rand.choice(COLORS[:4]), [-1, -1]),
+            BreakBox(rand.choice(COLORS[:4]), [-1, -1])]
+
+class MakeUnmakeTest(unittest.TestCase):
+    def test_unmake_restores_everything(self):
+        rand = random.Random(16)
+        for i in range(40):
+            field = busy(rand)
+            field.boning = rows(rand)
+            before = snapshot(field)
+            first, second = piece(rand), piece(rand)
+            for orient, col in field.moves(False):
+                field.make(first, col, orient)
+                after = snapshot(field)
+                for orient2, col2 in field.moves(False)[:4]:
+                    field.make(second, col2, orient2)
+                    field.unmake()
+                    self.assertEqual(snapshot(field), after)
+                field.unmake()
+                self.assertEqual(snapshot(field), before)
+
+    # The indexes kept up as boxes come and go agree with a field
+    # built from scratch with the same boxes.
+    def test_indexes_match_fresh_field(self):
+        rand = random.Random(17)
+        for i in range(20):
+            field = busy(rand)
+            boxes = piece(rand)
+            for orient, col in field.moves(False):
+                field.make(boxes, col, orient)
+                fresh = ai.AIField(field)
+                self.assertEqual(snapshot(fresh)[1:9], snapshot(field)[1:9])
+                field.unmake()
+
+if __name__ == "__main__": unittest.main()
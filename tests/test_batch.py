@@ -0,0 +1,95 @@
+# Tests for BatchField: a turn on many boards at once comes out just as
+# AIField.take_turn does on each of them.
+
+import random, unittest
+
+import ai, batch
+from engine import BasicField, Box, BoxGen, TickBox, Diamond
+from constants import COLORS
+
+# A board from some play in combat, ticking boxes mixed in. In half of
+# them every piece is plain boxes in two colors, so big crystals form
+# and grow (the rest of the time they're rare).
+def board(rand):
+    gen = BoxGen(rand, COLORS[:4], False, True)
+    crystals = rand.random() < 0.5
+    field = ai.AIField(BasicField(6, 13))
+    for i in range(rand.randrange(1, 16)):
+        if crystals:
+            boxes = [Box(rand.choice(COLORS[:2]), [-1, -1]) for j in "12"]
+        else: boxes = [gen.get([-1, -1]), gen.get([-1, -1])]
+        if rand.random() < 0.25:
+            boxes[1] = TickBox(rand.choice(COLORS[:4]), [-1, -1])
+            boxes[1].time_left = rand.randrange(1, 5)
+        elif rand.random() < 0.03: boxes[0] = Diamond("diamond", [-1, -1])
+        moves = field.moves(False)
+        if not moves: break
+        orient, col = rand.choice(moves)
+        field.drop(boxes, col, orient)
+        if rand.random() < 0.6: field.take_turn()
+    return field
+
+def cells(field):
+    found = []
+    for row in field:
+        for box in row:
+            if box is None: found.append(None)
+            else:
+                found.append((box.kind, box.color, box.x, box.y,
+                              tuple(box.size), getattr(box, "time_left", 0)))
+    return found
+
+class BatchTest(unittest.TestCase):
+    # Every placement of a piece on each board, all in one batch.
+    def test_same_as_aifield(self):
+        rand = random.Random(9)
+        gen = BoxGen(rand, COLORS[:4], False, True)
+        for i in range(20):
+            fields = []
+            for j in range(5):
+                boxes = [gen.get([-1, -1]), gen.get([-1, -1])]
+                fields.extend([f for o, c, f, b in
+                               board(rand).expand(boxes, False)])
+            if not fields: continue
+            turn = batch.BatchField.from_fields(fields)
+            values = turn.take_turn()
+            for n, field in enumerate(fields):
+                self.assertEqual(values[n], field.take_turn())
+                self.assertEqual(cells(turn.field(n)), cells(field))
+                self.assertEqual(turn.max_gemsize[n], field.max_gemsize)
+
+    # A 2x2 crystal with boxes of its color beside it, or on top, that
+    # it can grow into, but no square of boxes to start a new one.
+    def test_crystal_grows(self):
+        fields = []
+        for side in [[(2, 11), (2, 12)], [(0, 10), (1, 10)],
+                     [(3, 11), (3, 12)]]:
+            field = ai.AIField(BasicField(6, 13))
+            for xy in [(0, 11), (1, 11), (0, 12), (1, 12)]:
+                field.place(Box("red", list(xy)))
+            while field.merge(): pass
+            for xy in side: field.place(Box("red", list(xy)))
+            fields.append(field)
+        turn = batch.BatchField.from_fields(fields)
+        turn.take_turn()
+        for n, field in enumerate(fields):
+            field.take_turn()
+            self.assertEqual(cells(turn.field(n)), cells(field))
+        self.assertEqual(fields[0][12][0].size, [3, 2])
+        self.assertEqual(fields[1][12][0].size, [2, 3])
+
+    # Only some of the boards take a turn; the rest stay as they were.
+    def test_some_boards(self):
+        rand = random.Random(10)
+        fields = [board(rand) for i in range(12)]
+        turn = batch.BatchField.from_fields(fields)
+        which = range(0, 12, 3)
+        values = turn.take_turn(which)
+        for n, field in enumerate(fields):
+            if n in which:
+                self.assertEqual(values[which.index(n)], field.take_turn())
+            self.assertEqual(cells(turn.field(n)), cells(field))
+
+if batch.numpy is None: del(BatchTest)
+
+if __name__ == "__main__": unittest.main()
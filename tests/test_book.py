@@ -0,0 +1,90 @@
+# Tests for the opening book's file: what's written is what's looked up.
+
+import os, tempfile, unittest
+
+import ai, book
+from engine import BasicField, Box, BreakBox
+
+class BookTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(".book")
+        os.close(fd)
+        self.book = None
+
+    def tearDown(self):
+        # The book keeps the file mapped until it goes.
+        self.book = None
+        os.remove(self.filename)
+
+    def _write(self, height, names, moves):
+        book.write(self.filename, height, names, moves)
+        self.book = book.Book(self.filename)
+        return self.book
+
+    def test_round_trip(self):
+        moves = {}
+        for i in range(200):
+            key = book.md5(str(i)).digest()[:8]
+            moves[key] = (["GoodAI", "ExpertAI"][i % 2], (i % 4, i % 6))
+        found = self._write(4, ["GoodAI", "ExpertAI"], moves)
+        self.assertEqual(found.height, 4)
+        self.assertEqual(found.names, ["GoodAI", "ExpertAI"])
+        self.assertEqual(len(found), len(moves))
+        for key, (name, move) in moves.items():
+            self.assertEqual(found.lookup(key), move)
+        self.assertEqual(found.lookup("\x00" * 8), None)
+        self.assertEqual(found.lookup("\xff" * 8), None)
+        items = list(found.items())
+        self.assertEqual([key for key, name, move in items],
+                         sorted(moves.keys()))
+        for key, name, move in items:
+            self.assertEqual((name, move), moves[key])
+
+    def test_get(self):
+        field = ai.AIField(BasicField(6, 13))
+        field.add_box([2, 12], Box("red", [-1, -1]))
+        falling = [Box("blue", [-1, -1]), BreakBox("red", [-1, -1])]
+        nextpiece = [Box("green", [-1, -1]), Box("green", [-1, -1])]
+        key = book.canonical("GoodAI", field, falling, nextpiece)
+        found = self._write(4, ["GoodAI"], { key: ("GoodAI", (3, 2)) })
+        self.assertEqual(found.get("GoodAI", field, falling, nextpiece),
+                         (3, 2))
+        # The same position with the colors swapped around is the same.
+        other = ai.AIField(BasicField(6, 13))
+        other.add_box([2, 12], Box("green", [-1, -1]))
+        self.assertEqual(found.get("GoodAI", other,
+                                   [Box("yellow", [-1, -1]),
+                                    BreakBox("green", [-1, -1])],
+                                   [Box("red", [-1, -1]),
+                                    Box("red", [-1, -1])]), (3, 2))
+        # But not flipped left to right.
+        other = ai.AIField(BasicField(6, 13))
+        other.add_box([3, 12], Box("red", [-1, -1]))
+        self.assertEqual(found.get("GoodAI", other, falling, nextpiece),
+                         None)
+        self.assertEqual(found.get("ExpertAI", field, falling, nextpiece),
+                         None)
+        self.assertEqual(found.get("GoodAI", field, falling, None), None)
+
+    # Positions the solver finds nowhere to go for are left out, and
+    # not played on from.
+    def test_generate_without_a_move(self):
+        solve = book.solve
+        def nowhere(name, width, height, boxes, falling, nextpiece):
+            if falling[0][1] == nextpiece[0][1]: return None
+            elif falling[1][1] == nextpiece[1][1]: return (1, 0)
+            else: return (2, 3)
+        book.solve = nowhere
+        try: moves = book.generate("GoodAI", 2, 4, 0)
+        finally: book.solve = solve
+        self.failUnless(moves)
+        self.failIf(None in moves.values())
+        self.failIf((1, 0) in moves.values())
+
+    def test_not_a_book(self):
+        f = file(self.filename, "wb")
+        f.write("ADDBOOK1" + "\x00" * 16)
+        f.close()
+        self.assertRaises(ValueError, book.Book, self.filename)
+
+if __name__ == "__main__": unittest.main()
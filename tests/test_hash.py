@@ -0,0 +1,117 @@
+# Tests for BasicField.state_hash: the same boxes in the same places
+# hash the same, however the field got there.
+
+import random, unittest
+
+import ai
+from engine import BasicField, Box, BreakBox, TickBox
+from constants import COLORS
+
+# Some loose boxes scattered over the top of the field, with gaps under
+# them, so falling and merging both have work to do.
+def scattered(rand, width = 6, height = 13):
+    boxes = []
+    for x in range(width):
+        for y in range(rand.randrange(height), height):
+            if rand.random() < 0.3: continue
+            f = rand.random()
+            color = rand.choice(COLORS[:3])
+            if f < 0.1: box = BreakBox(color, [x, y])
+            elif f < 0.25:
+                box = TickBox(color, [x, y])
+                box.time_left = rand.randrange(1, 5)
+            else: box = Box(color, [x, y])
+            boxes.append(box)
+    return boxes
+
+# A new field with each box placed in the given order.
+def filled(boxes, width = 6, height = 13):
+    field = BasicField(width, height)
+    for box in boxes: field.place(box)
+    return field
+
+# The hash of a field built from scratch with the same boxes.
+def rebuilt(field):
+    boxes = []
+    for y, row in enumerate(field):
+        for x, box in enumerate(row):
+            if box is not None and box.x == x and box.y == y:
+                boxes.append(box.copy())
+    return filled(boxes, field.width, field.height).state_hash
+
+# The field, cell by cell, as plain values.
+def cells(field):
+    found = []
+    for row in field:
+        for box in row:
+            if box is None: found.append(None)
+            else:
+                found.append((box.kind, box.color, box.x, box.y,
+                              tuple(box.size), getattr(box, "time_left", 0)))
+    return found
+
+class HashTest(unittest.TestCase):
+    def test_place_in_any_order(self):
+        rand = random.Random(8)
+        for i in range(30):
+            boxes = scattered(rand)
+            field = filled(boxes)
+            shuffled = [box.copy() for box in boxes]
+            rand.shuffle(shuffled)
+            self.assertEqual(filled(shuffled).state_hash, field.state_hash)
+            if boxes:
+                self.failIfEqual(field.state_hash, 0)
+            # Taking boxes off, in any order, takes their keys back out.
+            rand.shuffle(boxes)
+            for box in boxes[:len(boxes) / 2]: field.unplace(box)
+            self.assertEqual(field.state_hash, rebuilt(field))
+            for box in boxes: field.unplace(box)
+            self.assertEqual(field.state_hash, 0)
+
+    # Falling a row at a time or all at once, from boxes placed in
+    # either order, then merging and ticking, all end up at the hash
+    # the same boxes have when placed there fresh.
+    def test_fall_merge_tick(self):
+        rand = random.Random(80)
+        for i in range(30):
+            boxes = scattered(rand)
+            stepped = filled([box.copy() for box in boxes])
+            settled = filled([box.copy() for box in reversed(boxes)])
+            while stepped.fall():
+                self.assertEqual(stepped.state_hash, rebuilt(stepped))
+            settled.settle()
+            self.assertEqual(cells(stepped), cells(settled))
+            self.assertEqual(stepped.state_hash, settled.state_hash)
+            for field in [stepped, settled]:
+                while field.merge():
+                    self.assertEqual(field.state_hash, rebuilt(field))
+                field.tick()
+                self.assertEqual(field.state_hash, rebuilt(field))
+                field.breaking()
+                field.settle()
+                self.assertEqual(field.state_hash, rebuilt(field))
+            self.assertEqual(stepped.state_hash, settled.state_hash)
+
+    # A copy hashes the same as the field, and stays in step with it.
+    def test_copy(self):
+        rand = random.Random(800)
+        for i in range(20):
+            field = ai.AIField(filled(scattered(rand)))
+            field.settle()
+            while field.merge(): pass
+            copy = ai.AIField(field)
+            self.assertEqual(copy.state_hash, field.state_hash)
+            before = field.state_hash
+            for orient, col in field.moves(False):
+                for f in [field, copy]:
+                    boxes = [Box(COLORS[0], [-1, -1]),
+                             BreakBox(COLORS[1], [-1, -1])]
+                    f.make(boxes, col, orient)
+                self.assertEqual(copy.state_hash, field.state_hash)
+                self.assertEqual(field.state_hash, rebuilt(field))
+                field.unmake()
+                copy.unmake()
+                self.assertEqual(field.state_hash, before)
+                self.assertEqual(copy.state_hash, before)
+
+if __name__ == "__main__": unittest.main()
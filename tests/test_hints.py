@@ -0,0 +1,91 @@
+# Tests for HintService: a hint is only ever for the piece last asked
+# about, thinking in the game or in a worker process.
+
+import time, unittest
+
+import hints
+from engine import BasicField, Box
+from constants import COLORS
+
+def piece(a, b): return [Box(a, [-1, -1]), Box(b, [-1, -1])]
+
+# Where a piece goes on an empty field, it lands at the bottom; on a
+# full one (no two boxes touching have the same color, so nothing
+# merges or breaks), at the top.
+EMPTY = BasicField(6, 13)
+FULL = BasicField(6, 13)
+for x in range(6):
+    for y in range(3, 13): FULL.place(Box(COLORS[(x + y) % 4], [x, y]))
+
+def on_empty(hint): return min([y for x, y in hint.cells]) >= 11
+def on_full(hint): return max([y for x, y in hint.cells]) <= 2
+
+# Poll service until it has a hint, or give up after a while.
+def wait(service, seconds = 10):
+    end = time.time() + seconds
+    while time.time() < end:
+        hint = service.poll()
+        if hint is not None: return hint
+        time.sleep(0.001)
+    return None
+
+class InGameTest(unittest.TestCase):
+    def setUp(self):
+        self._multiprocessing = hints.multiprocessing
+        hints.multiprocessing = None
+        self.service = hints.HintService()
+
+    def tearDown(self):
+        self.service.close()
+        hints.multiprocessing = self._multiprocessing
+
+    def test_hint(self):
+        self.service.ask(EMPTY, piece("red", "blue"), piece("red", "red"))
+        self.failUnless(on_empty(wait(self.service)))
+
+    def test_cancel(self):
+        self.service.ask(EMPTY, piece("red", "blue"), piece("red", "red"))
+        self.service.poll()
+        self.service.cancel()
+        for i in range(100): self.assertEqual(self.service.poll(), None)
+
+    def test_new_piece(self):
+        self.service.ask(EMPTY, piece("red", "blue"), piece("red", "red"))
+        self.service.poll()
+        self.service.ask(FULL, piece("red", "blue"), piece("red", "red"))
+        self.failUnless(on_full(wait(self.service)))
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.service = hints.HintService()
+
+    def tearDown(self): self.service.close()
+
+    def test_hint(self):
+        self.service.ask(EMPTY, piece("red", "blue"), piece("red", "red"))
+        self.failUnless(on_empty(wait(self.service)))
+
+    def test_cancel(self):
+        self.service.ask(EMPTY, piece("red", "blue"), piece("red", "red"))
+        self.service.cancel()
+        time.sleep(0.5)
+        self.assertEqual(self.service.poll(), None)
+
+    # The worker has already answered about the first piece by the
+    # time we ask about the second; that answer has to be thrown away.
+    def test_stale_answer(self):
+        self.service.ask(EMPTY, piece("red", "blue"), piece("red", "red"))
+        end = time.time() + 10
+        while not self.service._conn.poll() and time.time() < end:
+            time.sleep(0.001)
+        self.service.ask(FULL, piece("red", "blue"), piece("red", "red"))
+        self.failUnless(on_full(wait(self.service)))
+
+    def test_new_piece(self):
+        self.service.ask(EMPTY, piece("red", "blue"), piece("red", "red"))
+        self.service.ask(FULL, piece("red", "blue"), piece("red", "red"))
+        self.failUnless(on_full(wait(self.service)))
+
+if hints.multiprocessing is None: del(WorkerTest)
+
+if __name__ == "__main__": unittest.main()
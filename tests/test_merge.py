@@ -0,0 +1,59 @@
+# Tests for BasicField.merge: trying only the boxes that changed has
+# to grow crystals just as trying every box on the field always did.
+
+import random, unittest
+
+import ai
+from engine import BasicField, Box, BreakBox, TickBox
+from constants import COLORS
+
+# An AIField that merges the way the game always has: every box on the
+# field, one for each cell it covers, sorted and tried in turn.
+class ScanField(ai.AIField):
+    def merge(self):
+        boxes = [b for row in self._field for b in row if isinstance(b, Box)]
+        boxes.sort(lambda a, b: cmp(b.y, a.y) and cmp(a.x, b.x))
+        for box in boxes:
+            dead = box.try_merge(self)
+            if len(dead) > 0: return dead
+        return []
+
+# A piece in only a few colors, so crystals form, grow, and get in each
+# other's way; now and then a ticking box or a break gem.
+def piece(rand, colors):
+    boxes = [Box(rand.choice(colors), [-1, -1]) for i in "12"]
+    f = rand.random()
+    if f < 0.15:
+        boxes[1] = TickBox(rand.choice(colors), [-1, -1])
+        boxes[1].time_left = rand.randrange(1, 5)
+    elif f < 0.2: boxes[1] = BreakBox(rand.choice(colors), [-1, -1])
+    return boxes
+
+def cells(field):
+    found = []
+    for row in field:
+        for box in row:
+            if box is None: found.append(None)
+            else:
+                found.append((box.kind, box.color, box.x, box.y,
+                              tuple(box.size), getattr(box, "time_left", 0)))
+    return found
+
+class MergeTest(unittest.TestCase):
+    def test_same_as_full_scan(self):
+        rand = random.Random(3)
+        for i in range(150):
+            colors = COLORS[:rand.choice([1, 2, 2, 3])]
+            field = ai.AIField(BasicField(6, 13))
+            scan = ScanField(BasicField(6, 13))
+            for j in range(40):
+                moves = field.moves(False)
+                if not moves: break
+                orient, col = rand.choice(moves)
+                boxes = piece(rand, colors)
+                field.drop([b.copy() for b in boxes], col, orient)
+                scan.drop(boxes, col, orient)
+                self.assertEqual(field.take_turn(), scan.take_turn())
+                self.assertEqual(cells(field), cells(scan))
+
+if __name__ == "__main__": unittest.main()
@@ -0,0 +1,81 @@
+# Tests for ai.plan: where a piece can really get to, and how.
+
+import random, unittest
+
+import ai
+from engine import BasicField, Box, FallingPiece
+from constants import COLORS, LEFT, RIGHT, ROT_CW, ROT_CC
+
+# A crowded field: uneven columns, some right up to the top where they
+# get in the way of turning (and so swap the piece's boxes), with a few
+# boxes hanging in the air for the piece to get caught under.
+def crowded(rand, width = 6, height = 13):
+    field = BasicField(width, height)
+    for x in range(width):
+        if x == width / 2: top = rand.randrange(1, height)
+        else: top = rand.randrange(height)
+        for y in range(top, height):
+            field.place(Box(rand.choice(COLORS[:4]), [x, y]))
+    for i in range(rand.randrange(4)):
+        x, y = rand.randrange(width), rand.randrange(2, height - 2)
+        if field[y][x] is None:
+            field.place(Box(rand.choice(COLORS[:4]), [x, y]))
+    return field
+
+# A piece at (x, y, orient) that's had keys pressed, from scratch.
+def replay(field, x, y, orient, swapped, keys):
+    if swapped: piece = FallingPiece(2, 1, field)
+    else: piece = FallingPiece(1, 2, field)
+    piece.x, piece.y, piece._orient = x, y, orient
+    press = { ROT_CC: piece.rot_cc, LEFT: piece.go_left,
+              RIGHT: piece.go_right, ROT_CW: piece.rot_cw }
+    for key in keys: press[key]()
+    return piece
+
+# Every move the piece can make, and the fewest keys to get there,
+# found by replaying every sequence of keys rather than trusting any
+# piece to be put back as it was.
+def brute_force(field, x, y, orient, swapped):
+    def state(piece):
+        return (piece.x, piece.y, piece._orient, piece._box1, piece._box2)
+    seen = { state(replay(field, x, y, orient, swapped, [])): [] }
+    queue = [[]]
+    moves = {}
+    for keys in queue:
+        piece = replay(field, x, y, orient, swapped, keys)
+        move = ai._landing(field, piece)
+        if move is not None and move not in moves: moves[move] = len(keys)
+        for key in [ROT_CC, LEFT, RIGHT, ROT_CW]:
+            new = state(replay(field, x, y, orient, swapped,
+                               keys + [key]))
+            if new not in seen:
+                seen[new] = keys + [key]
+                queue.append(keys + [key])
+    return moves
+
+class PlanTest(unittest.TestCase):
+    def test_empty_field(self):
+        field = BasicField(6, 13)
+        moves = ai.plan(field, 3, 0, 0)
+        self.assertEqual(len(moves), len(ai.AIField(field).moves(False)))
+
+    # Starting turned, or with the boxes already swapped, as AIPlayer
+    # plans again after each key.
+    def test_matches_brute_force(self):
+        rand = random.Random(19)
+        for i in range(60):
+            field = crowded(rand)
+            for orient in range(4):
+                for swapped in [False, True]:
+                    self._check(field, 3, 0, orient, swapped)
+
+    def _check(self, field, x, y, orient, swapped):
+        moves = ai.plan(field, x, y, orient, swapped)
+        expected = brute_force(field, x, y, orient, swapped)
+        self.assertEqual(sorted(moves.keys()), sorted(expected.keys()))
+        for move, keys in moves.items():
+            self.assertEqual(len(keys), expected[move])
+            piece = replay(field, x, y, orient, swapped, keys)
+            self.assertEqual(ai._landing(field, piece), move)
+
+if __name__ == "__main__": unittest.main()
@@ -0,0 +1,64 @@
+# Tests for PlaneField: the same game as AIField, kept in planes.
+
+import random, unittest
+
+import ai
+from planes import PlaneField
+from engine import BasicField, BoxGen, TickBox, Diamond
+from constants import COLORS
+
+# Fields from a few pieces of play with specials, and now and then a
+# ticking box or a diamond, so there are crystals, merges and ticks.
+def played(rand, pieces):
+    gen = BoxGen(rand, COLORS[:4], False, True)
+    field = ai.AIField(BasicField(6, 13))
+    for i in range(pieces):
+        boxes = [gen.get([-1, -1]), gen.get([-1, -1])]
+        if rand.random() < 0.3:
+            boxes[1] = TickBox(rand.choice(COLORS[:4]), [-1, -1])
+            boxes[1].time_left = rand.randrange(1, 5)
+        elif rand.random() < 0.05: boxes[0] = Diamond("diamond", [-1, -1])
+        moves = field.moves(False)
+        if not moves: break
+        orient, col = rand.choice(moves)
+        field.drop(boxes, col, orient)
+        if rand.random() < 0.7: field.take_turn()
+    return field
+
+# The field, cell by cell, as plain values.
+def cells(field):
+    found = []
+    for row in field:
+        for box in row:
+            if box is None: found.append(None)
+            else:
+                found.append((box.kind, box.color, box.x, box.y,
+                              tuple(box.size), getattr(box, "time_left", 0),
+                              getattr(box, "special", None)))
+    return found
+
+class PlaneFieldTest(unittest.TestCase):
+    def test_round_trip(self):
+        rand = random.Random(1)
+        for i in range(50):
+            field = played(rand, rand.randrange(1, 14))
+            planes = PlaneField.from_field(field)
+            self.assertEqual(cells(planes), cells(field))
+            again = ai.AIField(planes)
+            self.assertEqual(cells(again), cells(field))
+            self.assertEqual(again.state_hash, field.state_hash)
+            self.assertEqual(cells(planes.copy()), cells(field))
+
+    def test_take_turn(self):
+        rand = random.Random(2)
+        gen = BoxGen(rand, COLORS[:4], False, True)
+        for i in range(30):
+            field = played(rand, rand.randrange(1, 14))
+            boxes = [gen.get([-1, -1]), gen.get([-1, -1])]
+            for orient, col, after, placed in field.expand(boxes, False):
+                planes = PlaneField.from_field(after)
+                self.assertEqual(planes.take_turn(), after.take_turn())
+                self.assertEqual(cells(planes), cells(after))
+                self.assertEqual(planes.max_gemsize, after.max_gemsize)
+
+if __name__ == "__main__": unittest.main()
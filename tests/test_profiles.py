@@ -0,0 +1,64 @@
+# Tests for AI profiles: a bad one in the file is left out, rather than
+# stopping everything else loading.
+
+import os, tempfile, unittest
+from ConfigParser import Error
+
+import ai
+
+PROFILES = """[TestTunedAI]
+base = InsaneAI
+emergency = 7.5
+same_color = 4
+
+[TestNoBaseAI]
+emergency = 7
+
+[TestUnknownBaseAI]
+base = NoSuchAI
+
+[TestNotAnAI]
+base = os
+
+[TestBadNumberAI]
+base = HardAI
+too_high = lots
+
+[TestBadWeightAI]
+base = HardAI
+no_such_weight = 1
+"""
+
+class ProfileTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(".profiles")
+        os.close(fd)
+        self.names = []
+
+    def tearDown(self):
+        os.remove(self.filename)
+        for name in self.names: delattr(ai, name)
+
+    def _load(self, text):
+        f = file(self.filename, "w")
+        f.write(text)
+        f.close()
+        self.names = ai.load_profiles(self.filename)
+        return self.names
+
+    def test_bad_profiles_left_out(self):
+        self.assertEqual(self._load(PROFILES), ["TestTunedAI"])
+        cls = ai.TestTunedAI
+        self.failUnless(issubclass(cls, ai.InsaneAI))
+        self.assertEqual((cls.emergency, cls.same_color), (7.5, 4.0))
+        self.assertEqual(cls.too_high, ai.InsaneAI.too_high)
+        for name in ["TestNoBaseAI", "TestUnknownBaseAI", "TestNotAnAI",
+                     "TestBadNumberAI", "TestBadWeightAI"]:
+            self.failIf(hasattr(ai, name))
+
+    # A file that isn't a profiles file at all raises ConfigParser's
+    # errors, which importing ai catches.
+    def test_not_a_profiles_file(self):
+        self.assertRaises(Error, self._load, "emergency = 7\n")
+
+if __name__ == "__main__": unittest.main()
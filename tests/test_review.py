@@ -0,0 +1,103 @@
+# Tests for review.py, on small recordings made by hand: what moves
+# players made, and what they were worth next to the best ones.
+
+import unittest
+
+import ai, review
+from engine import BasicField, Box, BreakBox
+from constants import COLORS
+
+def piece():
+    return [BreakBox("red", [-1, -1]), Box("blue", [-1, -1])]
+
+def nextpiece():
+    return [Box("green", [-1, -1]), Box("green", [-1, -1])]
+
+# Two red boxes in the bottom left corner, for a red break gem to break.
+def corner():
+    field = BasicField(6, 13)
+    field.add_box([0, 12], Box("red", [-1, -1]))
+    field.add_box([1, 12], Box("red", [-1, -1]))
+    return field
+
+# A column of boxes up to row top, in colors that won't merge.
+def column(field, x, top):
+    for y in range(top, field.height):
+        field.add_box([x, y], Box(COLORS[y % 2], [-1, -1]))
+    return field
+
+# The field's boxes, as (kind, color, x, y).
+def boxes(field):
+    found = []
+    for y, row in enumerate(field):
+        for x, box in enumerate(row):
+            if box is not None and box.x == x and box.y == y:
+                found.append((box.kind, box.color, x, y))
+    found.sort()
+    return found
+
+class PlayedTest(unittest.TestCase):
+    # Wherever the piece locked, in whatever orientation, _played gives
+    # the move that puts the same boxes in the same places.
+    def test_orientations(self):
+        for orient, x, y, top in [(0, 2, 11, 13), (1, 3, 12, 13),
+                                  (2, 4, 11, 13), (3, 0, 12, 13),
+                                  (0, 5, 5, 6), (2, 1, 4, 6)]:
+            rec = review.Recording("Test", 6, 13)
+            rec.add(0, column(BasicField(6, 13), x, top), piece(),
+                    (x, y, orient), nextpiece(), None)
+            turn = rec.turns[0]
+            self.assertEqual(review._played(turn), (orient, x))
+
+            landed = column(BasicField(6, 13), x, top)
+            for box, cell in zip(piece(), turn[3]): landed.add_box(cell, box)
+            landed.settle()
+            dropped = ai.AIField(column(BasicField(6, 13), x, top))
+            self.failUnless(dropped.drop(piece(), x, orient))
+            dropped.settle()
+            self.assertEqual(boxes(dropped), boxes(landed))
+
+    # An upright piece on a column reaching the second row only gets
+    # its bottom box in.
+    def test_only_bottom_box(self):
+        rec = review.Recording("Test", 6, 13)
+        rec.add(0, column(BasicField(6, 13), 2, 1), piece(), (2, 0, 0),
+                nextpiece(), None)
+        turn = rec.turns[0]
+        self.assertEqual(turn[3], [(2, 0), None])
+        self.assertEqual(review._played(turn), (0, 2))
+
+class EvaluateTest(unittest.TestCase):
+    def test_missed_and_found(self):
+        rec = review.Recording("Test", 6, 13)
+        # Off to the right, where it breaks nothing...
+        rec.add(0, corner(), piece(), (4, 12, 3), nextpiece(), None)
+        # ...and next to the reds, where it breaks them and itself.
+        rec.add(1500, corner(), piece(), (2, 12, 3), nextpiece(), None)
+        missed = review.evaluate(6, 13, rec.turns[0])
+        found = review.evaluate(6, 13, rec.turns[1])
+        self.assertEqual(missed, (((0, 0), 300), 0))
+        self.assertEqual(found, (((0, 0), 300), 300))
+        self.assertEqual(review.lost(300, 0), 300)
+        self.assertEqual(review.lost(300, 300), 0)
+        self.assertEqual(review.review([rec], 0), [[missed, found]])
+
+        lines = review.timeline(rec, [missed, found])
+        self.assertEqual(lines[0], "Test, 2 pieces")
+        self.assertEqual(lines[-2], "300 points lost in 1 moves")
+        self.assertEqual(lines[-1], "  move 1 lost 300 points")
+
+    # Filling the middle column to the top loses the game, when there
+    # was room to go elsewhere.
+    def test_lost_the_game(self):
+        rec = review.Recording("Test", 6, 13)
+        rec.add(0, column(BasicField(6, 13), 3, 2), piece(), (3, 1, 0),
+                nextpiece(), None)
+        (move, best), worth = review.evaluate(6, 13, rec.turns[0])
+        self.assertEqual(worth, None)
+        self.failIfEqual(best, None)
+        self.assertEqual(review.lost(best, worth), None)
+        lines = review.timeline(rec, [((move, best), worth)])
+        self.assertEqual(lines[-1], "  move 1 lost the game")
+
+if __name__ == "__main__": unittest.main()
@@ -0,0 +1,52 @@
+# Tests for ai.TranspositionTable: what it forgets, and what it reports.
+
+import sys, unittest
+
+import ai
+
+class TableTest(unittest.TestCase):
+    def test_forgets_least_recently_used(self):
+        table = ai.TranspositionTable(3)
+        for key in "abc": table.put(key, key.upper())
+        self.assertEqual(table.get("a"), "A")
+        table.put("d", "D")
+        self.assertEqual(table.get("b"), None)
+        self.assertEqual([table.get(k) for k in "acd"], ["A", "C", "D"])
+        self.assertEqual(table.evictions, 1)
+
+    def test_resize(self):
+        table = ai.TranspositionTable(5)
+        for key in "abcde": table.put(key, key)
+        table.get("a")
+        table.resize(2)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.get("a"), "a")
+        self.assertEqual(table.get("e"), "e")
+        self.assertEqual(table.evictions, 3)
+        table.put("f", "f")
+        self.assertEqual(len(table), 2)
+
+    def test_stats(self):
+        table = ai.TranspositionTable(10)
+        table.put("a", 1)
+        table.get("a")
+        table.get("b")
+        stats = table.stats()
+        self.assertEqual((stats["entries"], stats["capacity"], stats["hits"],
+                          stats["misses"], stats["evictions"]),
+                         (1, 10, 1, 1, 0))
+
+    # Values like LookaheadAI's rankings, a list of tuples of tuples,
+    # count everything in them, not just the list.
+    def test_memory_counts_values(self):
+        if not hasattr(sys, "getsizeof"): return
+        small = ai.TranspositionTable(10)
+        small.put(1, [])
+        big = ai.TranspositionTable(10)
+        big.put(1, [((i, float(i)), 0.5 * i, (i % 4, i % 6))
+                    for i in range(22)])
+        value = big.get(1)
+        self.failUnless(big.memory() - small.memory() >
+                        sys.getsizeof(value) + 22 * sys.getsizeof(value[0]))
+
+if __name__ == "__main__": unittest.main()
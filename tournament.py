@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# tournament.py -- headless AI-vs-AI matches
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# Plays AIs against each other with no display, as fast as they can
+# think, and reports how each AI and each character did. Usage:
+#   tournament.py [--games N] [--workers N] [--seed S] [--combat]
+#                 [--chars a,b,...] [--table-size N] AI1 AI2 ...
+# e.g. tournament.py --games 50 HardAI InsaneAI ExpertAI
+#
+# Every pair of AIs plays --games seeds, once from each side; the
+# characters for each game are picked by its seed. A match is played
+# in rounds: each player in turn gets the next piece, puts it where its
+# AI decides, and the field runs the rest of the turn as game.Field
+# does (falling, ticking, merging, breaking, chains), sending what it
+# broke to the other player through its character's DropPattern and
+# taking any rows sent to it, as VersusPlayer does. Nobody is faster
+# than anyone else here, so the AIs are judged on where they put
+# pieces; how long they took to decide is reported alongside, and how
+# well each AI's transposition table did (see ai.TranspositionTable),
+# with --table-size entries (default each AI's own table_size).
+#
+# The same seeds always play the same games (except for AIs that stop
+# thinking at a deadline, like ExpertAI).
+
+import os, sys, random, time
+
+# Python 2.6 and later can play several matches at once.
+try: import multiprocessing
+except ImportError: multiprocessing = None
+
+import ai
+from dirstore import DirStore
+from engine import BasicField, BoxGen, DropPattern, TickBox
+
+from constants import COLORS, angrydd_path
+
+# Stop a match (as a draw) if it goes on longer than this many rounds.
+MAX_ROUNDS = 1000
+
+# The characters' drop patterns, by name, read without loading any of
+# their images.
+_drops = {}
+
+def characters():
+    names = os.listdir(os.path.join(angrydd_path, "characters"))
+    names = filter(lambda name: "dwarf" in name, names)
+    names.sort()
+    return [name.split(".")[0] for name in names]
+
+def drop_pattern(name):
+    if name not in _drops:
+        path = os.path.join(angrydd_path, "characters", name + ".dwarf")
+        if not os.path.exists(path): path += ".zip"
+        store = DirStore(path)
+        _drops[name] = DropPattern([s.strip() for s in
+                                    store.read("drop").strip().split("\n")])
+    return _drops[name]
+
+# A field for a player with nobody watching; the only thing it has to
+# tell the player about is a tech bonus.
+class HeadlessField(ai.AIField):
+    def __init__(self, seat, width = 6, height = 13):
+        ai.AIField.__init__(self, BasicField(width, height))
+        self.seat = seat
+
+    def tech_bonus(self): self.seat.score += 1000
+
+# One side of a match: an AI, a character, their field and pieces.
+class Seat(object):
+    def __init__(self, pid, ai_name, char, seed, combat = False,
+                 table_size = None):
+        self.pid = pid
+        # An AI is a class name, or (name, base, weights) for a profile
+        # that isn't in the ai module; see ai.profile.
+        if isinstance(ai_name, tuple):
+            cls = ai.profile(*ai_name)
+            ai_name = ai_name[0]
+        else: cls = getattr(ai, ai_name)
+        self.ai_name = ai_name
+        self.char = char
+        self.drop = drop_pattern(char)
+        self.field = HeadlessField(self)
+        self._insrow = int(self.field.width / 2)
+        self._gen = BoxGen(random.Random(seed), COLORS[:4], False, combat)
+        self._ai = cls(self)
+        if table_size is not None: self._ai.resize_table(table_size)
+        self._pending_boning = []
+        self._next = self._piece()
+        self.others = []
+        self.dead = False
+        self.score = 0
+        self.pieces = 0
+        self.chains = []
+        self.thinking = []
+
+    def _piece(self): return [self._gen.get([-1, -1]),
+                              self._gen.get([-1, -1])]
+
+    # Take one piece's turn. The field plays it out (see
+    # AIField.take_turn), rows sent to us and all, just as the AIs
+    # think it will; we only keep score.
+    def turn(self):
+        field = self.field
+        if field[0][self._insrow] is not None:
+            self.dead = True
+            return
+        falling = self._next
+        self._next = self._piece()
+
+        start = time.time()
+        self._ai.setup(field, falling, self._next, (self._insrow, 0, 0),
+                       ai.boning_rows(self._pending_boning))
+        orient, col = self._ai.decide()
+        self.thinking.append(time.time() - start)
+        orient, col = self._reach(orient, col)
+        field.drop(falling, col, orient)
+        self.pieces += 1
+
+        field.boning = ai.boning_rows(self._pending_boning)
+        field.sent = 0
+        self._pending_boning = []
+        self.score += field.take_turn() * 100
+        field.boning = None
+        chain = field.chain
+        if chain > 1: field.max_chain = max(field.max_chain, chain)
+        if chain: self.chains.append(chain)
+        self.distribute_boning(field.sent)
+
+    # Where the piece ends up when the player heads for col: there, if
+    # it can get there (see ai.plan). If not, it starts upright over the
+    # middle column, turns, and slides along the top until something's
+    # in the way.
+    def _reach(self, orient, col):
+        if (orient, col) in self._ai.reach: return orient, col
+        field = self.field
+        x = self._insrow
+        if not field.can_drop(x, orient): orient = 0
+        if col < x: step = -1
+        else: step = 1
+        while x != col and field.can_drop(x + step, orient): x += step
+        return orient, x
+
+    def enqueue(self, rows):
+        for row in rows:
+            self._pending_boning.append([(c and TickBox(c, [-1, -1]))
+                                         for c in row])
+
+    # Send what's left of what we broke, once it's cancelled any rows
+    # coming at us, to the other players.
+    def distribute_boning(self, value):
+        value = float(value) / len(self.others)
+        if value == 0: return
+        for p in self.others: p.enqueue(self.drop.multiply(value))
+
+    # What happened to this player, to send back from a worker.
+    def result(self):
+        return { "ai": self.ai_name, "char": self.char, "dead": self.dead,
+                 "score": self.score, "pieces": self.pieces,
+                 "chains": self.chains, "max_chain": self.field.max_chain,
+                 "max_gemsize": self.field.max_gemsize,
+                 "thinking": self.thinking,
+                 "table": self._ai.table.stats() }
+
+# Play one match; returns the seed and each player's result.
+def play(seed, ai1, char1, ai2, char2, combat = False, table_size = None):
+    # DropPattern and the AIs use the random module.
+    random.seed(seed)
+    seats = [Seat(0, ai1, char1, seed, combat, table_size),
+             Seat(1, ai2, char2, seed, combat, table_size)]
+    for seat in seats: seat.others = [s for s in seats if s is not seat]
+    for i in range(MAX_ROUNDS):
+        for seat in seats:
+            seat.turn()
+            if seat.dead: return seed, [s.result() for s in seats]
+    return seed, [s.result() for s in seats]
+
+def _play(args): return play(*args)
+
+# The matches to play: every pair of AIs (or an AI against itself, if
+# there's only one) on each seed, from both sides.
+def schedule(ais, chars, games, seed = 0, combat = False, table_size = None):
+    pairs = []
+    for i, a in enumerate(ais):
+        for b in ais[i + 1:]: pairs.append((a, b))
+    if not pairs: pairs = [(ais[0], ais[0])]
+    matches = []
+    for a, b in pairs:
+        for n in range(games):
+            rand = random.Random(seed + n)
+            c1, c2 = rand.choice(chars), rand.choice(chars)
+            matches.append((seed + n, a, c1, b, c2, combat, table_size))
+            matches.append((seed + n, b, c2, a, c1, combat, table_size))
+    return matches
+
+# Play all the matches, in a pool of worker processes if we can;
+# results come back in the same order as the matches.
+def run(matches, workers = None):
+    if multiprocessing is None or workers == 0:
+        return map(_play, matches)
+    pool = multiprocessing.Pool(workers)
+    try: return pool.map(_play, matches, 1)
+    finally: pool.terminate()
+
+# Ratings, by key ("ai" or "char"), from the results in order. Everyone
+# starts at 1500; a draw (nobody died) counts half.
+def elo(results, key, k = 32):
+    ratings = {}
+    for seed, (p1, p2) in results:
+        a, b = p1[key], p2[key]
+        if a == b: continue
+        ra, rb = ratings.get(a, 1500.0), ratings.get(b, 1500.0)
+        expected = 1 / (1 + 10 ** ((rb - ra) / 400.0))
+        if p1["dead"] == p2["dead"]: actual = 0.5
+        elif p2["dead"]: actual = 1.0
+        else: actual = 0.0
+        ratings[a] = ra + k * (actual - expected)
+        ratings[b] = rb - k * (actual - expected)
+    return ratings
+
+# Totals for each key ("ai" or "char"): games, wins, losses, chains
+# and thinking time.
+def totals(results, key):
+    stats = {}
+    for seed, players in results:
+        for p in players:
+            s = stats.setdefault(p[key], { "games": 0, "wins": 0,
+                                           "losses": 0, "chains": [],
+                                           "max_chain": 0, "thinking": [] })
+            s["games"] += 1
+            other = players[players[0] is p]
+            if p["dead"] and not other["dead"]: s["losses"] += 1
+            elif other["dead"] and not p["dead"]: s["wins"] += 1
+            s["chains"].extend(p["chains"])
+            s["max_chain"] = max(s["max_chain"], p["max_chain"])
+            s["thinking"].extend(p["thinking"])
+    return stats
+
+def _mean(values):
+    if values: return sum(values) / float(len(values))
+    else: return 0.0
+
+def report(results, key, title):
+    stats = totals(results, key)
+    ratings = elo(results, key)
+    rows = [(-ratings.get(name, 1500.0), name) for name in stats]
+    rows.sort()
+    print "%-16s %6s %6s %6s %6s %7s %5s %8s %8s" % (
+        title, "games", "win%", "loss%", "elo", "chain", "max",
+        "ms/move", "ms max")
+    for rating, name in rows:
+        s = stats[name]
+        thinking = s["thinking"] or [0]
+        print "%-16s %6d %6.1f %6.1f %6.0f %7.2f %5d %8.2f %8.1f" % (
+            name, s["games"], 100.0 * s["wins"] / s["games"],
+            100.0 * s["losses"] / s["games"], -rating, _mean(s["chains"]),
+            s["max_chain"], 1000 * _mean(thinking), 1000 * max(thinking))
+
+# How each AI's transposition table did, over all its games: lookups
+# and how many hit, entries thrown out to make room, and how full the
+# table got and how much memory that took, on average and at most.
+def table_report(results):
+    stats = {}
+    for seed, players in results:
+        for p in players:
+            s = stats.setdefault(p["ai"], { "hits": 0, "lookups": 0,
+                                            "evictions": 0, "entries": [],
+                                            "memory": [] })
+            table = p["table"]
+            s["hits"] += table["hits"]
+            s["lookups"] += table["hits"] + table["misses"]
+            s["evictions"] += table["evictions"]
+            s["entries"].append(table["entries"])
+            if table["memory"] is not None:
+                s["memory"].append(table["memory"])
+            s["capacity"] = table["capacity"]
+    names = stats.keys()
+    names.sort()
+    print "%-16s %9s %6s %9s %8s %8s %8s %8s" % (
+        "Table", "lookups", "hit%", "evicted", "size", "entries", "max",
+        "kB max")
+    for name in names:
+        s = stats[name]
+        print "%-16s %9d %6.1f %9d %8d %8.0f %8d %8s" % (
+            name, s["lookups"], 100.0 * s["hits"] / max(1, s["lookups"]),
+            s["evictions"], s["capacity"], _mean(s["entries"]),
+            max(s["entries"]),
+            (s["memory"] and "%d" % (max(s["memory"]) / 1024)) or "?")
+
+def main(argv):
+    from optparse import OptionParser
+    parser = OptionParser(usage = "%prog [options] AI1 AI2 ...")
+    parser.add_option("--games", type = "int", default = 10,
+                      help = "seeds for each pair of AIs (default 10)")
+    parser.add_option("--workers", type = "int", default = None,
+                      help = "processes to play in (default one per CPU, "
+                      "0 for none)")
+    parser.add_option("--seed", type = "int", default = 0,
+                      help = "first seed (default 0)")
+    parser.add_option("--combat", action = "store_true", default = False,
+                      help = "play with specials and diamonds")
+    parser.add_option("--chars", default = None,
+                      help = "characters to pick from, comma-separated "
+                      "(default all)")
+    parser.add_option("--table-size", type = "int", default = None,
+                      help = "positions each AI's transposition table "
+                      "holds (default the AI's own)")
+    options, ais = parser.parse_args(argv)
+    if not ais: parser.error("no AIs given")
+    for name in ais:
+        cls = getattr(ai, name, None)
+        if not (isinstance(cls, type) and issubclass(cls, ai.AI)):
+            parser.error("no AI called %s" % name)
+    if options.chars: chars = options.chars.split(",")
+    else: chars = characters()
+
+    matches = schedule(ais, chars, options.games, options.seed,
+                       options.combat, options.table_size)
+    start = time.time()
+    results = run(matches, options.workers)
+    print "%d matches in %.1f seconds." % (len(results), time.time() - start)
+    print
+    report(results, "ai", "AI")
+    print
+    report(results, "char", "Character")
+    print
+    table_report(results)
+
+if __name__ == "__main__": main(sys.argv[1:])
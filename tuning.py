@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# tuning.py -- tune GoodAI's numbers by self-play
+# Copyright 2009 Josh Cronemeyer <joshuacronemeyer@shellsink.com>
+# Released under the terms of the GNU GPL v2.
+__revision__ = "$Id$"
+
+# Looks for better GoodAI.WEIGHTS with a genetic algorithm: each
+# generation, every candidate set of weights plays headless matches
+# (see tournament.py) against an opponent AI, from both sides; the best
+# carry on as they are, and the rest are replaced with mixtures of the
+# better ones, with a bit of noise. Usage:
+#   tuning.py [--generations N] [--population N] [--games N]
+#             [--workers N] [--seed S] [--base AI] [--opponent AI]
+#             [--name NAME] [--profiles FILE] [--checkpoint FILE]
+#
+# After every generation the state goes to the checkpoint file, and
+# starting again with the same file carries on from there. The best
+# weights found so far are saved as a profile (see ai.load_profiles)
+# called --name, for --base to play by.
+
+import os, sys, random, time
+
+try: import cPickle as pickle
+except ImportError: import pickle
+
+import ai
+import tournament
+
+# How much each weight is nudged by when it mutates, as a fraction of
+# its default (or 1, if that's smaller).
+SPREAD = 0.25
+
+# The weights a base class plays by now.
+def defaults(base):
+    cls = getattr(ai, base)
+    weights = {}
+    for key in ai.GoodAI.WEIGHTS: weights[key] = getattr(cls, key)
+    return weights
+
+def mutate(rand, weights, start, rate = 0.3):
+    child = dict(weights)
+    for key in child:
+        if rand.random() < rate:
+            child[key] += rand.gauss(0, SPREAD * max(1, abs(start[key])))
+    return child
+
+def crossover(rand, mother, father):
+    child = {}
+    for key in mother:
+        if rand.random() < 0.5: child[key] = mother[key]
+        else: child[key] = father[key]
+    return child
+
+# Points for each candidate: 1 for each win and 1/2 for each draw,
+# over the games it played, on the seeds for this generation.
+def evaluate(population, base, opponent, games, seed, chars,
+             combat = False, workers = None):
+    matches = []
+    for i, weights in enumerate(population):
+        spec = ("Candidate%d" % i, base, weights)
+        for n in range(games):
+            rand = random.Random(seed + n)
+            c1, c2 = rand.choice(chars), rand.choice(chars)
+            matches.append((seed + n, spec, c1, opponent, c2, combat))
+            matches.append((seed + n, opponent, c2, spec, c1, combat))
+    results = tournament.run(matches, workers)
+    points = [0.0] * len(population)
+    for i, (seed, players) in enumerate(results):
+        us = players[(i % 2) == 1]
+        them = players[(i % 2) == 0]
+        if them["dead"] and not us["dead"]: points[i / (2 * games)] += 1
+        elif them["dead"] == us["dead"]: points[i / (2 * games)] += 0.5
+    return [p / (2 * games) for p in points]
+
+# The next generation: the best quarter as they are, then children of
+# two parents each picked (the better of two) from the best half.
+def breed(rand, population, points, start):
+    ranked = [(-p, i) for i, p in enumerate(points)]
+    ranked.sort()
+    ranked = [population[i] for p, i in ranked]
+    elite = max(1, len(ranked) / 4)
+    parents = ranked[:max(2, len(ranked) / 2)]
+    def pick():
+        a = rand.randrange(len(parents))
+        b = rand.randrange(len(parents))
+        return parents[min(a, b)]
+    children = ranked[:elite]
+    while len(children) < len(population):
+        children.append(mutate(rand, crossover(rand, pick(), pick()), start))
+    return children
+
+def save(filename, state):
+    f = file(filename, "wb")
+    try: pickle.dump(state, f, 2)
+    finally: f.close()
+
+def load(filename):
+    f = file(filename, "rb")
+    try: return pickle.load(f)
+    finally: f.close()
+
+def main(argv):
+    from optparse import OptionParser
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("--generations", type = "int", default = 20,
+                      help = "generations to run (default 20)")
+    parser.add_option("--population", type = "int", default = 12,
+                      help = "candidates in each generation (default 12)")
+    parser.add_option("--games", type = "int", default = 8,
+                      help = "seeds each candidate plays (default 8)")
+    parser.add_option("--workers", type = "int", default = None,
+                      help = "processes to play in (default one per CPU, "
+                      "0 for none)")
+    parser.add_option("--seed", type = "int", default = 0,
+                      help = "first seed (default 0)")
+    parser.add_option("--combat", action = "store_true", default = False,
+                      help = "play with specials and diamonds")
+    parser.add_option("--base", default = "InsaneAI",
+                      help = "AI class to tune (default InsaneAI)")
+    parser.add_option("--opponent", default = "InsaneAI",
+                      help = "AI to play against (default InsaneAI)")
+    parser.add_option("--name", default = "TunedAI",
+                      help = "profile to save the best weights as "
+                      "(default TunedAI)")
+    parser.add_option("--profiles", default = ai.PROFILES,
+                      help = "profiles file (default %default)")
+    parser.add_option("--checkpoint", default = "tuning.pickle",
+                      help = "checkpoint file (default %default)")
+    options, args = parser.parse_args(argv)
+    for name in [options.base, options.opponent]:
+        cls = getattr(ai, name, None)
+        if not (isinstance(cls, type) and issubclass(cls, ai.GoodAI)):
+            parser.error("%s isn't a kind of GoodAI" % name)
+
+    start = defaults(options.base)
+    if os.path.exists(options.checkpoint):
+        state = load(options.checkpoint)
+        print "Carrying on from generation %d." % state["generation"]
+    else:
+        rand = random.Random(options.seed)
+        population = [start]
+        while len(population) < options.population:
+            population.append(mutate(rand, start, start, 1.0))
+        state = { "generation": 0, "population": population,
+                  "rand": rand, "best": (None, start) }
+
+    chars = tournament.characters()
+    while state["generation"] < options.generations:
+        generation = state["generation"]
+        population = state["population"]
+        begun = time.time()
+        points = evaluate(population, options.base, options.opponent,
+                          options.games,
+                          options.seed + generation * options.games,
+                          chars, options.combat, options.workers)
+        best = max(points)
+        weights = population[points.index(best)]
+        if state["best"][0] is None or best >= state["best"][0]:
+            state["best"] = (best, weights)
+        print "Generation %d: best %.2f, mean %.2f (%.0f seconds)" % (
+            generation, best, sum(points) / len(points), time.time() - begun)
+
+        state["population"] = breed(state["rand"], population, points, start)
+        state["generation"] = generation + 1
+        save(options.checkpoint, state)
+        ai.save_profile(options.profiles, options.name, options.base,
+                        state["best"][1])
+
+    best, weights = state["best"]
+    print "Best (%.2f against %s):" % (best, options.opponent)
+    for key in ai.GoodAI.WEIGHTS:
+        print "  %s = %g (was %g)" % (key, weights[key], start[key])
+    print "Saved as %s in %s." % (options.name, options.profiles)
+
+if __name__ == "__main__": main(sys.argv[1:])